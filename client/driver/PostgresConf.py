@@ -14,14 +14,19 @@ from collections import OrderedDict
 
 
 def main():
-    if (len(sys.argv) != 3):
-        raise Exception("Usage: python confparser.py [Next Config] [Current Config]")
+    if (len(sys.argv) not in (3, 4)):
+        raise Exception("Usage: python confparser.py [Next Config] [Current Config] "
+                        "[Batch Index (optional)]")
 
     with open(sys.argv[1], "r") as f:
         conf = json.load(f,
                          encoding="UTF-8",
                          object_pairs_hook=OrderedDict)
-    conf = conf['recommendation']
+    if len(sys.argv) == 4 and 'recommendations' in conf:
+        # Pick one of the configurations of a batch recommendation
+        conf = conf['recommendations'][int(sys.argv[3])]
+    else:
+        conf = conf['recommendation']
     with open(sys.argv[2], "r+") as postgresqlconf:
         lines = postgresqlconf.readlines()
         settings_idx = lines.index("# Add settings for extensions here\n")
@@ -93,10 +93,13 @@ def create_database():
 
 
 @task
-def change_conf():
+def change_conf(batch_idx=None):
     next_conf = 'next_config'
     if CONF['database_type'] == 'postgres':
         cmd = 'sudo python3 PostgresConf.py {} {}'.format(next_conf, CONF['database_conf'])
+        if batch_idx is not None:
+            # apply one of the configurations of a batch recommendation
+            cmd += ' {}'.format(batch_idx)
     else:
         raise Exception("Database Type {} Not Implemented !".format(CONF['database_type']))
     local(cmd)
@@ -252,8 +255,15 @@ def lhs_samples(count=10):
     local(cmd)
 
 
-@task
-def loop():
+def _batch_size():
+    # the number of configurations in the last recommendation (a batch is
+    # recommended when RECOMMENDATION_BATCH_SIZE > 1 on the server)
+    with open('next_config', 'r') as next_conf:
+        conf = json.load(next_conf)
+    return len(conf.get('recommendations', [])) or 1
+
+
+def _run_and_upload():
 
     # free cache
     free_cache()
@@ -302,9 +312,23 @@ def loop():
     # upload result
     upload_result()
 
+
+@task
+def loop():
+
+    # run the workload on the current config and upload the result
+    _run_and_upload()
+
     # get result
     get_result()
 
+    # benchmark the other configs of a batch recommendation, the first one
+    # is applied below and benchmarked by the next loop
+    for batch_idx in range(1, _batch_size()):
+        LOG.info('Run the %s-th config of the batch', batch_idx + 1)
+        change_conf(batch_idx)
+        _run_and_upload()
+
     # change config
     change_conf()
 
@@ -0,0 +1,87 @@
+#
+# OtterTune - acquisition.py
+#
+# Copyright (c) 2017-18, Carnegie Mellon University Database Group
+#
+'''
+Acquisition functions computed from the predictions (yhat) and standard
+deviations (sigma) of a GP model. The objective is minimized, so y_best is
+the smallest observed value, and every acquisition function returns a score
+where higher is better (i.e., the candidates can be ranked by it directly).
+All functions are vectorized over the candidates.
+'''
+import numpy as np
+from scipy import special
+
+EXPECTED_IMPROVEMENT = 'ei'
+PROBABILITY_OF_IMPROVEMENT = 'pi'
+UPPER_CONFIDENCE_BOUND = 'ucb'
+
+
+def calculate_sigma_multiplier(t, ndim, bound=0.1):
+    # The exploration weight (beta) of GP-UCB for iteration t of an ndim
+    # dimensional problem
+    assert t > 0
+    assert ndim > 0
+    assert bound > 0 and bound <= 1
+    beta = 2 * np.log(ndim * (t**2) * (np.pi**2) / 6 * bound)
+    if beta > 0:
+        beta = np.sqrt(beta)
+    else:
+        beta = 1
+    return beta
+
+
+def _improvement_zscores(yhat, sigma, y_best):
+    # Returns (y_best - yhat) / sigma, which is +/-inf (or 0 if yhat equals
+    # y_best) where sigma is 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        u = (y_best - yhat) / sigma
+    return np.where(np.isnan(u), 0.0, u)
+
+
+def expected_improvement(yhat, sigma, y_best):
+    # E[max(y_best - y, 0)] for y ~ N(yhat, sigma^2)
+    u = _improvement_zscores(yhat, sigma, y_best)
+    phi1 = special.ndtr(u)
+    phi2 = (1.0 / np.sqrt(2.0 * np.pi)) * np.exp(np.square(u) * (-0.5))
+    with np.errstate(invalid='ignore'):
+        eis = sigma * (u * phi1 + phi2)
+    # With no uncertainty the improvement is deterministic
+    return np.where(sigma > 0, eis, np.maximum(y_best - yhat, 0.0))
+
+
+def probability_of_improvement(yhat, sigma, y_best):
+    # P(y < y_best) for y ~ N(yhat, sigma^2)
+    u = _improvement_zscores(yhat, sigma, y_best)
+    return special.ndtr(u)
+
+
+def upper_confidence_bound(yhat, sigma, beta):
+    # The upper confidence bound of -y, i.e., beta * sigma - yhat
+    return beta * sigma - yhat
+
+
+ACQUISITION_FUNCTIONS = (EXPECTED_IMPROVEMENT, PROBABILITY_OF_IMPROVEMENT,
+                         UPPER_CONFIDENCE_BOUND)
+
+
+def check_acquisition_functions(names):
+    for name in names:
+        if name not in ACQUISITION_FUNCTIONS:
+            raise Exception("Unknown acquisition function: {}".format(name))
+
+
+def compute_acquisitions(names, yhat, sigma, y_best, beta):
+    # Returns a dictionary mapping each of the acquisition function names to
+    # its scores for the candidates
+    check_acquisition_functions(names)
+    acquisitions = {}
+    for name in names:
+        if name == EXPECTED_IMPROVEMENT:
+            acquisitions[name] = expected_improvement(yhat, sigma, y_best)
+        elif name == PROBABILITY_OF_IMPROVEMENT:
+            acquisitions[name] = probability_of_improvement(yhat, sigma, y_best)
+        else:
+            acquisitions[name] = upper_confidence_bound(yhat, sigma, beta)
+    return acquisitions
@@ -0,0 +1,75 @@
+#
+# OtterTune - batch_selection.py
+#
+# Copyright (c) 2017-18, Carnegie Mellon University Database Group
+#
+'''
+Selection of a batch of q configurations to try in parallel from a GPRGD
+(or GPRGDNP) model. After each configuration is selected, the model is
+updated with a fantasized observation at it (see partial_fit) so that the
+next one is chosen away from it:
+
+  - kriging believer: the observation is the model's prediction there
+  - constant liar: the observation is the best (min) value observed so far
+
+The fantasy does not always move the minimum (e.g., a constant liar at the
+current minimum), so candidates that are already in the batch are skipped.
+'''
+import numpy as np
+from scipy.spatial.distance import cdist
+
+from analysis.util import get_analysis_logger
+
+LOG = get_analysis_logger(__name__)
+
+KRIGING_BELIEVER = 'kriging_believer'
+CONSTANT_LIAR = 'constant_liar'
+
+BATCH_METHODS = (KRIGING_BELIEVER, CONSTANT_LIAR)
+
+# Candidates within this (Euclidean) distance of a configuration already in
+# the batch are considered the same configuration
+MIN_DISTANCE = 1e-6
+
+
+def select_batch(model, X_samples, q, method=KRIGING_BELIEVER, ridge=0.01,
+                 min_distance=MIN_DISTANCE, **predict_kwargs):
+    # Returns the q configurations (a q x nfeats matrix, best first) and the
+    # GPRGDResult of each round. X_samples are the starting points of every
+    # round of gradient descent and predict_kwargs are passed to
+    # model.predict. Each round selects the best result that is not within
+    # min_distance of the configurations already selected; if there is
+    # none, the batch stops early (with fewer than q configurations). The
+    # model must be fitted and is modified (the fantasized observations are
+    # appended to its training data).
+    if method not in BATCH_METHODS:
+        raise Exception("Unknown batch selection method: {}".format(method))
+    if q < 1:
+        raise Exception("The batch size must be positive ({})".format(q))
+    configs = []
+    results = []
+    for i in range(q):
+        res = model.predict(X_samples, **predict_kwargs)
+        # Stable, so that the first of equal losses is preferred (as argmin)
+        idxs = np.argsort(res.minl.ravel(), kind='mergesort')
+        if configs:
+            dists = np.min(cdist(res.minl_conf[idxs], np.vstack(configs)), axis=1)
+            idxs = idxs[dists > min_distance]
+        if idxs.size == 0:
+            LOG.warning("Batch selection round %d: all the candidates are already in "
+                        "the batch, returning %d configurations", i, len(configs))
+            break
+        best_idx = idxs[0]
+        config = res.minl_conf[best_idx].reshape(1, -1)
+        configs.append(config)
+        results.append(res)
+        if i == q - 1:
+            break
+        if method == KRIGING_BELIEVER:
+            y_fantasy = np.asarray(res.ypreds[best_idx]).reshape(1, -1)
+        else:
+            y_fantasy = np.min(model.y_train, axis=0).reshape(1, -1)
+        LOG.debug("Batch selection round %d: minl=%s, fantasized y=%s",
+                  i, str(res.minl[best_idx]), str(y_fantasy))
+        model.partial_fit(config, y_fantasy, ridge=ridge)
+    return np.vstack(configs), results
@@ -0,0 +1,90 @@
+#
+# OtterTune - candidate_screening.py
+#
+# Copyright (c) 2017-18, Carnegie Mellon University Database Group
+#
+'''
+Compares the peak memory (RSS) and latency of screening a growing number of
+candidate configurations with the streaming top-k API (screen_candidates)
+and with a single predict call over the materialized candidate matrix.
+Each measurement runs in a new process, since the peak RSS of a process
+never decreases.
+
+Usage (from the server directory):
+    python -m analysis.benchmarks.candidate_screening --counts 10000 100000 1000000
+'''
+
+import argparse
+import multiprocessing
+import resource
+
+import numpy as np
+
+from analysis.acquisition import EXPECTED_IMPROVEMENT
+from analysis.gp import GPRNP
+from analysis.screening import halton_sequence, iter_halton_candidates, screen_candidates
+from analysis.util import get_analysis_logger, stopwatch
+
+LOG = get_analysis_logger(__name__)
+
+METHODS = ('streaming', 'materialized')
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def screen(method, n_candidates, n_train, n_feats, k, chunk_size, seed, results):
+    rng = np.random.RandomState(seed)
+    X_train = rng.rand(n_train, n_feats)
+    y_train = np.sin(3 * X_train).sum(axis=1).reshape(-1, 1)
+    model = GPRNP(length_scale=1.0, magnitude=1.0, batch_size=chunk_size,
+                  solver=GPRNP.SOLVER_CHOLESKY)
+    model.fit(X_train, y_train, ridge=0.01)
+    X_min, X_max = np.zeros(n_feats), np.ones(n_feats)
+    base_rss = peak_rss_mb()
+    with stopwatch() as timer:
+        if method == 'streaming':
+            chunks = iter_halton_candidates(n_candidates, X_min, X_max, chunk_size=chunk_size)
+            _, res = screen_candidates(model, chunks, k)
+            best = res.acquisitions[EXPECTED_IMPROVEMENT][0, 0]
+        else:
+            X_candidates = halton_sequence(0, n_candidates, n_feats)
+            res = model.predict(X_candidates)
+            best = np.max(res.acquisitions[EXPECTED_IMPROVEMENT])
+    results.put((peak_rss_mb(), peak_rss_mb() - base_rss, timer.elapsed_seconds, best))
+
+
+def run(counts, methods=METHODS, n_train=2000, n_feats=12, k=10, chunk_size=10000, seed=0):
+    results = []
+    for n_candidates in counts:
+        for method in methods:
+            queue = multiprocessing.Queue()
+            proc = multiprocessing.Process(target=screen, args=(
+                method, n_candidates, n_train, n_feats, k, chunk_size, seed, queue))
+            proc.start()
+            peak_rss, rss_increase, elapsed, best = queue.get()
+            proc.join()
+            results.append((n_candidates, method, peak_rss, rss_increase, elapsed))
+            LOG.info("candidates=%9d  %-12s  peak RSS=%8.1f MB (+%8.1f MB)  time=%8.3fs  "
+                     "best EI=%.6f", n_candidates, method, peak_rss, rss_increase, elapsed,
+                     best)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Candidate screening memory benchmark")
+    parser.add_argument('--counts', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--methods', nargs='+', default=list(METHODS), choices=METHODS)
+    parser.add_argument('--n-train', type=int, default=2000)
+    parser.add_argument('--n-feats', type=int, default=12)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    args = parser.parse_args()
+    run(args.counts, methods=args.methods, n_train=args.n_train, n_feats=args.n_feats,
+        k=args.k, chunk_size=args.chunk_size)
+
+
+if __name__ == "__main__":
+    main()
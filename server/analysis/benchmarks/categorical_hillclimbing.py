@@ -0,0 +1,122 @@
+#
+# OtterTune - categorical_hillclimbing.py
+#
+# Copyright (c) 2017-18, Carnegie Mellon University Database Group
+#
+'''
+Reports the latency and recommendation quality of the categorical hill
+climbing of the gradient descent models (GPRGD and GPRGDNP) for knob sets
+with several multi-valued enums, as the number of candidate flips scored per
+hill climbing step (categorical_feature_candidates) grows. The enums are
+dummy encoded and the knobs scaled as in the website. The quality is the
+loss reached by the gradient descent and the true objective value of the
+recommended configurations (lower is better).
+
+Usage (from the server directory):
+    python -m analysis.benchmarks.categorical_hillclimbing --n-values 6 5 4 3 --candidates 1 16
+'''
+
+import argparse
+
+import numpy as np
+from sklearn.preprocessing import StandardScaler
+
+from analysis.constraints import ParamConstraintHelper
+from analysis.gp import GPRGDNP
+from analysis.preprocessing import DummyEncoder
+from analysis.util import get_analysis_logger, stopwatch
+
+LOG = get_analysis_logger(__name__)
+
+
+def make_knobs(n_values, n_cont, n_train, rng):
+    # Returns the dummy encoder, the (raw) training configurations and the
+    # table of the contribution of each enum value to the objective. The
+    # enums are the first len(n_values) knobs.
+    n_cat = len(n_values)
+    encoder = DummyEncoder(n_values, np.arange(n_cat),
+                           ['enum_{}'.format(i) for i in range(n_cat)],
+                           ['knob_{}'.format(i) for i in range(n_cont)])
+    X_raw = np.hstack((np.column_stack([rng.randint(nvals, size=n_train) for nvals in n_values]),
+                       rng.rand(n_train, n_cont)))
+    encoder.fit(X_raw)
+    enum_costs = [rng.rand(nvals) for nvals in n_values]
+    return encoder, X_raw, enum_costs
+
+
+def objective(X_raw, enum_costs):
+    # The (true) metric to minimize
+    n_cat = len(enum_costs)
+    y = np.sum(np.sin(3 * X_raw[:, n_cat:]), axis=1)
+    for i, costs in enumerate(enum_costs):
+        y += 2 * costs[X_raw[:, i].astype(int)]
+    return y
+
+
+def decode(X_encoded, n_values):
+    # Returns the raw configurations of the dummy encoded ones
+    cols = []
+    start = 0
+    for nvals in n_values:
+        cols.append(np.argmax(X_encoded[:, start:start + nvals], axis=1))
+        start += nvals
+    return np.hstack((np.column_stack(cols), X_encoded[:, start:]))
+
+
+def run(n_values=(6, 5, 5, 4, 3), n_cont=8, n_train=1000, n_starts=50, max_iter=100,
+        candidates=(1, 8, 32), backends=('numpy', 'tensorflow'), seed=0):
+    rng = np.random.RandomState(seed)
+    encoder, X_raw, enum_costs = make_knobs(n_values, n_cont, n_train, rng)
+    X_scaler = StandardScaler()
+    X_train = X_scaler.fit_transform(encoder.transform(X_raw))
+    y_raw = objective(X_raw, enum_costs)
+    y_train = ((y_raw - y_raw.mean()) / y_raw.std()).reshape(-1, 1)
+    X_min, X_max = np.min(X_train, axis=0), np.max(X_train, axis=0)
+    X_start = X_train[rng.choice(n_train, n_starts, replace=False)]
+    constraint_helper = ParamConstraintHelper(X_scaler, encoder, init_flip_prob=0.3,
+                                              flip_prob_decay=0.5)
+    results = []
+    for backend in backends:
+        for n_candidates in candidates:
+            if backend == 'tensorflow':
+                # Only load TensorFlow when it is actually used
+                from analysis.gp_tf import GPRGD
+                model = GPRGD(max_iter=max_iter, gd_method=GPRGD.GD_BATCHED,
+                              loss_tol=1e-6, learning_rate=0.1)
+            else:
+                model = GPRGDNP(max_iter=max_iter, loss_tol=1e-6, learning_rate=0.1)
+            model.fit(X_train, y_train, X_min, X_max, ridge=0.1)
+            # The hill climbing is random
+            np.random.seed(seed)
+            with stopwatch() as timer:
+                res = model.predict(X_start, constraint_helper=constraint_helper,
+                                    categorical_feature_candidates=n_candidates)
+            confs = decode(X_scaler.inverse_transform(res.minl_conf), n_values)
+            y_confs = objective(confs, enum_costs)
+            results.append((backend, n_candidates, timer.elapsed_seconds, np.mean(res.minl),
+                            np.min(y_confs), np.mean(y_confs)))
+            LOG.info("%-10s candidates=%3d  predict(%d starts)=%7.3fs  mean iters=%5.1f  "
+                     "mean min loss=%.4f  recommended y=%.4f  mean y=%.4f", backend,
+                     n_candidates, n_starts, timer.elapsed_seconds, np.mean(res.n_iters),
+                     np.mean(res.minl), np.min(y_confs), np.mean(y_confs))
+    LOG.info("Best y of the training samples: %.4f", np.min(y_raw))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Categorical hill climbing benchmark")
+    parser.add_argument('--n-values', type=int, nargs='+', default=[6, 5, 5, 4, 3],
+                        help="number of values of each enum knob")
+    parser.add_argument('--n-cont', type=int, default=8)
+    parser.add_argument('--n-train', type=int, default=1000)
+    parser.add_argument('--n-starts', type=int, default=50)
+    parser.add_argument('--candidates', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--backends', nargs='+', default=['numpy', 'tensorflow'],
+                        choices=['numpy', 'tensorflow'])
+    args = parser.parse_args()
+    run(n_values=args.n_values, n_cont=args.n_cont, n_train=args.n_train,
+        n_starts=args.n_starts, candidates=args.candidates, backends=args.backends)
+
+
+if __name__ == "__main__":
+    main()
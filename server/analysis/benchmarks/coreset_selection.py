@@ -0,0 +1,105 @@
+#
+# OtterTune - coreset_selection.py
+#
+# Copyright (c) 2017-18, Carnegie Mellon University Database Group
+#
+'''
+Reports the fit time versus recommendation quality trade-off of fitting the
+GPRGDNP model on a coreset of the training samples (analysis/coreset.py)
+rather than all of them. The samples are a synthetic workload whose results
+are densely clustered around a few configurations, plus the target's own
+samples, which are always kept. The quality is measured by the RMSE of the
+model on random configurations and by the true objective value of the
+recommended configuration (lower is better).
+
+Usage (from the server directory):
+    python -m analysis.benchmarks.coreset_selection --n-train 6000 --sizes 500 1000 2000
+'''
+
+import argparse
+
+import numpy as np
+
+from analysis.coreset import CORESET_METHODS, select_coreset
+from analysis.gp import GPRNP, GPRGDNP
+from analysis.util import get_analysis_logger, stopwatch
+
+LOG = get_analysis_logger(__name__)
+
+
+def objective(X):
+    # The (true) metric to minimize
+    return np.sum(np.sin(3 * X) + 0.5 * np.square(X - 0.7), axis=1)
+
+
+def make_workload(n_train, n_target, n_feats, n_clusters, rng):
+    # 80% of the workload's samples are near duplicates of n_clusters
+    # configurations, the rest are spread uniformly
+    n_clustered = int(0.8 * n_train)
+    centers = rng.rand(n_clusters, n_feats)
+    X_clustered = centers[rng.randint(n_clusters, size=n_clustered)] + \
+        0.01 * rng.randn(n_clustered, n_feats)
+    X_workload = np.clip(np.vstack((X_clustered, rng.rand(n_train - n_clustered, n_feats))),
+                         0, 1)
+    X_target = rng.rand(n_target, n_feats)
+    # The target's samples come first (as in configuration_recommendation)
+    X_train = np.vstack((X_target, X_workload))
+    y_train = objective(X_train) + 0.05 * rng.randn(X_train.shape[0])
+    return X_train, y_train.reshape(-1, 1)
+
+
+def run(n_train=6000, sizes=(500, 1000, 2000), methods=CORESET_METHODS, n_target=20,
+        n_feats=8, n_clusters=20, n_starts=40, max_iter=100, seed=0):
+    rng = np.random.RandomState(seed)
+    X_train, y_raw = make_workload(n_train, n_target, n_feats, n_clusters, rng)
+    y_mean, y_std = y_raw.mean(), y_raw.std()
+    y_train = (y_raw - y_mean) / y_std
+    X_test = rng.rand(2000, n_feats)
+    y_test = objective(X_test)
+    X_min, X_max = np.zeros(n_feats), np.ones(n_feats)
+    X_start = rng.rand(n_starts, n_feats)
+    keep_idxs = np.arange(n_target)
+    runs = [('all', None)] + [(method, size) for size in sizes for method in methods]
+    results = []
+    for method, size in runs:
+        with stopwatch() as select_timer:
+            if size is None:
+                idxs = np.arange(X_train.shape[0])
+            else:
+                idxs = select_coreset(X_train, size, keep_idxs, method=method)
+        model = GPRGDNP(length_scale=1.0, magnitude=1.0, max_train_size=X_train.shape[0],
+                        max_iter=max_iter, solver=GPRNP.SOLVER_CHOLESKY,
+                        optimizer=GPRGDNP.OPTIMIZER_LBFGS)
+        with stopwatch() as fit_timer:
+            model.fit(X_train[idxs], y_train[idxs], X_min, X_max, ridge=0.01)
+        # RMSE of the (unscaled) predictions on random configurations
+        ypreds = GPRNP.predict(model, X_test, acquisitions=()).ypreds.ravel()
+        rmse = np.sqrt(np.mean(np.square(ypreds * y_std + y_mean - y_test)))
+        with stopwatch() as search_timer:
+            res = model.predict(X_start)
+        best_conf = res.minl_conf[np.argmin(res.minl.ravel())]
+        best_y = objective(best_conf.reshape(1, -1))[0]
+        results.append((method, idxs.shape[0], select_timer.elapsed_seconds,
+                        fit_timer.elapsed_seconds, search_timer.elapsed_seconds, rmse, best_y))
+        LOG.info("%-8s n=%5d  select=%7.3fs  fit=%7.3fs  search=%7.3fs  rmse=%.4f  "
+                 "recommended y=%.4f", method, idxs.shape[0], select_timer.elapsed_seconds,
+                 fit_timer.elapsed_seconds, search_timer.elapsed_seconds, rmse, best_y)
+    LOG.info("Best y of the training samples: %.4f", np.min(y_raw))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Coreset selection benchmark")
+    parser.add_argument('--n-train', type=int, default=6000)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[500, 1000, 2000])
+    parser.add_argument('--methods', nargs='+', default=list(CORESET_METHODS),
+                        choices=CORESET_METHODS)
+    parser.add_argument('--n-feats', type=int, default=8)
+    parser.add_argument('--n-clusters', type=int, default=20)
+    args = parser.parse_args()
+    run(n_train=args.n_train, sizes=args.sizes, methods=args.methods,
+        n_feats=args.n_feats, n_clusters=args.n_clusters)
+
+
+if __name__ == "__main__":
+    main()
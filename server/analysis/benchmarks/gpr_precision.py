@@ -0,0 +1,106 @@
+#
+# OtterTune - gpr_precision.py
+#
+# Copyright (c) 2017-18, Carnegie Mellon University Database Group
+#
+'''
+Compares the speed and accuracy of the float32 and float64 GPR models on
+synthetic workloads. The errors are relative to the float64 numpy model
+with the Cholesky solver.
+
+Usage (from the server directory):
+    python -m analysis.benchmarks.gpr_precision --sizes 1000 3000 6000
+    python -m analysis.benchmarks.gpr_precision --backends numpy tensorflow
+'''
+
+import argparse
+
+import numpy as np
+
+from analysis.gp import GPRNP
+from analysis.util import get_analysis_logger, stopwatch
+
+LOG = get_analysis_logger(__name__)
+
+DTYPES = ('float32', 'float64')
+SOLVERS = (GPRNP.SOLVER_INVERSE, GPRNP.SOLVER_CHOLESKY)
+
+
+def make_workload(n_train, n_feats, n_test, rng):
+    # A smooth (standardized) response with noise, like the scaled metrics
+    # of a tuning session. Half of the configurations are near duplicates
+    # of the other half, which makes the kernel matrix ill-conditioned.
+    n_unique = n_train // 2
+    X_unique = rng.rand(n_unique, n_feats)
+    X_dups = X_unique[:n_train - n_unique] + 1e-4 * rng.randn(n_train - n_unique, n_feats)
+    X_train = np.vstack((X_unique, X_dups))
+    y_train = np.sin(3 * X_train).sum(axis=1) + 0.05 * rng.randn(n_train)
+    y_train = ((y_train - y_train.mean()) / y_train.std()).reshape(-1, 1)
+    X_test = rng.rand(n_test, n_feats)
+    return X_train, y_train, X_test
+
+
+def create_model(backend, solver, dtype, n_train, n_test):
+    if backend == 'numpy':
+        return GPRNP(length_scale=1.0, magnitude=1.0, max_train_size=n_train,
+                     batch_size=n_test, solver=solver, dtype=dtype)
+    # Only load TensorFlow when it is benchmarked
+    from analysis.gp_tf import GPR
+    return GPR(length_scale=1.0, magnitude=1.0, max_train_size=n_train,
+               batch_size=n_test, solver=solver, dtype=dtype)
+
+
+def run(sizes, backends=('numpy',), n_feats=12, n_test=3000, ridge=0.01, seed=0):
+    rng = np.random.RandomState(seed)
+    results = []
+    for n_train in sizes:
+        X_train, y_train, X_test = make_workload(n_train, n_feats, n_test, rng)
+        reference = create_model('numpy', GPRNP.SOLVER_CHOLESKY, 'float64', n_train, n_test)
+        reference.fit(X_train, y_train, ridge=ridge)
+        ref_result = reference.predict(X_test)
+        for backend in backends:
+            for solver in SOLVERS:
+                for dtype in DTYPES:
+                    # The data is converted once (as the website tasks do)
+                    X_train_dt = X_train.astype(dtype)
+                    y_train_dt = y_train.astype(dtype)
+                    X_test_dt = X_test.astype(dtype)
+                    model = create_model(backend, solver, dtype, n_train, n_test)
+                    try:
+                        with stopwatch() as fit_timer:
+                            model.fit(X_train_dt, y_train_dt, ridge=ridge)
+                        with stopwatch() as predict_timer:
+                            res = model.predict(X_test_dt)
+                    except Exception as ex:  # pylint: disable=broad-except
+                        LOG.info("n_train=%5d  %-10s %-8s %-7s  FAILED: %s", n_train,
+                                 backend, solver, dtype, str(ex).splitlines()[0])
+                        results.append((n_train, backend, solver, dtype, None, None,
+                                        None, None))
+                        continue
+                    ypred_err = np.max(np.abs(res.ypreds - ref_result.ypreds))
+                    sigma_err = np.max(np.abs(res.sigmas - ref_result.sigmas))
+                    results.append((n_train, backend, solver, dtype,
+                                    fit_timer.elapsed_seconds,
+                                    predict_timer.elapsed_seconds, ypred_err, sigma_err))
+                    LOG.info("n_train=%5d  %-10s %-8s %-7s  fit=%7.3fs  predict(%d)=%7.3fs  "
+                             "max err: ypreds=%.2e  sigmas=%.2e", n_train, backend, solver,
+                             dtype, fit_timer.elapsed_seconds, n_test,
+                             predict_timer.elapsed_seconds, ypred_err, sigma_err)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GPR float32/float64 benchmark")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 3000, 6000])
+    parser.add_argument('--backends', nargs='+', default=['numpy'],
+                        choices=['numpy', 'tensorflow'])
+    parser.add_argument('--n-feats', type=int, default=12)
+    parser.add_argument('--n-test', type=int, default=3000)
+    parser.add_argument('--ridge', type=float, default=0.01)
+    args = parser.parse_args()
+    run(args.sizes, backends=args.backends, n_feats=args.n_feats, n_test=args.n_test,
+        ridge=args.ridge)
+
+
+if __name__ == "__main__":
+    main()
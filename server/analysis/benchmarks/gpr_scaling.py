@@ -0,0 +1,72 @@
+#
+# OtterTune - gpr_scaling.py
+#
+# Copyright (c) 2017-18, Carnegie Mellon University Database Group
+#
+'''
+Benchmarks GPR (and tree ensemble) fit/predict time against the training
+size.
+
+Usage (from the server directory):
+    python -m analysis.benchmarks.gpr_scaling --sizes 500 1000 2000 4000 7000
+    python -m analysis.benchmarks.gpr_scaling --models gp_numpy extra_trees \
+        --sizes 1000 10000 100000
+'''
+
+import argparse
+
+import numpy as np
+
+from analysis.forest import ForestNP
+from analysis.gp import GPRNP
+from analysis.gp_tf import GPR
+from analysis.util import get_analysis_logger, stopwatch
+
+LOG = get_analysis_logger(__name__)
+
+MODELS = ('gp_tf', 'gp_numpy', ForestNP.EXTRA_TREES, ForestNP.RANDOM_FOREST)
+
+
+def create_model(name, max_train_size, batch_size):
+    if name == 'gp_tf':
+        return GPR(length_scale=1.0, magnitude=1.0,
+                   max_train_size=max_train_size, batch_size=batch_size)
+    if name == 'gp_numpy':
+        return GPRNP(length_scale=1.0, magnitude=1.0, max_train_size=max_train_size,
+                     batch_size=batch_size, solver=GPRNP.SOLVER_CHOLESKY)
+    return ForestNP(ensemble=name, batch_size=batch_size)
+
+
+def run(sizes, models=('gp_tf',), n_feats=12, n_test=3000, seed=0):
+    rng = np.random.RandomState(seed)
+    X_test = rng.rand(n_test, n_feats)
+    results = []
+    for n_samples in sizes:
+        X_train = rng.rand(n_samples, n_feats)
+        y_train = rng.rand(n_samples, 1)
+        for name in models:
+            model = create_model(name, max(sizes), n_test)
+            with stopwatch() as fit_timer:
+                model.fit(X_train, y_train, ridge=1.0)
+            with stopwatch() as predict_timer:
+                model.predict(X_test)
+            results.append((n_samples, name, fit_timer.elapsed_seconds,
+                            predict_timer.elapsed_seconds))
+            LOG.info("n_train=%6d  %-13s  fit=%8.3fs  predict(%d)=%8.3fs", n_samples, name,
+                     fit_timer.elapsed_seconds, n_test, predict_timer.elapsed_seconds)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GPR fit/predict scaling benchmark")
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[500, 1000, 2000, 4000, 7000])
+    parser.add_argument('--models', nargs='+', default=['gp_tf'], choices=MODELS)
+    parser.add_argument('--n-feats', type=int, default=12)
+    parser.add_argument('--n-test', type=int, default=3000)
+    args = parser.parse_args()
+    run(args.sizes, models=args.models, n_feats=args.n_feats, n_test=args.n_test)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#
+# OtterTune - gprgd_backends.py
+#
+# Copyright (c) 2017-18, Carnegie Mellon University Database Group
+#
+'''
+Compares the latency of the tensorflow (GPRGD) and numpy (GPRGDNP)
+gradient descent backends, and of the Adam and L-BFGS-B optimizers of the
+numpy backend.
+
+Usage (from the server directory):
+    python -m analysis.benchmarks.gprgd_backends --n-train 2000 --n-starts 100
+'''
+
+import argparse
+
+import numpy as np
+
+from analysis.gp import GPRGDNP
+from analysis.gp_tf import GPRGD
+from analysis.util import get_analysis_logger, stopwatch
+
+LOG = get_analysis_logger(__name__)
+
+
+def run(n_train=2000, n_feats=12, n_starts=100, max_iter=100, n_jobs=4, seed=0):
+    rng = np.random.RandomState(seed)
+    X_train = rng.rand(n_train, n_feats)
+    y_train = np.sin(3 * X_train).sum(axis=1).reshape(-1, 1)
+    X_start = rng.rand(n_starts, n_feats)
+    X_min = np.zeros(n_feats)
+    X_max = np.ones(n_feats)
+    models = [
+        ('tensorflow/serial', GPRGD(max_iter=max_iter, gd_method=GPRGD.GD_SERIAL)),
+        ('tensorflow/batched', GPRGD(max_iter=max_iter, gd_method=GPRGD.GD_BATCHED)),
+        ('numpy', GPRGDNP(max_iter=max_iter)),
+        ('numpy/lbfgs', GPRGDNP(max_iter=max_iter, optimizer=GPRGDNP.OPTIMIZER_LBFGS)),
+        ('numpy/lbfgs/threads', GPRGDNP(max_iter=max_iter, optimizer=GPRGDNP.OPTIMIZER_LBFGS,
+                                        n_jobs=n_jobs)),
+        ('numpy/lbfgs/procs', GPRGDNP(max_iter=max_iter, optimizer=GPRGDNP.OPTIMIZER_LBFGS,
+                                      n_jobs=n_jobs, executor=GPRGDNP.EXECUTOR_PROCESS)),
+    ]
+    results = []
+    for name, model in models:
+        with stopwatch() as fit_timer:
+            model.fit(X_train, y_train, X_min, X_max, ridge=1.0)
+        with stopwatch() as predict_timer:
+            res = model.predict(X_start)
+        results.append((name, fit_timer.elapsed_seconds, predict_timer.elapsed_seconds))
+        LOG.info("%-20s  fit=%8.3fs  predict(%d starts)=%8.3fs  min loss=%.6f  "
+                 "mean loss=%.6f  mean iters=%.1f", name, fit_timer.elapsed_seconds,
+                 n_starts, predict_timer.elapsed_seconds, np.min(res.minl),
+                 np.mean(res.minl), np.mean(res.n_iters))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GPRGD backend latency benchmark")
+    parser.add_argument('--n-train', type=int, default=2000)
+    parser.add_argument('--n-jobs', type=int, default=4)
+    parser.add_argument('--n-feats', type=int, default=12)
+    parser.add_argument('--n-starts', type=int, default=100)
+    parser.add_argument('--max-iter', type=int, default=100)
+    args = parser.parse_args()
+    run(n_train=args.n_train, n_feats=args.n_feats, n_starts=args.n_starts,
+        max_iter=args.max_iter, n_jobs=args.n_jobs)
+
+
+if __name__ == "__main__":
+    main()
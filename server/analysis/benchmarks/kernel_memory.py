@@ -0,0 +1,73 @@
+#
+# OtterTune - kernel_memory.py
+#
+# Copyright (c) 2017-18, Carnegie Mellon University Database Group
+#
+'''
+Compares the peak memory and latency of building an n x n kernel matrix
+from a full distance matrix (magnitude * exp(-cdist(X, X) / length_scale),
+as the GPR models used to) and blockwise with analysis.kernels. The peak
+memory is measured with tracemalloc (numpy reports its allocations to it).
+
+Usage (from the server directory):
+    python -m analysis.benchmarks.kernel_memory --sizes 2000 4000 8000
+'''
+
+import argparse
+import tracemalloc
+
+import numpy as np
+from scipy.spatial.distance import cdist
+
+from analysis.kernels import EXPONENTIAL, KERNELS, create_kernel
+from analysis.util import get_analysis_logger, stopwatch
+
+LOG = get_analysis_logger(__name__)
+
+
+def full_distance_kernel(X, dtype):
+    K = 1.0 * np.exp(-cdist(X, X) / 1.0)
+    return K.astype(dtype, copy=False)
+
+
+def run(sizes, kernel_types=(EXPONENTIAL,), dtypes=('float64', 'float32'), n_feats=12,
+        seed=0):
+    rng = np.random.RandomState(seed)
+    results = []
+    for n_samples in sizes:
+        X = rng.rand(n_samples, n_feats)
+        methods = [('full distances', EXPONENTIAL, full_distance_kernel)]
+        for kernel_type in kernel_types:
+            kernel = create_kernel(kernel_type)
+            methods.append(('blockwise', kernel_type,
+                            lambda X, dtype, kernel=kernel: kernel(X, X, dtype=dtype)))
+        for dtype in dtypes:
+            for method, kernel_type, build in methods:
+                tracemalloc.start()
+                with stopwatch() as timer:
+                    K = build(X, dtype)
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                peak_mb = peak / 2.0 ** 20
+                result_mb = K.nbytes / 2.0 ** 20
+                del K
+                results.append((n_samples, method, kernel_type, dtype, peak_mb,
+                                timer.elapsed_seconds))
+                LOG.info("n=%5d  %-14s %-11s %-7s  peak=%8.1f MB (K=%7.1f MB)  time=%7.3fs",
+                         n_samples, method, kernel_type, dtype, peak_mb, result_mb,
+                         timer.elapsed_seconds)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Kernel construction memory benchmark")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[2000, 4000, 8000])
+    parser.add_argument('--kernels', nargs='+', default=[EXPONENTIAL],
+                        choices=sorted(KERNELS))
+    parser.add_argument('--n-feats', type=int, default=12)
+    args = parser.parse_args()
+    run(args.sizes, kernel_types=args.kernels, n_feats=args.n_feats)
+
+
+if __name__ == "__main__":
+    main()
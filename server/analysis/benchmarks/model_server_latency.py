@@ -0,0 +1,86 @@
+#
+# OtterTune - model_server_latency.py
+#
+# Copyright (c) 2017-18, Carnegie Mellon University Database Group
+#
+'''
+Measures the latency of the model server (analysis/model_server.py): a cold
+request (the model is sent, fit and cached by the server), a warm request
+(the server already has the model) and the same operation in a short-lived
+worker that fits the model itself, for GPRNP models of a growing number of
+training samples.
+
+Usage (from the server directory):
+    python -m analysis.benchmarks.model_server_latency --sizes 1000 2000 4000
+'''
+
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+
+from analysis.gp import GPRNP
+from analysis.model_server import ModelClient, ModelServer, run_operation
+from analysis.model_store import model_key
+from analysis.util import get_analysis_logger, stopwatch
+
+LOG = get_analysis_logger(__name__)
+
+
+def run(sizes=(1000, 2000, 4000), n_feats=20, n_test=100, n_warm=10, seed=0):
+    rng = np.random.RandomState(seed)
+    root = tempfile.mkdtemp()
+    address = os.path.join(root, 'models.sock')
+    server = ModelServer(address, authkey=b'benchmark')
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    while server.listener is None:
+        thread.join(0.01)
+    client = ModelClient(address, authkey=b'benchmark')
+    results = []
+    try:
+        for n_samples in sizes:
+            X_train = rng.rand(n_samples, n_feats)
+            y_train = rng.randn(n_samples, 1)
+            X_test = rng.rand(n_test, n_feats)
+            fit_args = (X_train, y_train)
+            model = GPRNP(length_scale=1.0, magnitude=1.0)
+            key = (0, n_samples, model_key(model, fit_args, 0.01))
+            with stopwatch() as local_timer:
+                run_operation(GPRNP(length_scale=1.0, magnitude=1.0).fit(
+                    *fit_args, ridge=0.01), 'predict', X_test)
+            with stopwatch() as cold_timer:
+                client.call(key, 'predict', args=(X_test,), model=model,
+                            fit_args=fit_args, ridge=0.01)
+            with stopwatch() as warm_timer:
+                for _ in range(n_warm):
+                    client.call(key, 'predict', args=(X_test,))
+            warm_seconds = warm_timer.elapsed_seconds / n_warm
+            results.append((n_samples, local_timer.elapsed_seconds,
+                            cold_timer.elapsed_seconds, warm_seconds))
+            LOG.info("samples=%6d  local fit+predict=%.3fs  cold=%.3fs  warm=%.4fs",
+                     n_samples, local_timer.elapsed_seconds, cold_timer.elapsed_seconds,
+                     warm_seconds)
+        LOG.info("Model server stats: %s", str(client.stats()))
+    finally:
+        client.shutdown()
+        thread.join()
+        shutil.rmtree(root)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Model server latency benchmark")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 2000, 4000])
+    parser.add_argument('--n-feats', type=int, default=20)
+    parser.add_argument('--n-test', type=int, default=100)
+    args = parser.parse_args()
+    run(sizes=args.sizes, n_feats=args.n_feats, n_test=args.n_test)
+
+
+if __name__ == "__main__":
+    main()
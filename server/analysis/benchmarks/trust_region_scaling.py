@@ -0,0 +1,114 @@
+#
+# OtterTune - trust_region_scaling.py
+#
+# Copyright (c) 2017-18, Carnegie Mellon University Database Group
+#
+'''
+Compares global and trust region (analysis/trust_region.py) optimization in
+a simulated tuning session as the number of knobs grows. Each session starts
+with the samples of a (mapped) workload and a few random target samples and
+then makes one recommendation per iteration, which is "benchmarked" with a
+synthetic objective and added to the training data, as in the website. The
+global mode fits GPRGDNP on all samples and searches the whole knob space;
+the trust region mode fits it on the samples in the region around the best
+target configuration (at least --min-samples and at most --max-samples, the
+closest to it) and only searches the region. Reports the mean time per
+recommendation and the best objective value found (lower is better).
+
+Usage (from the server directory):
+    python -m analysis.benchmarks.trust_region_scaling --dims 10 30 50 --n-iters 20
+'''
+
+import argparse
+
+import numpy as np
+
+from analysis.gp import GPRGDNP
+from analysis.trust_region import TrustRegion, select_local_samples
+from analysis.util import get_analysis_logger, stopwatch
+
+LOG = get_analysis_logger(__name__)
+
+GLOBAL = 'global'
+TRUST_REGION = 'trust_region'
+
+
+def objective(X):
+    # The (true) metric to minimize: a Levy-like function of the knobs in
+    # [0, 1], with its minimum (0) at 0.3 and many local minima
+    w = 1 + (X - 0.3) * 2.5
+    return np.mean(np.square(w - 1) * (1 + 2 * np.square(np.sin(np.pi * w + 1))), axis=1)
+
+
+def run_session(mode, n_feats, n_workload, n_init, n_iters, n_starts, min_samples,
+                max_samples, rng):
+    X_workload = rng.rand(n_workload, n_feats)
+    X_target = rng.rand(n_init, n_feats)
+    y_target = objective(X_target)
+    X_min, X_max = np.zeros(n_feats), np.ones(n_feats)
+    region = TrustRegion(failure_tolerance=max(4, n_feats // 5)).fit_history(y_target)
+    times = []
+    train_sizes = []
+    for _ in range(n_iters):
+        with stopwatch() as timer:
+            X_train = np.vstack((X_target, X_workload))
+            y_train = objective(X_train)
+            lower, upper = X_min, X_max
+            if mode == TRUST_REGION:
+                x_center = X_target[np.argmin(y_target)]
+                lower, upper = region.bounds(x_center, X_min, X_max)
+                idxs = select_local_samples(X_train, x_center, lower, upper,
+                                            min_samples=min_samples,
+                                            max_samples=max_samples)
+                X_train, y_train = X_train[idxs], y_train[idxs]
+            y_scaled = (y_train - y_train.mean()) / y_train.std()
+            model = GPRGDNP(length_scale=np.sqrt(n_feats) / 2, magnitude=1.0,
+                            max_train_size=X_train.shape[0], max_iter=50, loss_tol=1e-6,
+                            learning_rate=0.05)
+            model.fit(X_train, y_scaled.reshape(-1, 1), lower, upper, ridge=0.01)
+            X_start = lower + rng.rand(n_starts, n_feats) * (upper - lower)
+            res = model.predict(X_start)
+            config = res.minl_conf[np.argmin(res.minl.ravel())].reshape(1, -1)
+        y_new = objective(config)[0]
+        region.update(y_new)
+        X_target = np.vstack((X_target, config))
+        y_target = np.append(y_target, y_new)
+        times.append(timer.elapsed_seconds)
+        train_sizes.append(X_train.shape[0])
+    return np.mean(times), np.mean(train_sizes), np.min(y_target), region
+
+
+def run(dims=(10, 30, 50), modes=(GLOBAL, TRUST_REGION), n_workload=3000, n_init=10,
+        n_iters=20, n_starts=50, min_samples=500, max_samples=1000, seed=0):
+    results = []
+    for n_feats in dims:
+        for mode in modes:
+            # Every mode starts from the same samples
+            rng = np.random.RandomState(seed)
+            mean_time, mean_size, y_best, region = run_session(
+                mode, n_feats, n_workload, n_init, n_iters, n_starts, min_samples,
+                max_samples, rng)
+            results.append((n_feats, mode, mean_time, mean_size, y_best))
+            LOG.info("knobs=%3d  %-12s  time/recommendation=%7.3fs  train size=%7.1f  "
+                     "best y=%.4f%s", n_feats, mode, mean_time, mean_size, y_best,
+                     "  ({})".format(region) if mode == TRUST_REGION else "")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Trust region scaling benchmark")
+    parser.add_argument('--dims', type=int, nargs='+', default=[10, 30, 50])
+    parser.add_argument('--modes', nargs='+', default=[GLOBAL, TRUST_REGION],
+                        choices=[GLOBAL, TRUST_REGION])
+    parser.add_argument('--n-workload', type=int, default=3000)
+    parser.add_argument('--n-iters', type=int, default=20)
+    parser.add_argument('--n-starts', type=int, default=50)
+    parser.add_argument('--min-samples', type=int, default=500)
+    parser.add_argument('--max-samples', type=int, default=1000)
+    args = parser.parse_args()
+    run(dims=args.dims, modes=args.modes, n_workload=args.n_workload, n_iters=args.n_iters,
+        n_starts=args.n_starts, min_samples=args.min_samples, max_samples=args.max_samples)
+
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,7 @@ Created on Jul 4, 2016
 '''
 from abc import ABCMeta, abstractproperty
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
 import os
 import json
@@ -20,6 +21,7 @@ import matplotlib.pyplot as plt
 from scipy.spatial.distance import cdist
 from sklearn.metrics import silhouette_score
 from sklearn.cluster import KMeans as SklearnKMeans
+from sklearn.utils import check_random_state
 from celery.utils.log import get_task_logger
 
 from .base import ModelBase
@@ -419,7 +421,7 @@ class GapStatistic(KSelection):
         self.log_wkbs_ = None
         self.khats_ = None
 
-    def fit(self, X, cluster_map, n_b=50):
+    def fit(self, X, cluster_map, n_b=50, n_jobs=1, random_state=None):
         """Estimates the optimal number of clusters (K) for a
            KMeans model trained on X.
 
@@ -435,6 +437,17 @@ class GapStatistic(KSelection):
         n_B : int
               The number of reference data sets to generate
 
+        n_jobs : int
+                 The number of processes the reference data sets are split
+                 among (the results do not depend on it)
+
+        random_state : int, RandomState or None
+                       Seeds the reference data sets. With None the n_b
+                       per-data-set seeds are drawn from the global numpy
+                       random state (np.random), so the results vary between
+                       runs unless np.random is seeded beforehand. Pass an int
+                       for reproducible results.
+
 
         Returns
         -------
@@ -443,26 +456,32 @@ class GapStatistic(KSelection):
         self._reset()
         mins, maxs = GapStatistic.bounding_box(X)
         n_clusters = len(cluster_map)
+        cluster_sizes = sorted(cluster_map.keys())
 
         # Dispersion for real distribution
         log_wks = np.zeros(n_clusters)
-        log_wkbs = np.zeros(n_clusters)
-        sk = np.zeros(n_clusters)
-        for indk, (K, model) in enumerate(sorted(cluster_map.items())):
+        for indk, K in enumerate(cluster_sizes):
 
             # Computes Wk: the within-dispersion of each cluster size (k)
-            log_wks[indk] = np.log(model.cluster_inertia_ / (2.0 * K))
-
-            # Create B reference datasets
-            log_bwkbs = np.zeros(n_b)
-            for i in range(n_b):
-                Xb = np.empty_like(X)
-                for j in range(X.shape[1]):
-                    Xb[:, j] = np.random.uniform(mins[j], maxs[j], size=X.shape[0])
-                Xb_model = KMeans().fit(Xb, K)
-                log_bwkbs[i] = np.log(Xb_model.cluster_inertia_ / (2.0 * K))
-            log_wkbs[indk] = sum(log_bwkbs) / n_b
-            sk[indk] = np.sqrt(sum((log_bwkbs - log_wkbs[indk]) ** 2) / n_b)
+            log_wks[indk] = np.log(cluster_map[K].cluster_inertia_ / (2.0 * K))
+
+        # Each of the B reference data sets is generated once (from its own
+        # seed) and clustered for every K, so the reference dispersions do
+        # not depend on how the data sets are split among the workers
+        seeds = check_random_state(random_state).randint(np.iinfo(np.int32).max, size=n_b)
+        n_jobs = min(n_jobs, n_b)
+        if n_jobs <= 1:
+            log_bwkbs = [reference_log_dispersions(X.shape, mins, maxs, cluster_sizes, seed)
+                         for seed in seeds]
+        else:
+            with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+                log_bwkbs = list(pool.map(reference_log_dispersions, [X.shape] * n_b,
+                                          [mins] * n_b, [maxs] * n_b,
+                                          [cluster_sizes] * n_b, seeds))
+        # Shape: (n_b, n_clusters)
+        log_bwkbs = np.array(log_bwkbs)
+        log_wkbs = np.mean(log_bwkbs, axis=0)
+        sk = np.sqrt(np.mean((log_bwkbs - log_wkbs) ** 2, axis=0))
         sk = sk * np.sqrt(1 + 1.0 / n_b)
 
         khats = np.zeros(n_clusters)
@@ -768,6 +787,40 @@ class Silhouette(KSelection):
         plt.close()
 
 
+def reference_log_dispersions(shape, mins, maxs, cluster_sizes, seed):
+    """Generates a reference data set for the gap statistic and computes its
+       within-dispersion (log) for each cluster size. This is a module-level
+       function so that it can be run in a process pool.
+
+    Parameters
+    ----------
+    shape : tuple
+            The shape (n_samples, n_features) of the reference data set.
+
+    mins, maxs : array-like, shape (n_features)
+                 The bounding box the reference data set is sampled from
+                 (uniformly).
+
+    cluster_sizes : list
+                    The cluster sizes (K) to fit KMeans models for.
+
+    seed : int
+           Seeds both the reference data set and the KMeans models.
+
+
+    Returns
+    -------
+    The log within-dispersion of each cluster size, array [n_clusters]
+    """
+    rng = np.random.RandomState(seed)
+    Xb = rng.uniform(mins, maxs, size=shape)
+    log_wkbs = np.zeros(len(cluster_sizes))
+    for indk, K in enumerate(cluster_sizes):
+        Xb_model = KMeans().fit(Xb, K, estimator_params={'random_state': seed})
+        log_wkbs[indk] = np.log(Xb_model.cluster_inertia_ / (2.0 * K))
+    return log_wkbs
+
+
 def create_kselection_model(model_name):
     """Constructs the KSelection model object with the given name
 
@@ -113,3 +113,44 @@ class ParamConstraintHelper(object):
 
         conv_sample = self._handle_rescaling(conv_sample, rescale)
         return conv_sample
+
+    def randomize_categorical_features_batch(self, samples, n_candidates=1, scaled=True,
+                                             rescale=True):
+        # Returns n_candidates random flips of the categorical features of
+        # each row of samples at once: row i * n_candidates + j is candidate j
+        # of sample i. The flips are drawn as in randomize_categorical_features
+        # (at least one feature is flipped), but the scaling and the flips are
+        # vectorized over all of the candidates.
+        samples = np.atleast_2d(np.asarray(samples, dtype=float))
+        candidates = np.repeat(samples, n_candidates, axis=0)
+        if not self.is_dummy_encoded_:
+            return candidates
+        n_values = self.encoder_.n_values_
+        cat_start_indices = self.encoder_.feature_indices_
+        n_cat_feats = len(n_values)
+        n_rows = candidates.shape[0]
+
+        if scaled:
+            candidates = self.scaler_.inverse_transform(candidates)
+
+        # Always flip one categorical feature and the rest with decreasing
+        # probability, then shuffle the flips of each candidate
+        flips = np.zeros((n_rows, n_cat_feats), dtype=bool)
+        flips[:, 0] = True
+        flip_probs = self.init_flip_prob_ * self.flip_prob_decay_ ** np.arange(n_cat_feats - 1)
+        flips[:, 1:] = np.random.rand(n_rows, n_cat_feats - 1) <= flip_probs
+        flip_shuffle_indices = np.argsort(np.random.rand(n_rows, n_cat_feats), axis=1)
+        flips = flips[np.arange(n_rows)[:, np.newaxis], flip_shuffle_indices]
+
+        for i, nvals in enumerate(n_values):
+            start_idx = cat_start_indices[i]
+            rows = np.flatnonzero(flips[:, i])
+            current_vals = np.argmax(candidates[rows, start_idx: start_idx + nvals], axis=1)
+            # A value other than the current one, chosen uniformly
+            new_vals = (current_vals + np.random.randint(1, nvals, size=rows.shape[0])) % nvals
+            candidates[rows, start_idx: start_idx + nvals] = 0
+            candidates[rows, start_idx + new_vals] = 1
+
+        if rescale:
+            candidates = self.scaler_.transform(candidates)
+        return candidates
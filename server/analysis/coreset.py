@@ -0,0 +1,75 @@
+#
+# OtterTune - coreset.py
+#
+# Copyright (c) 2017-18, Carnegie Mellon University Database Group
+#
+'''
+Selection of a bounded, representative subset (coreset) of the training
+samples of a GPR model. Densely clustered (near duplicate) configurations
+inflate the training size, and the O(n^3) fit, without adding much
+information, so the coreset covers the configuration space as evenly as
+possible.
+'''
+import numpy as np
+from scipy.spatial.distance import cdist
+
+from analysis.util import get_analysis_logger
+
+LOG = get_analysis_logger(__name__)
+
+KCENTER = 'kcenter'
+RANDOM = 'random'
+
+CORESET_METHODS = (KCENTER, RANDOM)
+
+
+def kcenter_greedy(X, size, keep_idxs=(), random_state=0):
+    # Returns the indices of size rows of X selected with the greedy
+    # k-center algorithm: the rows in keep_idxs are selected first, and then
+    # each step selects the row farthest from all of the rows selected so
+    # far. The max distance of any row to its nearest selected row is within
+    # a factor of 2 of the optimal one. Takes O(n size) time and O(n) memory.
+    n_samples = X.shape[0]
+    selected = np.zeros(n_samples, dtype=bool)
+    min_dists = np.ones(n_samples) * np.inf
+    order = list(np.unique(np.asarray(keep_idxs, dtype=int)))
+    if not order:
+        order = [np.random.RandomState(random_state).randint(n_samples)]
+    for start in range(0, len(order), 1000):
+        idxs = order[start:start + 1000]
+        selected[idxs] = True
+        min_dists = np.minimum(min_dists, np.min(cdist(X[idxs], X), axis=0))
+    while len(order) < size:
+        candidate_dists = np.where(selected, -1.0, min_dists)
+        idx = int(np.argmax(candidate_dists))
+        order.append(idx)
+        selected[idx] = True
+        min_dists = np.minimum(min_dists, cdist(X[idx:idx + 1], X)[0])
+    return np.array(order)
+
+
+def select_coreset(X, size, keep_idxs=(), method=KCENTER, random_state=0):
+    # Returns the (sorted) indices of a subset of at most size rows of X
+    # that includes the rows in keep_idxs. If there are more than size rows
+    # in keep_idxs, they are all returned. 'random' selects the other rows
+    # uniformly at random.
+    if method not in CORESET_METHODS:
+        raise Exception("Unknown coreset method: {}".format(method))
+    if size < 1:
+        raise Exception("The coreset size must be positive ({})".format(size))
+    n_samples = X.shape[0]
+    keep_idxs = np.unique(np.asarray(keep_idxs, dtype=int))
+    if n_samples <= size:
+        return np.arange(n_samples)
+    if keep_idxs.shape[0] >= size:
+        return keep_idxs
+    if method == KCENTER:
+        idxs = kcenter_greedy(X, size, keep_idxs, random_state)
+    else:
+        rng = np.random.RandomState(random_state)
+        others = np.setdiff1d(np.arange(n_samples), keep_idxs)
+        idxs = np.concatenate((keep_idxs, rng.choice(others, size - keep_idxs.shape[0],
+                                                     replace=False)))
+    LOG.debug("Selected a coreset of %d of %d samples (%s)", idxs.shape[0], n_samples,
+              method)
+    return np.sort(idxs)
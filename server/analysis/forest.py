@@ -0,0 +1,239 @@
+#
+# OtterTune - forest.py
+#
+# Copyright (c) 2017-18, Carnegie Mellon University Database Group
+#
+'''
+Tree-ensemble (extra trees / random forest) surrogate models with the same
+interface as the numpy GPR models: ForestNP can replace GPRNP and
+ForestSearchNP can replace GPRGDNP. The predicted mean and variance of a
+configuration are the mean and variance of the predictions of the trees.
+Training takes O(n log n) time per tree, so unlike the GPR models there is
+no limit on the number of training samples.
+'''
+import numpy as np
+from sklearn.ensemble import ExtraTreesRegressor, RandomForestRegressor
+
+from analysis.acquisition import (EXPECTED_IMPROVEMENT, calculate_sigma_multiplier,
+                                  check_acquisition_functions, compute_acquisitions)
+from analysis.gp import GPRResult, GPRGDResult, hillclimb_categorical_features
+from analysis.util import deadline_passed, get_analysis_logger
+
+LOG = get_analysis_logger(__name__)
+
+
+class ForestNP(object):
+
+    EXTRA_TREES = 'extra_trees'
+    RANDOM_FOREST = 'random_forest'
+
+    # Lower bound on the predictive variance
+    MIN_VARIANCE = 1e-12
+
+    def __init__(self, ensemble=EXTRA_TREES, n_estimators=100, min_samples_leaf=1,
+                 max_features=1.0, batch_size=3000, n_jobs=1, random_state=0,
+                 check_numerics=True):
+        if ensemble not in (ForestNP.EXTRA_TREES, ForestNP.RANDOM_FOREST):
+            raise Exception("Unknown tree ensemble: {}".format(ensemble))
+        self.ensemble = ensemble
+        self.n_estimators = n_estimators
+        self.min_samples_leaf = min_samples_leaf
+        self.max_features = max_features
+        self.batch_size_ = batch_size
+        self.n_jobs = n_jobs
+        self.random_state = random_state
+        self.check_numerics = check_numerics
+        self.X_train = None
+        self.y_train = None
+        self.y_best = None
+        self.forest_ = None
+
+    def __repr__(self):
+        rep = ""
+        for k, v in sorted(self.__dict__.items()):
+            rep += "{} = {}\n".format(k, v)
+        return rep
+
+    def __str__(self):
+        return self.__repr__()
+
+    def check_fitted(self):
+        if self.X_train is None or self.y_train is None or self.forest_ is None:
+            raise Exception("The model must be trained before making predictions!")
+
+    def fit(self, X_train, y_train, ridge=None):
+        # ridge is accepted for compatibility with GPRNP and ignored
+        from sklearn.utils.validation import check_X_y
+
+        X_train, y_train = check_X_y(X_train, y_train, multi_output=True,
+                                     y_numeric=True, estimator="ForestNP")
+        if X_train.ndim != 2 or y_train.ndim != 2:
+            raise Exception("X_train or y_train should have 2 dimensions! X_dim:{}, y_dim:{}"
+                            .format(X_train.ndim, y_train.ndim))
+        if self.ensemble == ForestNP.EXTRA_TREES:
+            forest_cls = ExtraTreesRegressor
+        else:
+            forest_cls = RandomForestRegressor
+        self.forest_ = forest_cls(n_estimators=self.n_estimators,
+                                  min_samples_leaf=self.min_samples_leaf,
+                                  max_features=self.max_features,
+                                  n_jobs=self.n_jobs,
+                                  random_state=self.random_state)
+        # A single output is passed as a 1D array (as sklearn expects)
+        self.forest_.fit(X_train, y_train.ravel() if y_train.shape[1] == 1 else y_train)
+        self.X_train = X_train
+        self.y_train = y_train
+        self.y_best = np.min(y_train, axis=0)
+        return self
+
+    def partial_fit(self, X_new, y_new, ridge=None):
+        # The trees cannot be updated incrementally, so the model is refit
+        # on all of the data
+        if self.X_train is None:
+            return ForestNP.fit(self, X_new, y_new, ridge)
+        return ForestNP.fit(self, np.vstack((self.X_train, X_new)),
+                            np.vstack((self.y_train, y_new)), ridge)
+
+    def predict_mean_var(self, X):
+        # Returns the mean and variance (over the trees) of the predictions
+        # of each row of X, with one column per output
+        n_outputs = self.y_train.shape[1]
+        tree_preds = np.empty((len(self.forest_.estimators_), X.shape[0], n_outputs))
+        for i, tree in enumerate(self.forest_.estimators_):
+            tree_preds[i] = tree.predict(X).reshape(X.shape[0], n_outputs)
+        mean = np.mean(tree_preds, axis=0)
+        var = np.maximum(np.var(tree_preds, axis=0), ForestNP.MIN_VARIANCE)
+        return mean, var
+
+    def predict(self, X_test, acquisitions=(EXPECTED_IMPROVEMENT,), beta=None):
+        # Same as GPRNP.predict, except that each output has its own sigmas
+        self.check_fitted()
+        if X_test.ndim != 2:
+            raise Exception("X_test should have 2 dimensions! X_dim:{}"
+                            .format(X_test.ndim))
+        check_acquisition_functions(acquisitions)
+        from sklearn.utils.validation import check_array
+        X_test = check_array(X_test, estimator="ForestNP")
+        if beta is None:
+            beta = calculate_sigma_multiplier(t=self.X_train.shape[0],
+                                              ndim=self.X_train.shape[1])
+        test_size = X_test.shape[0]
+        n_outputs = self.y_train.shape[1]
+        yhats = np.zeros([test_size, n_outputs])
+        sigmas = np.zeros([test_size, n_outputs])
+        acq_scores = {name: np.zeros([test_size, n_outputs]) for name in acquisitions}
+        for arr_offset in range(0, test_size, self.batch_size_):
+            end_offset = min(arr_offset + self.batch_size_, test_size)
+            yhat, var = self.predict_mean_var(X_test[arr_offset:end_offset])
+            sigma = np.sqrt(var)
+            yhats[arr_offset:end_offset] = yhat
+            sigmas[arr_offset:end_offset] = sigma
+            batch_scores = compute_acquisitions(acquisitions, yhat, sigma, self.y_best, beta)
+            for name, scores in batch_scores.items():
+                acq_scores[name][arr_offset:end_offset] = scores
+        if self.check_numerics:
+            ForestNP.check_output(yhats)
+            ForestNP.check_output(sigmas)
+        return GPRResult(yhats, sigmas, acq_scores)
+
+    @staticmethod
+    def check_output(X):
+        finite_els = np.isfinite(X)
+        if not np.all(finite_els):
+            raise Exception("Input contains non-finite values: {}"
+                            .format(X[~finite_els]))
+
+
+# Tree ensembles are piecewise constant, so instead of gradient descent the
+# loss (mu_multiplier * yhat - sigma_multiplier * sigma) is minimized with a
+# randomized local search: each iteration moves every starting point by a
+# gaussian step (scaled by step_size * (X_max - X_min)) and keeps the moves
+# that lower its loss.
+class ForestSearchNP(ForestNP):
+
+    def __init__(self, ensemble=ForestNP.EXTRA_TREES, n_estimators=100, min_samples_leaf=1,
+                 max_features=1.0, batch_size=3000, n_jobs=1, random_state=0,
+                 check_numerics=True, max_iter=100, step_size=0.1, patience=10,
+                 sigma_multiplier=3.0, mu_multiplier=1.0, debug=False):
+        super(ForestSearchNP, self).__init__(ensemble=ensemble,
+                                             n_estimators=n_estimators,
+                                             min_samples_leaf=min_samples_leaf,
+                                             max_features=max_features,
+                                             batch_size=batch_size,
+                                             n_jobs=n_jobs,
+                                             random_state=random_state,
+                                             check_numerics=check_numerics)
+        self.max_iter = max_iter
+        self.step_size = step_size
+        self.patience = patience
+        self.sigma_multiplier = sigma_multiplier
+        self.mu_multiplier = mu_multiplier
+        self.debug = debug
+        self.X_min = None
+        self.X_max = None
+
+    def fit(self, X_train, y_train, X_min, X_max, ridge=None):  # pylint: disable=arguments-differ
+        super(ForestSearchNP, self).fit(X_train, y_train, ridge)
+        self.X_min = np.asarray(X_min, dtype=float)
+        self.X_max = np.asarray(X_max, dtype=float)
+        return self
+
+    def objective(self, X):
+        # Returns yhat, sigma and the loss of each row of X (the first output)
+        mean, var = self.predict_mean_var(X)
+        yhat = mean[:, 0]
+        sigma = np.sqrt(var[:, 0])
+        return yhat, sigma, self.mu_multiplier * yhat - self.sigma_multiplier * sigma
+
+    def predict(self, X_test, constraint_helper=None,  # pylint: disable=arguments-differ
+                categorical_feature_method='hillclimbing',
+                categorical_feature_steps=3,
+                categorical_feature_candidates=1, deadline=None):
+        # Stops the search once the deadline (a time.time() timestamp) has
+        # passed and returns the best configurations found so far
+        self.check_fitted()
+        if X_test.ndim != 2:
+            raise Exception("X_test should have 2 dimensions! X_dim:{}"
+                            .format(X_test.ndim))
+        if constraint_helper is not None and categorical_feature_method != 'hillclimbing':
+            raise Exception("Unknown categorial feature method: {}".format(
+                categorical_feature_method))
+        rng = np.random.RandomState(self.random_state)
+        xt = np.clip(np.array(X_test, dtype=float), self.X_min, self.X_max)
+        if constraint_helper is not None:
+            xt = np.array([constraint_helper.apply_constraints(x) for x in xt])
+        yhat, sigma, minl = self.objective(xt)
+        n_iter = np.ones(xt.shape[0]) * self.max_iter
+        stalls = np.zeros(xt.shape[0], dtype=int)
+        active = np.ones(xt.shape[0], dtype=bool)
+        scale = self.step_size * (self.X_max - self.X_min)
+        for step in range(1, self.max_iter + 1):
+            if deadline_passed(deadline):
+                n_iter[active] = step - 1
+                break
+            new_xt = np.clip(xt + rng.randn(*xt.shape) * scale, self.X_min, self.X_max)
+            if constraint_helper is not None:
+                new_xt = np.array([constraint_helper.apply_constraints(x) for x in new_xt])
+                if step % categorical_feature_steps == 0:
+                    new_xt = hillclimb_categorical_features(
+                        lambda X: self.objective(X)[2], new_xt, constraint_helper,
+                        categorical_feature_candidates)
+            new_yhat, new_sigma, new_loss = self.objective(new_xt)
+            improved = (new_loss < minl) & active
+            xt[improved] = new_xt[improved]
+            yhat[improved] = new_yhat[improved]
+            sigma[improved] = new_sigma[improved]
+            minl[improved] = new_loss[improved]
+            stalls = np.where(improved, 0, stalls + 1)
+            converged = active & (stalls >= self.patience)
+            n_iter[converged] = step
+            active &= ~converged
+            if self.debug is True:
+                LOG.info("Iter %d: min loss %s", step, str(minl))
+            if not np.any(active):
+                break
+        if self.check_numerics:
+            ForestNP.check_output(minl)
+            ForestNP.check_output(xt)
+        return GPRGDResult(yhat.reshape(-1, 1), sigma.reshape(-1, 1), minl.reshape(-1, 1),
+                           xt, n_iter.reshape(-1, 1))
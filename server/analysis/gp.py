@@ -8,31 +8,262 @@ Created on Feb 18, 2018
 
 @author: Bohan Zhang
 '''
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
 import numpy as np
-from scipy.spatial.distance import cdist as ed
-from scipy import special
-from analysis.gp_tf import GPRResult
+from scipy.linalg import cho_solve, solve_triangular
+from scipy.optimize import minimize
+from analysis.acquisition import (EXPECTED_IMPROVEMENT, calculate_sigma_multiplier,
+                                  check_acquisition_functions, compute_acquisitions)
+from analysis.kernels import (EXPONENTIAL, check_kernel_type, create_kernel,
+                              iter_dist_blocks)
+from analysis.util import deadline_passed, get_analysis_logger
+
+LOG = get_analysis_logger(__name__)
+
+
+class GPRResult(object):
+
+    def __init__(self, ypreds=None, sigmas=None, acquisitions=None):
+        self.ypreds = ypreds
+        self.sigmas = sigmas
+        # Maps acquisition function names (see analysis.acquisition) to
+        # their scores for each prediction
+        self.acquisitions = acquisitions
+
+
+class GPRGDResult(GPRResult):
+
+    def __init__(self, ypreds=None, sigmas=None,
+                 minl=None, minl_conf=None, n_iters=None):
+        super(GPRGDResult, self).__init__(ypreds, sigmas)
+        self.minl = minl
+        self.minl_conf = minl_conf
+        self.n_iters = n_iters
+
+
+def check_dtype(dtype):
+    # Returns dtype as a numpy dtype. The GP models support float32 and float64.
+    dtype = np.dtype(dtype)
+    if dtype not in (np.float32, np.float64):
+        raise Exception("Unsupported dtype: {} (must be float32 or float64)".format(dtype))
+    return dtype
+
+
+def cholesky_with_jitter(K, max_jitter_tries=5, init_jitter=1e-6):
+    # Returns the lower Cholesky factor of K and the diagonal jitter that
+    # was needed to compute it. If K is not numerically positive definite
+    # then a jitter of init_jitter * mean(diag(K)) is added to the diagonal
+    # and increased tenfold on each of the (at most max_jitter_tries) retries.
+    jitter = 0.0
+    scale = np.mean(np.diag(K))
+    for i in range(max_jitter_tries + 1):
+        try:
+            if jitter == 0.0:
+                return np.linalg.cholesky(K), jitter
+            return np.linalg.cholesky(K + jitter * np.eye(K.shape[0], dtype=K.dtype)), jitter
+        except np.linalg.LinAlgError:
+            jitter = init_jitter * scale * 10 ** i
+            LOG.warning("Cholesky decomposition failed, retrying with jitter=%s", jitter)
+    raise Exception("Cholesky decomposition failed after {} retries (jitter={})"
+                    .format(max_jitter_tries, jitter))
+
+
+def cholesky_append(K_chol, K_cross, K_new):
+    # Returns the lower Cholesky factor of [[K, K_cross], [K_cross^T, K_new]]
+    # given the factor K_chol of K, in O(n^2 k) for k new rows. Raises
+    # np.linalg.LinAlgError if the extended matrix is not numerically
+    # positive definite.
+    n_old, n_new = K_cross.shape
+    K_21 = np.transpose(solve_triangular(K_chol, K_cross, lower=True))
+    K_22 = np.linalg.cholesky(K_new - np.matmul(K_21, np.transpose(K_21)))
+    K_ext = np.zeros((n_old + n_new, n_old + n_new), dtype=np.result_type(K_chol, K_22))
+    K_ext[:n_old, :n_old] = K_chol
+    K_ext[n_old:, :n_old] = K_21
+    K_ext[n_old:, n_old:] = K_22
+    return K_ext
+
+
+def inverse_append(K_inv, K_cross, K_new):
+    # Returns the inverse of [[K, K_cross], [K_cross^T, K_new]] given the
+    # inverse K_inv of K, in O(n^2 k) for k new rows (block inversion with
+    # the Schur complement of K).
+    n_old, n_new = K_cross.shape
+    K_ab = np.matmul(K_inv, K_cross)
+    K_schur_inv = np.linalg.inv(K_new - np.matmul(np.transpose(K_cross), K_ab))
+    K_ab_s = np.matmul(K_ab, K_schur_inv)
+    K_ext = np.zeros((n_old + n_new, n_old + n_new), dtype=np.result_type(K_inv, K_ab_s))
+    K_ext[:n_old, :n_old] = K_inv + np.matmul(K_ab_s, np.transpose(K_ab))
+    K_ext[:n_old, n_old:] = -K_ab_s
+    K_ext[n_old:, :n_old] = -np.transpose(K_ab_s)
+    K_ext[n_old:, n_old:] = K_schur_inv
+    return K_ext
+
+
+def update_stall_counts(stalls, loss_prev, loss, xt, grad, X_min, X_max,
+                        loss_tol=None, grad_tol=None):
+    # Returns the number of consecutive iterations in which each start point
+    # of a gradient descent has met one of the convergence criteria: the
+    # change in its loss is at most loss_tol, or the norm of its projected
+    # gradient is at most grad_tol (None disables a criterion).
+    small = np.zeros_like(loss, dtype=bool)
+    if loss_tol is not None and loss_prev is not None:
+        small |= np.abs(loss - loss_prev) <= loss_tol
+    if grad_tol is not None:
+        # Use the projected gradient: components pushing against the
+        # X_min/X_max box cannot move the conf and are ignored
+        blocked = ((xt <= X_min) & (grad > 0)) | ((xt >= X_max) & (grad < 0))
+        grad = np.where(blocked, 0, grad)
+        small |= np.sqrt(np.sum(np.square(grad), axis=-1)) <= grad_tol
+    return np.where(small, stalls + 1, 0)
+
+
+def hillclimb_categorical_features(loss_fn, X, constraint_helper, n_candidates=1):
+    # One step of categorical hill climbing for the rows of X: n_candidates
+    # random flips of the categorical features of every row are generated
+    # at once and scored together with the rows themselves in a single call
+    # of loss_fn (a matrix -> the loss of each row). Each row is replaced by
+    # its best candidate if that lowers its loss. Returns the new rows.
+    n_rows = X.shape[0]
+    candidates = constraint_helper.randomize_categorical_features_batch(X, n_candidates)
+    losses = np.asarray(loss_fn(np.vstack((X, candidates)))).ravel()
+    candidate_losses = losses[n_rows:].reshape(n_rows, n_candidates)
+    best_idxs = np.argmin(candidate_losses, axis=1)
+    keep = candidate_losses[np.arange(n_rows), best_idxs] < losses[:n_rows]
+    X = np.array(X)
+    X[keep] = candidates.reshape(n_rows, n_candidates, -1)[keep, best_idxs[keep]]
+    return X
+
+
+def log_marginal_likelihood(X, y, length_scale, magnitude, ridge, eval_gradient=False,
+                            max_jitter_tries=5, kernel_type=EXPONENTIAL):
+    # Returns the log marginal likelihood of a GP with the kernel
+    # magnitude * f(||x - x'|| / length_scale) + diag(ridge) (see
+    # analysis.kernels), summed over the columns of y, and (optionally) its
+    # gradient with respect to (log(length_scale), log(magnitude)):
+    #   dlml/dtheta = 0.5 * tr((alpha alpha^T - K^-1) dK/dtheta)
+    # where dK/dlog(length_scale) = -r dk/dr and dK/dlog(magnitude) = K.
+    sample_size, n_outputs = y.shape
+    if np.isscalar(ridge):
+        ridge = np.ones(sample_size) * ridge
+    kernel = create_kernel(kernel_type, length_scale, magnitude)
+    K_f = kernel(X, X)
+    K_chol, _ = cholesky_with_jitter(K_f + np.diag(ridge), max_jitter_tries)
+    alpha = cho_solve((K_chol, True), y)
+    lml = -0.5 * np.sum(y * alpha) - n_outputs * np.sum(np.log(np.diag(K_chol))) \
+        - 0.5 * sample_size * n_outputs * np.log(2 * np.pi)
+    if not eval_gradient:
+        return lml
+    K_inner = np.matmul(alpha, np.transpose(alpha)) - \
+        n_outputs * cho_solve((K_chol, True), np.eye(sample_size))
+    # dK/dlog(length_scale) is computed in row blocks, like K_f
+    grad_length_scale = 0.0
+    for start, end, dists in iter_dist_blocks(X, X):
+        K_grad_length_scale = -np.square(dists) * kernel.grad_coef(dists)
+        grad_length_scale += np.sum(K_inner[start:end] * K_grad_length_scale)
+    grad = np.array([0.5 * grad_length_scale, 0.5 * np.sum(K_inner * K_f)])
+    return lml, grad
+
+
+def fit_kernel_hyperparameters(X, y, ridge, length_scale=1.0, magnitude=1.0,
+                               bounds=((1e-2, 1e2), (1e-2, 1e2)), max_samples=1000,
+                               max_iter=50, random_state=0, kernel_type=EXPONENTIAL,
+                               log_step=None):
+    # Returns the length scale and magnitude that maximize the log marginal
+    # likelihood of the GP on (X, y), starting from the given values and
+    # within bounds ((min_length_scale, max_length_scale), (min_magnitude,
+    # max_magnitude)). The likelihood costs O(n^3), so at most max_samples
+    # (random) rows are used. The optimization is done in log space. If
+    # log_step is given, the logs of the results are rounded to multiples of
+    # it, so that close fits give the same values (e.g., the same graph
+    # cache and model store keys).
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64).reshape(X.shape[0], -1)
+    if np.isscalar(ridge):
+        ridge = np.ones(X.shape[0]) * ridge
+    if X.shape[0] > max_samples:
+        rng = np.random.RandomState(random_state)
+        idxs = np.sort(rng.choice(X.shape[0], max_samples, replace=False))
+        X, y, ridge = X[idxs], y[idxs], ridge[idxs]
+
+    def neg_lml(theta):
+        lml, grad = log_marginal_likelihood(X, y, np.exp(theta[0]), np.exp(theta[1]),
+                                            ridge, eval_gradient=True,
+                                            kernel_type=kernel_type)
+        return -lml, -grad
+
+    theta0 = np.log([length_scale, magnitude])
+    res = minimize(neg_lml, theta0, jac=True, method='L-BFGS-B',
+                   bounds=np.log(bounds), options={'maxiter': max_iter})
+    if not res.success:
+        LOG.warning("Kernel hyperparameter optimization did not converge: %s", res.message)
+    # Only keep the result if it is better than the starting point
+    theta, loss = res.x, res.fun
+    loss0 = neg_lml(theta0)[0]
+    if loss0 < loss:
+        theta, loss = theta0, loss0
+    if log_step is not None:
+        theta = np.round(theta / log_step) * log_step
+    # exp(log(bound)) may be just outside of the bound
+    length_scale = float(np.clip(np.exp(theta[0]), *bounds[0]))
+    magnitude = float(np.clip(np.exp(theta[1]), *bounds[1]))
+    return {
+        'length_scale': length_scale,
+        'magnitude': magnitude,
+        'log_marginal_likelihood': float(log_marginal_likelihood(
+            X, y, length_scale, magnitude, ridge, kernel_type=kernel_type)),
+    }
 
 
 # numpy version of Gaussian Process Regression, not using Tensorflow
 class GPRNP(object):
 
+    SOLVER_INVERSE = "inverse"
+    SOLVER_CHOLESKY = "cholesky"
+
     def __init__(self, length_scale=1.0, magnitude=1.0, max_train_size=7000,
-                 batch_size=3000, check_numerics=True, debug=False):
+                 batch_size=3000, check_numerics=True, debug=False,
+                 solver=SOLVER_INVERSE, max_jitter_tries=5, num_inducing=None,
+                 random_state=0, dtype=np.float32, kernel_type=EXPONENTIAL):
         assert np.isscalar(length_scale)
         assert np.isscalar(magnitude)
         assert length_scale > 0 and magnitude > 0
+        if solver not in (GPRNP.SOLVER_INVERSE, GPRNP.SOLVER_CHOLESKY):
+            raise Exception("Unknown solver: {}".format(solver))
         self.length_scale = length_scale
         self.magnitude = magnitude
         self.max_train_size_ = max_train_size
         self.batch_size_ = batch_size
         self.check_numerics = check_numerics
         self.debug = debug
+        self.solver = solver
+        self.max_jitter_tries = max_jitter_tries
+        # If set, a model trained on more than num_inducing samples is
+        # approximated with num_inducing inducing points (FITC), which takes
+        # O(n m) memory and O(n m^2) time instead of O(n^2) and O(n^3). The
+        # inducing points are a random subset of X_train (seeded with
+        # random_state), and max_train_size does not apply.
+        if num_inducing is not None and num_inducing < 1:
+            raise Exception("num_inducing must be positive ({})".format(num_inducing))
+        self.num_inducing = num_inducing
+        self.random_state = random_state
+        # The floating point precision (float32 or float64) of the training
+        # data, the kernel and its factorization. Inputs are converted to it
+        # once, and not copied if they already have it.
+        self.dtype = check_dtype(dtype)
+        # The kernel (see analysis.kernels) with length_scale and magnitude
+        check_kernel_type(kernel_type)
+        self.kernel_type = kernel_type
         self.X_train = None
         self.y_train = None
+        self.ridge = None
+        self.xy_ = None
         self.K = None
         self.K_inv = None
+        self.K_chol = None
+        self.jitter = None
         self.y_best = None
+        self.X_inducing = None
 
     def __repr__(self):
         rep = ""
@@ -46,29 +277,43 @@ class GPRNP(object):
     def _reset(self):
         self.X_train = None
         self.y_train = None
+        self.ridge = None
+        self.xy_ = None
         self.K = None
         self.K_inv = None
+        self.K_chol = None
+        self.jitter = None
         self.y_best = None
+        self.X_inducing = None
 
     def check_X_y(self, X, y):
         from sklearn.utils.validation import check_X_y
 
-        if X.shape[0] > self.max_train_size_:
+        if self.num_inducing is None and X.shape[0] > self.max_train_size_:
             raise Exception("X_train size cannot exceed {} ({})"
                             .format(self.max_train_size_, X.shape[0]))
-        return check_X_y(X, y, multi_output=True,
+        X, y = check_X_y(X, y, multi_output=True,
                          allow_nd=True, y_numeric=True,
-                         estimator="GPRNP")
+                         dtype=self.dtype, estimator="GPRNP")
+        return X, np.asarray(y, dtype=self.dtype)
 
     def check_fitted(self):
         if self.X_train is None or self.y_train is None \
-                or self.K is None:
+                or self.xy_ is None or self.K is None:
             raise Exception("The model must be trained before making predictions!")
 
     @staticmethod
-    def check_array(X):
+    def check_array(X, dtype="numeric"):
         from sklearn.utils.validation import check_array
-        return check_array(X, allow_nd=True, estimator="GPRNP")
+        return check_array(X, allow_nd=True, dtype=dtype, estimator="GPRNP")
+
+    def get_kernel(self):
+        return create_kernel(self.kernel_type, self.length_scale, self.magnitude)
+
+    def kernel(self, X1, X2):
+        # The kernel matrix between the rows of X1 and X2, computed blockwise
+        # in self.dtype (without a full matrix of distances)
+        return self.get_kernel()(X1, X2, dtype=self.dtype)
 
     @staticmethod
     def check_output(X):
@@ -83,66 +328,482 @@ class GPRNP(object):
         if X_train.ndim != 2 or y_train.ndim != 2:
             raise Exception("X_train or y_train should have 2 dimensions! X_dim:{}, y_dim:{}"
                             .format(X_train.ndim, y_train.ndim))
-        self.X_train = np.float32(X_train)
-        self.y_train = np.float32(y_train)
+        self.X_train = X_train
+        self.y_train = y_train
         sample_size = self.X_train.shape[0]
         if np.isscalar(ridge):
             ridge = np.ones(sample_size) * ridge
         assert isinstance(ridge, np.ndarray)
         assert ridge.ndim == 1
-        K = self.magnitude * np.exp(-ed(self.X_train, self.X_train) / self.length_scale) \
-            + np.diag(ridge)
-        K_inv = np.linalg.inv(K)
+        self.ridge = ridge.astype(self.dtype, copy=False)
+        if self.is_sparse():
+            return self._fit_sparse()
+        K = self.kernel(self.X_train, self.X_train)
+        K[np.diag_indices_from(K)] += self.ridge
         self.K = K
-        self.K_inv = K_inv
-        self.y_best = np.min(y_train)
+        if self.solver == GPRNP.SOLVER_CHOLESKY:
+            self.K_chol, self.jitter = cholesky_with_jitter(K, self.max_jitter_tries)
+        else:
+            self.K_inv = np.linalg.inv(K)
+        self._update_xy()
+        return self
+
+    def is_sparse(self):
+        return self.num_inducing is not None and self.X_train is not None \
+            and self.X_train.shape[0] > self.num_inducing
+
+    def _fit_sparse(self):
+        # FITC approximation with the inducing points Z:
+        #   K ~= Q = K_nm K_mm^-1 K_mn, with the exact diagonal
+        #   Lambda = diag(K_nn - Q_nn) + ridge
+        #   Sigma = (K_mm + K_mn Lambda^-1 K_nm)^-1
+        #   yhat = k_*m Sigma K_mn Lambda^-1 y
+        #   sigma^2 = k_** - k_*m (K_mm^-1 - Sigma) k_m*
+        # This has the same form as the exact model with Z as the training
+        # data, so xy_ and K_inv (K_mm^-1 - Sigma) are all predict needs.
+        # K_mn is processed batch_size columns at a time.
+        sample_size = self.X_train.shape[0]
+        rng = np.random.RandomState(self.random_state)
+        idxs = np.sort(rng.choice(sample_size, self.num_inducing, replace=False))
+        self.X_inducing = self.X_train[idxs]
+        K_mm = self.kernel(self.X_inducing, self.X_inducing)
+        self.K = K_mm
+        K_mm_chol, self.jitter = cholesky_with_jitter(K_mm, self.max_jitter_tries)
+
+        # With K_mm = LL^T and V = L^-1 K_mn: A = I + V Lambda^-1 V^T and
+        # Sigma = L^-T A^-1 L^-1
+        K_a = np.eye(self.num_inducing, dtype=self.dtype)
+        b = np.zeros((self.num_inducing, self.y_train.shape[1]), dtype=self.dtype)
+        for start in range(0, sample_size, self.batch_size_):
+            end = min(start + self.batch_size_, sample_size)
+            K_mn = self.kernel(self.X_inducing, self.X_train[start:end])
+            v = solve_triangular(K_mm_chol, K_mn, lower=True)
+            lam = self.magnitude - np.sum(np.square(v), axis=0) + self.ridge[start:end]
+            v_lam = v / lam
+            K_a += np.matmul(v_lam, np.transpose(v))
+            b += np.matmul(v_lam, self.y_train[start:end])
+        K_a_chol, _ = cholesky_with_jitter(K_a, self.max_jitter_tries)
+        self.xy_ = solve_triangular(K_mm_chol, cho_solve((K_a_chol, True), b),
+                                    lower=True, trans='T')
+        # K_mm^-1 - Sigma = L^-T (I - A^-1) L^-1
+        eye = np.eye(self.num_inducing, dtype=self.dtype)
+        K_mm_chol_inv = solve_triangular(K_mm_chol, eye, lower=True)
+        K_a_inv = cho_solve((K_a_chol, True), eye)
+        self.K_inv = np.matmul(np.transpose(K_mm_chol_inv),
+                               np.matmul(eye - K_a_inv, K_mm_chol_inv))
+        self.y_best = np.min(self.y_train, axis=0)
         return self
 
-    def predict(self, X_test):
+    def get_basis(self):
+        # Returns the points that the kernel of a test point is computed
+        # against and whether the Cholesky factor (rather than K_inv) is used
+        if self.X_inducing is not None:
+            return self.X_inducing, False
+        return self.X_train, self.solver == GPRNP.SOLVER_CHOLESKY
+
+    def partial_fit(self, X_new, y_new, ridge=0.01):
+        # Appends new observations to a fitted model. The factorization of K
+        # is extended in O(n^2 k) instead of being recomputed in O(n^3), and
+        # the model predicts the same as one fit on all of the data.
+        if self.X_train is None:
+            return GPRNP.fit(self, X_new, y_new, ridge)
+        X_new, y_new = self.check_X_y(X_new, y_new)
+        if X_new.ndim != 2 or y_new.ndim != 2:
+            raise Exception("X_new or y_new should have 2 dimensions! X_dim:{}, y_dim:{}"
+                            .format(X_new.ndim, y_new.ndim))
+        sample_size = self.X_train.shape[0] + X_new.shape[0]
+        if self.num_inducing is None and sample_size > self.max_train_size_:
+            raise Exception("X_train size cannot exceed {} ({})"
+                            .format(self.max_train_size_, sample_size))
+        if np.isscalar(ridge):
+            ridge = np.ones(X_new.shape[0]) * ridge
+        assert isinstance(ridge, np.ndarray)
+        assert ridge.ndim == 1
+        ridge = ridge.astype(self.dtype, copy=False)
+        if self.num_inducing is not None and sample_size > self.num_inducing:
+            # A sparse model is refit on all of the data
+            X_train, y_train = self.X_train, self.y_train
+            return GPRNP.fit(self, np.vstack((X_train, X_new)), np.vstack((y_train, y_new)),
+                             np.concatenate((self.ridge, ridge)))
+
+        K_cross = self.kernel(self.X_train, X_new)
+        K_new = self.kernel(X_new, X_new)
+        K_new[np.diag_indices_from(K_new)] += ridge
+        self.K = np.vstack((np.hstack((self.K, K_cross)),
+                            np.hstack((np.transpose(K_cross), K_new))))
+        self.X_train = np.vstack((self.X_train, X_new))
+        self.y_train = np.vstack((self.y_train, y_new))
+        self.ridge = np.concatenate((self.ridge, ridge))
+        if self.solver == GPRNP.SOLVER_CHOLESKY:
+            try:
+                if self.jitter != 0.0:
+                    # The old factor includes a jitter that a refit may not need
+                    raise np.linalg.LinAlgError("Factor of K includes a jitter")
+                self.K_chol = cholesky_append(self.K_chol, K_cross, K_new)
+            except np.linalg.LinAlgError:
+                self.K_chol, self.jitter = cholesky_with_jitter(self.K, self.max_jitter_tries)
+        else:
+            self.K_inv = inverse_append(self.K_inv, K_cross, K_new)
+        self._update_xy()
+        return self
+
+    def _update_xy(self):
+        if self.solver == GPRNP.SOLVER_CHOLESKY:
+            self.xy_ = cho_solve((self.K_chol, True), self.y_train)
+        else:
+            self.xy_ = np.matmul(self.K_inv, self.y_train)
+        self.y_best = np.min(self.y_train, axis=0)
+
+    def predict(self, X_test, acquisitions=(EXPECTED_IMPROVEMENT,), beta=None):
+        # Also computes the acquisition functions named in acquisitions
+        # (see analysis.acquisition) in the same batched pass. beta is the
+        # exploration weight of UCB; by default it is computed with
+        # calculate_sigma_multiplier for the size of the training data.
+        # A model fit on several outputs (columns of y_train) shares one
+        # kernel factorization, so all of the outputs are predicted with a
+        # single matmul and have the same sigmas. The ypreds and acquisition
+        # scores have one column per output.
         self.check_fitted()
         if X_test.ndim != 2:
             raise Exception("X_test should have 2 dimensions! X_dim:{}"
                             .format(X_test.ndim))
-        X_test = np.float32(GPRNP.check_array(X_test))
+        check_acquisition_functions(acquisitions)
+        X_test = GPRNP.check_array(X_test, dtype=self.dtype)
         test_size = X_test.shape[0]
         arr_offset = 0
-        length_scale = self.length_scale
-        yhats = np.zeros([test_size, 1])
+        X_basis, use_chol = self.get_basis()
+        if beta is None:
+            beta = calculate_sigma_multiplier(t=self.X_train.shape[0],
+                                              ndim=self.X_train.shape[1])
+        n_outputs = self.xy_.shape[1]
+        yhats = np.zeros([test_size, n_outputs])
         sigmas = np.zeros([test_size, 1])
-        eips = np.zeros([test_size, 1])
+        acq_scores = {name: np.zeros([test_size, n_outputs]) for name in acquisitions}
         while arr_offset < test_size:
             if arr_offset + self.batch_size_ > test_size:
                 end_offset = test_size
             else:
                 end_offset = arr_offset + self.batch_size_
             xt_ = X_test[arr_offset:end_offset]
-            K2 = self.magnitude * np.exp(-ed(self.X_train, xt_) / length_scale)
-            K3 = self.magnitude * np.exp(-ed(xt_, xt_) / length_scale)
+            K2 = self.kernel(X_basis, xt_)
             K2_trans = np.transpose(K2)
-            yhat = np.matmul(K2_trans, np.matmul(self.K_inv, self.y_train))
-            sigma = np.sqrt(np.diag(K3 - np.matmul(K2_trans, np.matmul(self.K_inv, K2)))) \
-                .reshape(xt_.shape[0], 1)
-            u = (self.y_best - yhat) / sigma
-            phi1 = 0.5 * special.erf(u / np.sqrt(2.0)) + 0.5
-            phi2 = (1.0 / np.sqrt(2.0 * np.pi)) * np.exp(np.square(u) * (-0.5))
-            eip = sigma * (u * phi1 + phi2)
+            yhat = np.matmul(K2_trans, self.xy_)
+            # Only the diagonal of the predictive covariance is needed, so it
+            # is computed directly in O(batch_size * n) memory. The prior
+            # variance k(x, x) of every test point is the magnitude.
+            if use_chol:
+                v = solve_triangular(self.K_chol, K2, lower=True)
+                var = self.magnitude - np.sum(np.square(v), axis=0)
+                sigma = np.sqrt(np.maximum(var, 0.0)).reshape(xt_.shape[0], 1)
+            else:
+                var = self.magnitude - np.sum(K2 * np.matmul(self.K_inv, K2), axis=0)
+                sigma = np.sqrt(np.maximum(var, 0.0)).reshape(xt_.shape[0], 1)
             yhats[arr_offset:end_offset] = yhat
             sigmas[arr_offset:end_offset] = sigma
-            eips[arr_offset:end_offset] = eip
+            batch_scores = compute_acquisitions(acquisitions, yhat, sigma, self.y_best, beta)
+            for name, scores in batch_scores.items():
+                acq_scores[name][arr_offset:end_offset] = scores
             arr_offset = end_offset
         GPRNP.check_output(yhats)
         GPRNP.check_output(sigmas)
-        return GPRResult(yhats, sigmas)
+        return GPRResult(yhats, sigmas, acq_scores)
 
     def get_params(self, deep=True):
         return {"length_scale": self.length_scale,
                 "magnitude": self.magnitude,
                 "X_train": self.X_train,
                 "y_train": self.y_train,
+                "xy_": self.xy_,
                 "K": self.K,
-                "K_inv": self.K_inv}
+                "K_inv": self.K_inv,
+                "K_chol": self.K_chol}
 
     def set_params(self, **parameters):
         for param, val in list(parameters.items()):
             setattr(self, param, val)
         return self
+
+
+def lbfgs_minimize(model, X_start, constraint_helper=None, categorical_feature_steps=3,
+                   categorical_feature_candidates=1, deadline=None):
+    # Minimizes the loss of a fitted GPRGDNP model from each of the rows of
+    # X_start with L-BFGS-B, one starting point at a time, within the box
+    # [X_min, X_max]. Then the constraints are applied to the minimum and
+    # categorical_feature_steps steps of categorical hill climbing (each
+    # scoring categorical_feature_candidates flips) are run. Returns the yhat, sigma,
+    # min loss, min loss conf and number of iterations of each row. Once the
+    # deadline (a time.time() timestamp) has passed, the remaining starting
+    # points are returned as they are (after 0 iterations). This is a
+    # module-level function so that it can be run in a process pool.
+    bounds = list(zip(model.X_min, model.X_max))
+    options = {'maxiter': model.max_iter}
+    if model.loss_tol is not None:
+        options['ftol'] = model.loss_tol
+    if model.grad_tol is not None:
+        options['gtol'] = model.grad_tol
+
+    def loss_and_grad(x):
+        _, _, loss, grad = model.objective(x.reshape(1, -1).astype(model.dtype))
+        return float(loss[0]), grad[0].astype(np.float64)
+
+    def loss_only(X):
+        return model.objective(X.astype(model.dtype), gradient=False)[2]
+
+    batch_len, nfeats = X_start.shape
+    minl_conf = np.empty((batch_len, nfeats))
+    n_iter = np.empty(batch_len)
+    for i in range(batch_len):
+        x0 = np.clip(np.asarray(X_start[i], dtype=np.float64), model.X_min, model.X_max)
+        if deadline_passed(deadline):
+            minl_conf[i] = x0
+            n_iter[i] = 0
+            continue
+        res = minimize(loss_and_grad, x0, jac=True, method='L-BFGS-B',
+                       bounds=bounds, options=options)
+        x = res.x
+        if constraint_helper is not None:
+            x = constraint_helper.apply_constraints(x).reshape(1, -1)
+            for _ in range(categorical_feature_steps):
+                x = hillclimb_categorical_features(loss_only, x, constraint_helper,
+                                                   categorical_feature_candidates)
+        if model.debug is True:
+            LOG.info("Start %d: %d iterations, %s", i, res.nit, res.message)
+        minl_conf[i] = x
+        n_iter[i] = res.nit
+    yhat, sigma, minl, _ = model.objective(minl_conf.astype(model.dtype), gradient=False)
+    return yhat, sigma, minl, minl_conf, n_iter
+
+
+# numpy version of GPRGD, not using Tensorflow. The gradient of the loss
+# (mu_multiplier * yhat - sigma_multiplier * sigma) is computed in closed
+# form and all starting points are optimized together with Adam, or one at
+# a time with L-BFGS-B (optionally in a thread or process pool).
+class GPRGDNP(GPRNP):
+
+    # Lower bound on the predictive variance of the starting points
+    MIN_VARIANCE = 1e-12
+
+    OPTIMIZER_ADAM = 'adam'
+    OPTIMIZER_LBFGS = 'lbfgs'
+
+    EXECUTOR_THREAD = 'thread'
+    EXECUTOR_PROCESS = 'process'
+
+    def __init__(self, length_scale=1.0, magnitude=1.0, max_train_size=7000,
+                 batch_size=3000, learning_rate=0.01, epsilon=1e-6, max_iter=100,
+                 sigma_multiplier=3.0, mu_multiplier=1.0, check_numerics=True,
+                 debug=False, solver=GPRNP.SOLVER_INVERSE, loss_tol=None,
+                 grad_tol=None, patience=10, beta1=0.9, beta2=0.999,
+                 num_inducing=None, random_state=0, dtype=np.float32,
+                 optimizer=OPTIMIZER_ADAM, n_jobs=1, executor=EXECUTOR_THREAD,
+                 kernel_type=EXPONENTIAL):
+        super(GPRGDNP, self).__init__(length_scale=length_scale,
+                                      magnitude=magnitude,
+                                      max_train_size=max_train_size,
+                                      batch_size=batch_size,
+                                      check_numerics=check_numerics,
+                                      debug=debug,
+                                      solver=solver,
+                                      num_inducing=num_inducing,
+                                      random_state=random_state,
+                                      dtype=dtype,
+                                      kernel_type=kernel_type)
+        self.learning_rate = learning_rate
+        self.epsilon = epsilon
+        self.max_iter = max_iter
+        self.sigma_multiplier = sigma_multiplier
+        self.mu_multiplier = mu_multiplier
+        self.loss_tol = loss_tol
+        self.grad_tol = grad_tol
+        self.patience = patience
+        self.beta1 = beta1
+        self.beta2 = beta2
+        if optimizer not in (GPRGDNP.OPTIMIZER_ADAM, GPRGDNP.OPTIMIZER_LBFGS):
+            raise Exception("Unknown optimizer: {}".format(optimizer))
+        if executor not in (GPRGDNP.EXECUTOR_THREAD, GPRGDNP.EXECUTOR_PROCESS):
+            raise Exception("Unknown executor: {}".format(executor))
+        # The starting points are split among n_jobs workers of the
+        # executor (L-BFGS-B only)
+        self.optimizer = optimizer
+        self.n_jobs = n_jobs
+        self.executor = executor
+        self.X_min = None
+        self.X_max = None
+
+    def fit(self, X_train, y_train, X_min, X_max, ridge):  # pylint: disable=arguments-differ
+        super(GPRGDNP, self).fit(X_train, y_train, ridge)
+        self.X_min = np.asarray(X_min, dtype=self.dtype)
+        self.X_max = np.asarray(X_max, dtype=self.dtype)
+        return self
+
+    def objective(self, X, gradient=True):
+        # Returns yhat, sigma, the loss and (optionally) the gradient of the
+        # loss for each row of X
+        X_basis, use_chol = self.get_basis()
+        kernel = self.get_kernel()
+        K2 = kernel(X, X_basis, dtype=self.dtype)
+        yhat = np.matmul(K2, self.xy_).ravel()
+        if use_chol:
+            # Two triangular solves rather than cho_solve, which copies K_chol
+            # on every call (expensive for the single-row calls of L-BFGS-B)
+            v = solve_triangular(self.K_chol, np.transpose(K2), lower=True,
+                                 check_finite=False)
+            K_w = np.transpose(solve_triangular(self.K_chol, v, lower=True, trans='T',
+                                                check_finite=False))
+        else:
+            K_w = np.matmul(K2, self.K_inv)
+        var = np.maximum(self.magnitude - np.sum(K2 * K_w, axis=1), GPRGDNP.MIN_VARIANCE)
+        sigma = np.sqrt(var)
+        loss = self.mu_multiplier * yhat - self.sigma_multiplier * sigma
+        if not gradient:
+            return yhat, sigma, loss, None
+
+        # d(loss)/dk_i = mu_multiplier * xy_i + sigma_multiplier * w_i / sigma
+        # dk_i/dx = (dk/dr)(r_i) * (x - x_i) / r_i, with r_i = ||x - x_i||
+        # computed in row blocks of X, so that the distances (and the
+        # coefficients) are never materialized for all of X at once
+        grad = np.empty_like(X)
+        xy = self.mu_multiplier * self.xy_.ravel()
+        for start, end, dists in iter_dist_blocks(X, X_basis):
+            coef = xy + self.sigma_multiplier * K_w[start:end] / \
+                sigma[start:end].reshape(-1, 1)
+            coef = (coef * kernel.grad_coef(dists)).astype(self.dtype, copy=False)
+            grad[start:end] = X[start:end] * np.sum(coef, axis=1, keepdims=True) - \
+                np.matmul(coef, X_basis)
+        return yhat, sigma, loss, grad
+
+    def predict(self, X_test, constraint_helper=None,  # pylint: disable=arguments-differ
+                categorical_feature_method='hillclimbing',
+                categorical_feature_steps=3,
+                categorical_feature_candidates=1, deadline=None):
+        # Minimizes the loss from each row of X_test. If the deadline (a
+        # time.time() timestamp) passes, the search stops and the best
+        # configurations found so far are returned.
+        self.check_fitted()
+        if X_test.ndim != 2:
+            raise Exception("X_test should have 2 dimensions! X_dim:{}"
+                            .format(X_test.ndim))
+        if constraint_helper is not None and categorical_feature_method != 'hillclimbing':
+            raise Exception("Unknown categorial feature method: {}".format(
+                categorical_feature_method))
+        X_test = GPRNP.check_array(X_test, dtype=self.dtype)
+        test_size = X_test.shape[0]
+        nfeats = self.X_train.shape[1]
+
+        arr_offset = 0
+        yhats = np.zeros([test_size, 1])
+        sigmas = np.zeros([test_size, 1])
+        minls = np.zeros([test_size, 1])
+        minl_confs = np.zeros([test_size, nfeats])
+        n_iters = np.zeros([test_size, 1])
+        while arr_offset < test_size:
+            if arr_offset + self.batch_size_ > test_size:
+                end_offset = test_size
+            else:
+                end_offset = arr_offset + self.batch_size_
+            if self.optimizer == GPRGDNP.OPTIMIZER_LBFGS:
+                minimize_batch = self._minimize_lbfgs
+            else:
+                minimize_batch = self._minimize
+            yhat, sigma, minl, minl_conf, n_iter = minimize_batch(
+                X_test[arr_offset:end_offset], constraint_helper,
+                categorical_feature_steps, categorical_feature_candidates, deadline)
+            yhats[arr_offset:end_offset] = yhat.reshape(-1, 1)
+            sigmas[arr_offset:end_offset] = sigma.reshape(-1, 1)
+            minls[arr_offset:end_offset] = minl.reshape(-1, 1)
+            minl_confs[arr_offset:end_offset] = minl_conf
+            n_iters[arr_offset:end_offset] = n_iter.reshape(-1, 1)
+            arr_offset = end_offset
+
+        GPRNP.check_output(yhats)
+        GPRNP.check_output(sigmas)
+        GPRNP.check_output(minls)
+        GPRNP.check_output(minl_confs)
+
+        return GPRGDResult(yhats, sigmas, minls, minl_confs, n_iters)
+
+    def _minimize_lbfgs(self, X_start, constraint_helper, categorical_feature_steps,
+                        categorical_feature_candidates, deadline=None):
+        n_jobs = min(self.n_jobs, X_start.shape[0])
+        if n_jobs <= 1:
+            return lbfgs_minimize(self, X_start, constraint_helper, categorical_feature_steps,
+                                  categorical_feature_candidates, deadline)
+        # Each worker minimizes a contiguous chunk of the starting points
+        # (so the model is pickled once per worker by the process pool)
+        chunks = np.array_split(X_start, n_jobs)
+        if self.executor == GPRGDNP.EXECUTOR_PROCESS:
+            pool = ProcessPoolExecutor(max_workers=n_jobs)
+        else:
+            pool = ThreadPoolExecutor(max_workers=n_jobs)
+        with pool:
+            futures = [pool.submit(lbfgs_minimize, self, chunk, constraint_helper,
+                                   categorical_feature_steps, categorical_feature_candidates,
+                                   deadline)
+                       for chunk in chunks]
+            results = [future.result() for future in futures]
+        return tuple(np.concatenate(arrs) for arrs in zip(*results))
+
+    def _minimize(self, X_start, constraint_helper, categorical_feature_steps,
+                  categorical_feature_candidates, deadline=None):
+        batch_len = X_start.shape[0]
+        xt = np.array(X_start, dtype=self.dtype)
+
+        # Per-row record of the conf with the min loss from all iters
+        yhat = np.empty(batch_len) * np.nan
+        sigma = np.empty(batch_len) * np.nan
+        minl = np.ones(batch_len) * np.inf
+        minl_conf = xt.copy()
+        n_iter = np.ones(batch_len) * self.max_iter
+        active = np.ones(batch_len, dtype=bool)
+        stalls = np.zeros(batch_len, dtype=int)
+        loss_prev = None
+
+        # Adam moment estimates
+        m = np.zeros_like(xt)
+        v = np.zeros_like(xt)
+        for step in range(self.max_iter + 1):
+            yhat_it, sigma_it, loss_it, grad = self.objective(xt)
+            improved = (loss_it < minl) & active
+            yhat[improved] = yhat_it[improved]
+            sigma[improved] = sigma_it[improved]
+            minl[improved] = loss_it[improved]
+            minl_conf[improved] = xt[improved]
+            if self.debug is True:
+                LOG.info("Iter %d: min loss %s", step, str(minl))
+
+            # Starts that have converged keep their current conf
+            stalls = update_stall_counts(stalls, loss_prev, loss_it, xt, grad,
+                                         self.X_min, self.X_max,
+                                         self.loss_tol, self.grad_tol)
+            loss_prev = loss_it
+            converged = active & (stalls >= self.patience)
+            n_iter[converged] = step
+            active &= ~converged
+            if deadline_passed(deadline):
+                # Out of time: keep the best confs found so far
+                n_iter[active] = step
+                break
+            if step == self.max_iter or not np.any(active):
+                # Results from the final iteration have been recorded
+                break
+
+            # Adam update (same as tf.train.AdamOptimizer)
+            t = step + 1
+            m = self.beta1 * m + (1 - self.beta1) * grad
+            v = self.beta2 * v + (1 - self.beta2) * np.square(grad)
+            lr_t = self.learning_rate * np.sqrt(1 - self.beta2 ** t) / (1 - self.beta1 ** t)
+            xt_valid = xt - lr_t * m / (np.sqrt(v) + self.epsilon)
+
+            # constraint Projected Gradient Descent (per row)
+            xt_valid = np.minimum(xt_valid, self.X_max)
+            xt_valid = np.maximum(xt_valid, self.X_min)
+            if constraint_helper is not None:
+                xt_valid = np.array([constraint_helper.apply_constraints(x)
+                                     for x in xt_valid])
+                if step % categorical_feature_steps == 0:
+                    xt_valid = hillclimb_categorical_features(
+                        lambda X: self.objective(X.astype(self.dtype), gradient=False)[2],
+                        xt_valid, constraint_helper, categorical_feature_candidates)
+            xt_valid[~active] = xt[~active]
+            xt = xt_valid
+        return yhat, sigma, minl, minl_conf, n_iter
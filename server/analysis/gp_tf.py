@@ -13,34 +13,46 @@ import gc
 import numpy as np
 import tensorflow as tf
 
-from .util import get_analysis_logger
+from . import acquisition
+from .gp import (GPRResult, GPRGDResult, GPRGDNP, update_stall_counts, cholesky_append,
+                 inverse_append, check_dtype, hillclimb_categorical_features)
+from .graph_cache import GRAPH_CACHE, GraphCache
+from .kernels import EXPONENTIAL, check_kernel_type, create_kernel, iter_row_blocks
+from .util import deadline_passed, get_analysis_logger
 
 LOG = get_analysis_logger(__name__)
 
 
-class GPRResult(object):
-
-    def __init__(self, ypreds=None, sigmas=None):
-        self.ypreds = ypreds
-        self.sigmas = sigmas
-
-
-class GPRGDResult(GPRResult):
-
-    def __init__(self, ypreds=None, sigmas=None,
-                 minl=None, minl_conf=None):
-        super(GPRGDResult, self).__init__(ypreds, sigmas)
-        self.minl = minl
-        self.minl_conf = minl_conf
+def pairwise_distances(X1, X2, name=None, dtype=tf.float32):
+    # Euclidean distances between every row of X1 and every row of X2,
+    # computed in one batched op as ||a||^2 - 2ab + ||b||^2. The expansion
+    # is evaluated in float64 so that the cancellation in the cross term
+    # does not swamp small distances. The squared distances are clipped to a
+    # tiny positive value: the gradient of sqrt at 0 is infinite, which turned
+    # a gradient descent start at a training point into NaNs.
+    X1 = tf.cast(X1, tf.float64)
+    X2 = tf.cast(X2, tf.float64)
+    sq1 = tf.reduce_sum(tf.square(X1), 1, keepdims=True)
+    sq2 = tf.reduce_sum(tf.square(X2), 1, keepdims=True)
+    sq_dists = sq1 - 2.0 * tf.matmul(X1, X2, transpose_b=True) + tf.transpose(sq2)
+    dists = tf.sqrt(tf.maximum(sq_dists, 1e-30))
+    return tf.cast(dists, dtype, name=name)
 
 
 class GPR(object):
 
+    SOLVER_INVERSE = "inverse"
+    SOLVER_CHOLESKY = "cholesky"
+
     def __init__(self, length_scale=1.0, magnitude=1.0, max_train_size=7000,
-                 batch_size=3000, num_threads=4, check_numerics=True, debug=False):
+                 batch_size=3000, num_threads=4, check_numerics=True, debug=False,
+                 solver=SOLVER_INVERSE, max_jitter_tries=5, use_graph_cache=True,
+                 dtype=np.float32, kernel_type=EXPONENTIAL):
         assert np.isscalar(length_scale)
         assert np.isscalar(magnitude)
         assert length_scale > 0 and magnitude > 0
+        if solver not in (GPR.SOLVER_INVERSE, GPR.SOLVER_CHOLESKY):
+            raise Exception("Unknown solver: {}".format(solver))
         self.length_scale = length_scale
         self.magnitude = magnitude
         self.max_train_size_ = max_train_size
@@ -48,58 +60,83 @@ class GPR(object):
         self.num_threads_ = num_threads
         self.check_numerics = check_numerics
         self.debug = debug
+        self.solver = solver
+        self.max_jitter_tries = max_jitter_tries
+        # Share the graphs of the process-wide cache, or keep private graphs
+        # that are rebuilt on every fit
+        self.use_graph_cache = use_graph_cache
+        self.graph_cache_ = GRAPH_CACHE if use_graph_cache else GraphCache()
+        # The floating point precision (float32 or float64) of the graphs,
+        # the training data and the factorization of K
+        self.dtype = check_dtype(dtype)
+        # The kernel (see analysis.kernels) with length_scale and magnitude
+        check_kernel_type(kernel_type)
+        self.kernel_type = kernel_type
         self.X_train = None
         self.y_train = None
         self.xy_ = None
         self.K = None
         self.K_inv = None
-        self.graph = None
-        self.vars = None
-        self.ops = None
+        self.K_chol = None
+        self.jitter = None
+
+    def kernel_op(self, X1, X2, dtype):
+        # The kernel matrix between the rows of X1 and X2 (in dtype)
+        kernel = create_kernel(self.kernel_type, self.length_scale, self.magnitude)
+        return kernel.from_dists(pairwise_distances(X1, X2, dtype=dtype), xp=tf)
+
+    def kernel_matrix(self, X1, X2, ridge=None):
+        # The kernel matrix between the rows of X1 and X2 (plus diag(ridge) if
+        # given, for X1 = X2) in self.dtype. The kernel op is run on blocks
+        # of rows of X1 (see kernels.iter_row_blocks), so the graph only holds
+        # one block of distances and kernel values next to the result.
+        with self.build_graph() as entry:
+            return self._kernel_matrix(entry, X1, X2, ridge)
+
+    def _kernel_matrix(self, entry, X1, X2, ridge=None):
+        # kernel_matrix with the graph entry already in use
+        K = np.empty((X1.shape[0], X2.shape[0]), dtype=self.dtype)
+        X1_ph, X2_ph = entry.vars['X1_h'], entry.vars['X2_h']
+        for start, end in iter_row_blocks(X1.shape[0], X2.shape[0]):
+            K[start:end] = entry.session.run(entry.ops['K_op'],
+                                             feed_dict={X1_ph: X1[start:end], X2_ph: X2})
+        if ridge is not None:
+            K[np.diag_indices_from(K)] += ridge.astype(self.dtype)
+        return K
 
     def build_graph(self):
-        self.vars = {}
-        self.ops = {}
-        self.graph = tf.Graph()
-        with self.graph.as_default():
+        # Returns a context manager that holds the (cached) graph entry with
+        # the kernel and solver nodes
+        key = ('GPR', self.kernel_type, self.length_scale, self.magnitude,
+               self.check_numerics, self.num_threads_, self.dtype.name)
+        return self.graph_cache_.use(key, self._build_gpr_nodes, self.num_threads_)
+
+    def _build_gpr_nodes(self, entry):
+        with entry.graph.as_default():
+            dtype = tf.as_dtype(self.dtype)
             mag_const = tf.constant(self.magnitude,
-                                    dtype=np.float32,
+                                    dtype=dtype,
                                     name='magnitude')
-            ls_const = tf.constant(self.length_scale,
-                                   dtype=np.float32,
-                                   name='length_scale')
-
-            # Nodes for distance computation
-            v1 = tf.placeholder(tf.float32, name="v1")
-            v2 = tf.placeholder(tf.float32, name="v2")
-            dist_op = tf.sqrt(tf.reduce_sum(tf.pow(tf.subtract(v1, v2), 2), 1), name='dist_op')
-            if self.check_numerics:
-                dist_op = tf.check_numerics(dist_op, "dist_op: ")
-
-            self.vars['v1_h'] = v1
-            self.vars['v2_h'] = v2
-            self.ops['dist_op'] = dist_op
 
-            # Nodes for kernel computation
-            X_dists = tf.placeholder(tf.float32, name='X_dists')
-            ridge_ph = tf.placeholder(tf.float32, name='ridge')
-            K_op = mag_const * tf.exp(-X_dists / ls_const)
+            # Nodes for kernel computation. The distances between every row
+            # of X1 and every row of X2 are computed in one batched op and
+            # are only an intermediate of the kernel op, which kernel_matrix
+            # runs on blocks of rows of X1.
+            X1 = tf.placeholder(dtype, name="X1")
+            X2 = tf.placeholder(dtype, name="X2")
+            entry.vars['X1_h'] = X1
+            entry.vars['X2_h'] = X2
+            K_op = self.kernel_op(X1, X2, dtype)
             if self.check_numerics:
                 K_op = tf.check_numerics(K_op, "K_op: ")
-            K_ridge_op = K_op + tf.diag(ridge_ph)
-            if self.check_numerics:
-                K_ridge_op = tf.check_numerics(K_ridge_op, "K_ridge_op: ")
 
-            self.vars['X_dists_h'] = X_dists
-            self.vars['ridge_h'] = ridge_ph
-            self.ops['K_op'] = K_op
-            self.ops['K_ridge_op'] = K_ridge_op
+            entry.ops['K_op'] = K_op
 
             # Nodes for xy computation
-            K = tf.placeholder(tf.float32, name='K')
-            K_inv = tf.placeholder(tf.float32, name='K_inv')
-            xy_ = tf.placeholder(tf.float32, name='xy_')
-            yt_ = tf.placeholder(tf.float32, name='yt_')
+            K = tf.placeholder(dtype, name='K')
+            K_inv = tf.placeholder(dtype, name='K_inv')
+            xy_ = tf.placeholder(dtype, name='xy_')
+            yt_ = tf.placeholder(dtype, name='yt_')
             K_inv_op = tf.matrix_inverse(K)
             if self.check_numerics:
                 K_inv_op = tf.check_numerics(K_inv_op, "K_inv: ")
@@ -107,42 +144,61 @@ class GPR(object):
             if self.check_numerics:
                 xy_op = tf.check_numerics(xy_op, "xy_: ")
 
-            self.vars['K_h'] = K
-            self.vars['K_inv_h'] = K_inv
-            self.vars['xy_h'] = xy_
-            self.vars['yt_h'] = yt_
-            self.ops['K_inv_op'] = K_inv_op
-            self.ops['xy_op'] = xy_op
-
-            # Nodes for yhat/sigma computation
-            K2 = tf.placeholder(tf.float32, name="K2")
-            K3 = tf.placeholder(tf.float32, name="K3")
-            yhat_ = tf.cast(tf.matmul(tf.transpose(K2), xy_), tf.float32)
+            entry.vars['K_h'] = K
+            entry.vars['K_inv_h'] = K_inv
+            entry.vars['xy_h'] = xy_
+            entry.vars['yt_h'] = yt_
+            entry.ops['K_inv_op'] = K_inv_op
+            entry.ops['xy_op'] = xy_op
+
+            # Nodes for the Cholesky solver: K = LL^T, xy = L^T \ (L \ yt)
+            K_chol = tf.placeholder(dtype, name='K_chol')
+            K_chol_op = tf.cholesky(K)
+            if self.check_numerics:
+                K_chol_op = tf.check_numerics(K_chol_op, "K_chol: ")
+            xy_chol_op = tf.cholesky_solve(K_chol, yt_)
+            if self.check_numerics:
+                xy_chol_op = tf.check_numerics(xy_chol_op, "xy_: ")
+
+            entry.vars['K_chol_h'] = K_chol
+            entry.ops['K_chol_op'] = K_chol_op
+            entry.ops['xy_chol_op'] = xy_chol_op
+
+            # Nodes for yhat/sigma computation. K2 is the kernel between the
+            # training data (X1) and the test data (X2). Only the diagonal of
+            # the predictive covariance is computed; the prior variance of
+            # every test point is the magnitude.
+            K2 = K_op
+            yhat_ = tf.matmul(tf.transpose(K2), xy_)
             if self.check_numerics:
                 yhat_ = tf.check_numerics(yhat_, "yhat_: ")
-            sv1 = tf.matmul(tf.transpose(K2), tf.matmul(K_inv, K2))
+            sv1 = tf.reduce_sum(K2 * tf.matmul(K_inv, K2), 0)
             if self.check_numerics:
                 sv1 = tf.check_numerics(sv1, "sv1: ")
-            sig_val = tf.cast((tf.sqrt(tf.diag_part(K3 - sv1))), tf.float32)
+            sig_val = tf.sqrt(tf.maximum(mag_const - sv1, 0.0))
             if self.check_numerics:
                 sig_val = tf.check_numerics(sig_val, "sig_val: ")
 
-            self.vars['K2_h'] = K2
-            self.vars['K3_h'] = K3
-            self.ops['yhat_op'] = yhat_
-            self.ops['sig_op'] = sig_val
+            v = tf.matrix_triangular_solve(K_chol, K2, lower=True)
+            sig_chol = tf.sqrt(tf.maximum(mag_const - tf.reduce_sum(tf.square(v), 0), 0.0))
+            if self.check_numerics:
+                sig_chol = tf.check_numerics(sig_chol, "sig_chol: ")
+
+            entry.ops['yhat_op'] = yhat_
+            entry.ops['sig_op'] = sig_val
+            entry.ops['sig_chol_op'] = sig_chol
 
             # Compute y_best (min y)
-            y_best_op = tf.cast(tf.reduce_min(yt_, 0, True), tf.float32)
+            y_best_op = tf.reduce_min(yt_, 0, True)
             if self.check_numerics:
                 y_best_op = tf.check_numerics(y_best_op, "y_best_op: ")
-            self.ops['y_best_op'] = y_best_op
+            entry.ops['y_best_op'] = y_best_op
 
-            sigma = tf.placeholder(tf.float32, name='sigma')
-            yhat = tf.placeholder(tf.float32, name='yhat')
+            sigma = tf.placeholder(dtype, name='sigma')
+            yhat = tf.placeholder(dtype, name='yhat')
 
-            self.vars['sigma_h'] = sigma
-            self.vars['yhat_h'] = yhat
+            entry.vars['sigma_h'] = sigma
+            entry.vars['yhat_h'] = yhat
 
     def __repr__(self):
         rep = ""
@@ -159,9 +215,10 @@ class GPR(object):
         if X.shape[0] > self.max_train_size_:
             raise Exception("X_train size cannot exceed {} ({})"
                             .format(self.max_train_size_, X.shape[0]))
-        return check_X_y(X, y, multi_output=True,
+        X, y = check_X_y(X, y, multi_output=True,
                          allow_nd=True, y_numeric=True,
-                         estimator="GPR")
+                         dtype=self.dtype, estimator="GPR")
+        return X, np.asarray(y, dtype=self.dtype)
 
     def check_fitted(self):
         if self.X_train is None or self.y_train is None \
@@ -169,9 +226,9 @@ class GPR(object):
             raise Exception("The model must be trained before making predictions!")
 
     @staticmethod
-    def check_array(X):
+    def check_array(X, dtype="numeric"):
         from sklearn.utils.validation import check_array
-        return check_array(X, allow_nd=True, estimator="GPR")
+        return check_array(X, allow_nd=True, dtype=dtype, estimator="GPR")
 
     @staticmethod
     def check_output(X):
@@ -183,8 +240,8 @@ class GPR(object):
     def fit(self, X_train, y_train, ridge=1.0):
         self._reset()
         X_train, y_train = self.check_X_y(X_train, y_train)
-        self.X_train = np.float32(X_train)
-        self.y_train = np.float32(y_train)
+        self.X_train = X_train
+        self.y_train = y_train
         sample_size = self.X_train.shape[0]
 
         if np.isscalar(ridge):
@@ -192,60 +249,120 @@ class GPR(object):
         assert isinstance(ridge, np.ndarray)
         assert ridge.ndim == 1
 
-        X_dists = np.zeros((sample_size, sample_size), dtype=np.float32)
-        with tf.Session(graph=self.graph,
-                        config=tf.ConfigProto(
-                            intra_op_parallelism_threads=self.num_threads_)) as sess:
-            dist_op = self.ops['dist_op']
-            v1, v2 = self.vars['v1_h'], self.vars['v2_h']
-            for i in range(sample_size):
-                X_dists[i] = sess.run(dist_op, feed_dict={v1: self.X_train[i], v2: self.X_train})
-
-            K_ridge_op = self.ops['K_ridge_op']
-            X_dists_ph = self.vars['X_dists_h']
-            ridge_ph = self.vars['ridge_h']
-
-            self.K = sess.run(K_ridge_op, feed_dict={X_dists_ph: X_dists, ridge_ph: ridge})
-
-            K_ph = self.vars['K_h']
+        with self.build_graph() as entry:
+            sess = entry.session
+            self.K = self._kernel_matrix(entry, self.X_train, self.X_train, ridge)
+
+            K_ph = entry.vars['K_h']
+            yt_ph = entry.vars['yt_h']
+
+            if self.solver == GPR.SOLVER_CHOLESKY:
+                self.K_chol, self.jitter = self._cholesky_with_jitter(entry)
+                xy_op = entry.ops['xy_chol_op']
+                K_chol_ph = entry.vars['K_chol_h']
+                self.xy_ = sess.run(xy_op, feed_dict={K_chol_ph: self.K_chol,
+                                                      yt_ph: self.y_train})
+            else:
+                K_inv_op = entry.ops['K_inv_op']
+                self.K_inv = sess.run(K_inv_op, feed_dict={K_ph: self.K})
+
+                xy_op = entry.ops['xy_op']
+                K_inv_ph = entry.vars['K_inv_h']
+                self.xy_ = sess.run(xy_op, feed_dict={K_inv_ph: self.K_inv,
+                                                      yt_ph: self.y_train})
+        return self
 
-            K_inv_op = self.ops['K_inv_op']
-            self.K_inv = sess.run(K_inv_op, feed_dict={K_ph: self.K})
+    def partial_fit(self, X_new, y_new, ridge=1.0):
+        # Appends new observations to a fitted model. The factorization of K
+        # is extended in O(n^2 k) (see gp.cholesky_append/inverse_append)
+        # instead of being recomputed in O(n^3), and the model predicts the
+        # same as one fit on all of the data.
+        if self.X_train is None:
+            return GPR.fit(self, X_new, y_new, ridge)
+        X_new, y_new = self.check_X_y(X_new, y_new)
+        sample_size = self.X_train.shape[0] + X_new.shape[0]
+        if sample_size > self.max_train_size_:
+            raise Exception("X_train size cannot exceed {} ({})"
+                            .format(self.max_train_size_, sample_size))
+        if np.isscalar(ridge):
+            ridge = np.ones(X_new.shape[0]) * ridge
+        assert isinstance(ridge, np.ndarray)
+        assert ridge.ndim == 1
 
-            xy_op = self.ops['xy_op']
-            K_inv_ph = self.vars['K_inv_h']
-            yt_ph = self.vars['yt_h']
-            self.xy_ = sess.run(xy_op, feed_dict={K_inv_ph: self.K_inv,
-                                                  yt_ph: self.y_train})
+        with self.build_graph() as entry:
+            sess = entry.session
+            K_cross = self._kernel_matrix(entry, self.X_train, X_new)
+            K_new = self._kernel_matrix(entry, X_new, X_new, ridge)
+            self.K = np.vstack((np.hstack((self.K, K_cross)),
+                                np.hstack((np.transpose(K_cross), K_new))))
+            self.X_train = np.vstack((self.X_train, X_new))
+            self.y_train = np.vstack((self.y_train, y_new))
+
+            yt_ph = entry.vars['yt_h']
+            if self.solver == GPR.SOLVER_CHOLESKY:
+                try:
+                    if self.jitter != 0.0:
+                        # The old factor includes a jitter that a refit may not need
+                        raise np.linalg.LinAlgError("Factor of K includes a jitter")
+                    self.K_chol = cholesky_append(
+                        np.float64(self.K_chol), np.float64(K_cross),
+                        np.float64(K_new)).astype(self.dtype)
+                except np.linalg.LinAlgError:
+                    self.K_chol, self.jitter = self._cholesky_with_jitter(entry)
+                self.xy_ = sess.run(entry.ops['xy_chol_op'],
+                                    feed_dict={entry.vars['K_chol_h']: self.K_chol,
+                                               yt_ph: self.y_train})
+            else:
+                self.K_inv = inverse_append(
+                    np.float64(self.K_inv), np.float64(K_cross),
+                    np.float64(K_new)).astype(self.dtype)
+                self.xy_ = sess.run(entry.ops['xy_op'],
+                                    feed_dict={entry.vars['K_inv_h']: self.K_inv,
+                                               yt_ph: self.y_train})
         return self
 
+    def _cholesky_with_jitter(self, entry, init_jitter=1e-6):
+        # Factorizes self.K. If it is not numerically positive definite then
+        # a jitter of init_jitter * mean(diag(K)) is added to the diagonal
+        # and increased tenfold on each retry (see gp.cholesky_with_jitter).
+        K_chol_op = entry.ops['K_chol_op']
+        K_ph = entry.vars['K_h']
+        jitter = 0.0
+        scale = np.mean(np.diag(self.K))
+        for i in range(self.max_jitter_tries + 1):
+            K = self.K if jitter == 0.0 else \
+                self.K + self.dtype.type(jitter) * np.eye(self.K.shape[0], dtype=self.dtype)
+            try:
+                return entry.session.run(K_chol_op, feed_dict={K_ph: K}), jitter
+            except tf.errors.InvalidArgumentError:
+                jitter = init_jitter * scale * 10 ** i
+                LOG.warning("Cholesky decomposition failed, retrying with jitter=%s", jitter)
+        raise Exception("Cholesky decomposition failed after {} retries (jitter={})"
+                        .format(self.max_jitter_tries, jitter))
+
     def predict(self, X_test):
         self.check_fitted()
-        X_test = np.float32(GPR.check_array(X_test))
+        X_test = GPR.check_array(X_test, dtype=self.dtype)
         test_size = X_test.shape[0]
-        sample_size = self.X_train.shape[0]
 
         arr_offset = 0
         yhats = np.zeros([test_size, 1])
         sigmas = np.zeros([test_size, 1])
-        with tf.Session(graph=self.graph,
-                        config=tf.ConfigProto(
-                            intra_op_parallelism_threads=self.num_threads_)) as sess:
-            # Nodes for distance operation
-            dist_op = self.ops['dist_op']
-            v1 = self.vars['v1_h']
-            v2 = self.vars['v2_h']
-
-            # Nodes for kernel computation
-            K_op = self.ops['K_op']
-            X_dists = self.vars['X_dists_h']
+        with self.build_graph() as entry:
+            sess = entry.session
+            # Nodes for the kernel inputs
+            X1_ph = entry.vars['X1_h']
+            X2_ph = entry.vars['X2_h']
 
             # Nodes to compute yhats/sigmas
-            yhat_ = self.ops['yhat_op']
-            K_inv_ph = self.vars['K_inv_h']
-            K2 = self.vars['K2_h']
-            K3 = self.vars['K3_h']
-            xy_ph = self.vars['xy_h']
+            yhat_ = entry.ops['yhat_op']
+            xy_ph = entry.vars['xy_h']
+            if self.solver == GPR.SOLVER_CHOLESKY:
+                sig_val = entry.ops['sig_chol_op']
+                factor_ph, factor = entry.vars['K_chol_h'], self.K_chol
+            else:
+                sig_val = entry.ops['sig_op']
+                factor_ph, factor = entry.vars['K_inv_h'], self.K_inv
 
             while arr_offset < test_size:
                 if arr_offset + self.batch_size_ > test_size:
@@ -254,26 +371,15 @@ class GPR(object):
                     end_offset = arr_offset + self.batch_size_
 
                 X_test_batch = X_test[arr_offset:end_offset]
-                batch_len = end_offset - arr_offset
-
-                dists1 = np.zeros([sample_size, batch_len])
-                for i in range(sample_size):
-                    dists1[i] = sess.run(dist_op, feed_dict={v1: self.X_train[i],
-                                                             v2: X_test_batch})
-
-                sig_val = self.ops['sig_op']
-                K2_ = sess.run(K_op, feed_dict={X_dists: dists1})
-                yhat = sess.run(yhat_, feed_dict={K2: K2_, xy_ph: self.xy_})
-                dists2 = np.zeros([batch_len, batch_len])
-                for i in range(batch_len):
-                    dists2[i] = sess.run(dist_op, feed_dict={v1: X_test_batch[i], v2: X_test_batch})
-                K3_ = sess.run(K_op, feed_dict={X_dists: dists2})
-
-                sigma = np.zeros([1, batch_len], np.float32)
-                sigma[0] = sess.run(sig_val, feed_dict={K_inv_ph: self.K_inv, K2: K2_, K3: K3_})
-                sigma = np.transpose(sigma)
+
+                # K2, yhat and sigma are all computed in a single run
+                yhat, sigma = sess.run([yhat_, sig_val],
+                                       feed_dict={X1_ph: self.X_train,
+                                                  X2_ph: X_test_batch,
+                                                  factor_ph: factor,
+                                                  xy_ph: self.xy_})
                 yhats[arr_offset: end_offset] = yhat
-                sigmas[arr_offset: end_offset] = sigma
+                sigmas[arr_offset: end_offset] = sigma.reshape(-1, 1)
                 arr_offset = end_offset
         GPR.check_output(yhats)
         GPR.check_output(sigmas)
@@ -286,7 +392,8 @@ class GPR(object):
                 "y_train": self.y_train,
                 "xy_": self.xy_,
                 "K": self.K,
-                "K_inv": self.K_inv}
+                "K_inv": self.K_inv,
+                "K_chol": self.K_chol}
 
     def set_params(self, **parameters):
         for param, val in list(parameters.items()):
@@ -299,9 +406,11 @@ class GPR(object):
         self.xy_ = None
         self.K = None
         self.K_inv = None
-        self.graph = None
-        self.build_graph()
-        gc.collect()
+        self.K_chol = None
+        self.jitter = None
+        if not self.use_graph_cache:
+            self.graph_cache_.clear()
+            gc.collect()
 
 
 class GPRGD(GPR):
@@ -309,6 +418,11 @@ class GPRGD(GPR):
     GP_BETA_UCB = "UCB"
     GP_BETA_CONST = "CONST"
 
+    # Optimize the starting points one at a time or all together as a
+    # single (n_starts x n_features) variable
+    GD_SERIAL = "serial"
+    GD_BATCHED = "batched"
+
     def __init__(self,
                  length_scale=1.0,
                  magnitude=1.0,
@@ -319,49 +433,94 @@ class GPRGD(GPR):
                  epsilon=1e-6,
                  max_iter=100,
                  sigma_multiplier=3.0,
-                 mu_multiplier=1.0):
+                 mu_multiplier=1.0,
+                 solver=GPR.SOLVER_INVERSE,
+                 gd_method=GD_SERIAL,
+                 loss_tol=None,
+                 grad_tol=None,
+                 patience=10,
+                 use_graph_cache=True,
+                 dtype=np.float32,
+                 kernel_type=EXPONENTIAL):
         super(GPRGD, self).__init__(length_scale=length_scale,
                                     magnitude=magnitude,
                                     max_train_size=max_train_size,
                                     batch_size=batch_size,
-                                    num_threads=num_threads)
+                                    num_threads=num_threads,
+                                    solver=solver,
+                                    use_graph_cache=use_graph_cache,
+                                    dtype=dtype,
+                                    kernel_type=kernel_type)
         self.learning_rate = learning_rate
         self.epsilon = epsilon
         self.max_iter = max_iter
         self.sigma_multiplier = sigma_multiplier
         self.mu_multiplier = mu_multiplier
+        if gd_method not in (GPRGD.GD_SERIAL, GPRGD.GD_BATCHED):
+            raise Exception("Unknown gradient descent method: {}".format(gd_method))
+        self.gd_method = gd_method
+        # A start point has converged once the change in its loss is at most
+        # loss_tol, or the norm of its gradient is at most grad_tol, for
+        # patience consecutive iterations (None disables a criterion).
+        self.loss_tol = loss_tol
+        self.grad_tol = grad_tol
+        self.patience = patience
         self.X_min = None
         self.X_max = None
 
     def fit(self, X_train, y_train, X_min, X_max, ridge):  # pylint: disable=arguments-differ
         super(GPRGD, self).fit(X_train, y_train, ridge)
-        self.X_min = X_min
-        self.X_max = X_max
-
-        with tf.Session(graph=self.graph,
-                        config=tf.ConfigProto(
-                            intra_op_parallelism_threads=self.num_threads_)) as sess:
-            xt_ = tf.Variable(self.X_train[0], tf.float32)
-            xt_ph = tf.placeholder(tf.float32)
+        self.X_min = np.asarray(X_min, dtype=self.dtype)
+        self.X_max = np.asarray(X_max, dtype=self.dtype)
+        return self
+
+    def build_gd_graph(self):
+        # Returns a context manager that holds the (cached) graph entry with
+        # the gradient descent nodes
+        key = ('GPRGD', self.kernel_type, self.length_scale, self.magnitude,
+               self.check_numerics, self.num_threads_, self.X_train.shape[1], self.solver,
+               self.learning_rate, self.epsilon, self.sigma_multiplier,
+               self.mu_multiplier, self.dtype.name)
+        return self.graph_cache_.use(key, self._build_gd_nodes, self.num_threads_)
+
+    def _build_gd_nodes(self, entry):
+        nfeats = self.X_train.shape[1]
+        dtype = tf.as_dtype(self.dtype)
+        with entry.graph.as_default():
+            # The training data and the factorization of K (K_inv or K_chol)
+            # are loaded into variables by _load_training_data so that the
+            # nodes do not depend on a particular fit
+            X_train_ph = tf.placeholder(dtype, shape=[None, nfeats])
+            xy_ph = tf.placeholder(dtype, shape=[None, 1])
+            factor_ph = tf.placeholder(dtype, shape=[None, None])
+            X_train = tf.Variable(X_train_ph, trainable=False, validate_shape=False)
+            xy_ = tf.Variable(xy_ph, trainable=False, validate_shape=False)
+            factor = tf.Variable(factor_ph, trainable=False, validate_shape=False)
+            entry.vars['X_train_h'] = X_train_ph
+            entry.vars['xy_h'] = xy_ph
+            entry.vars['factor_h'] = factor_ph
+            entry.ops['load_data_op'] = tf.variables_initializer([X_train, xy_, factor])
+
+            # Nodes for the serial method: one starting point at a time
+            xt_ = tf.Variable(tf.zeros([nfeats], dtype=dtype))
+            xt_ph = tf.placeholder(dtype)
             xt_assign_op = xt_.assign(xt_ph)
-            init = tf.global_variables_initializer()
-            sess.run(init)
-            K2_mat = tf.transpose(tf.expand_dims(tf.sqrt(tf.reduce_sum(tf.pow(
-                tf.subtract(xt_, self.X_train), 2), 1)), 0))
-            if self.check_numerics is True:
-                K2_mat = tf.check_numerics(K2_mat, "K2_mat: ")
-            K2__ = tf.cast(self.magnitude * tf.exp(-K2_mat / self.length_scale), tf.float32)
+            K2__ = tf.transpose(self.kernel_op(tf.expand_dims(xt_, 0), X_train, dtype))
             if self.check_numerics is True:
                 K2__ = tf.check_numerics(K2__, "K2__: ")
-            yhat_gd = tf.cast(tf.matmul(tf.transpose(K2__), self.xy_), tf.float32)
+            yhat_gd = tf.matmul(tf.transpose(K2__), xy_)
             if self.check_numerics is True:
                 yhat_gd = tf.check_numerics(yhat_gd, message="yhat: ")
-            sig_val = tf.cast((tf.sqrt(self.magnitude - tf.matmul(
-                tf.transpose(K2__), tf.matmul(self.K_inv, K2__)))), tf.float32)
+            # The variance is clamped (at the same floor as GPRGDNP) so that
+            # the gradient of sqrt stays finite
+            if self.solver == GPR.SOLVER_CHOLESKY:
+                v = tf.matrix_triangular_solve(factor, K2__, lower=True)
+                var = self.magnitude - tf.matmul(v, v, transpose_a=True)
+            else:
+                var = self.magnitude - tf.matmul(tf.transpose(K2__), tf.matmul(factor, K2__))
+            sig_val = tf.sqrt(tf.maximum(var, GPRGDNP.MIN_VARIANCE))
             if self.check_numerics is True:
                 sig_val = tf.check_numerics(sig_val, message="sigma: ")
-            LOG.debug("\nyhat_gd : %s", str(sess.run(yhat_gd)))
-            LOG.debug("\nsig_val : %s", str(sess.run(sig_val)))
 
             loss = tf.squeeze(tf.subtract(self.mu_multiplier * yhat_gd,
                                           self.sigma_multiplier * sig_val))
@@ -370,22 +529,125 @@ class GPRGD(GPR):
             optimizer = tf.train.AdamOptimizer(learning_rate=self.learning_rate,
                                                epsilon=self.epsilon)
             # optimizer = tf.train.GradientDescentOptimizer(learning_rate=self.learning_rate)
-            train = optimizer.minimize(loss)
-
-            self.vars['xt_'] = xt_
-            self.vars['xt_ph'] = xt_ph
-            self.ops['xt_assign_op'] = xt_assign_op
-            self.ops['yhat_gd'] = yhat_gd
-            self.ops['sig_val2'] = sig_val
-            self.ops['loss_op'] = loss
-            self.ops['train_op'] = train
-        return self
+            train = optimizer.minimize(loss, var_list=[xt_])
+            # Reads xt_ after the training step has been applied
+            with tf.control_dependencies([train]):
+                train_xt = xt_.read_value()
+            grad = tf.gradients(loss, xt_)[0]
+
+            entry.vars['xt_'] = xt_
+            entry.vars['xt_ph'] = xt_ph
+            entry.ops['xt_assign_op'] = xt_assign_op
+            entry.ops['yhat_gd'] = yhat_gd
+            entry.ops['sig_val2'] = sig_val
+            entry.ops['loss_op'] = loss
+            entry.ops['train_op'] = train
+            entry.ops['train_xt_op'] = train_xt
+            entry.ops['grad_op'] = grad
+            entry.ops['init_op'] = tf.variables_initializer([xt_] + optimizer.variables())
+
+            # Nodes for the batched method: all starting points of a batch
+            # together. The loss of each row only depends on that row, so
+            # minimizing the sum of the losses moves every row along its own
+            # gradient. The number of rows is set when the variable is
+            # initialized from xt_ph, so one set of nodes serves every batch.
+            xt_ph = tf.placeholder(dtype, shape=[None, nfeats])
+            xt_ = tf.Variable(xt_ph, validate_shape=False)
+            xt_assign_op = xt_.assign(xt_ph)
+            yhat_gd, sig_val, loss = self._batched_loss_nodes(xt_, X_train, xy_, factor, dtype)
+            optimizer = tf.train.AdamOptimizer(learning_rate=self.learning_rate,
+                                               epsilon=self.epsilon)
+            train = optimizer.minimize(tf.reduce_sum(loss), var_list=[xt_])
+            with tf.control_dependencies([train]):
+                train_xt = xt_.read_value()
+            grad = tf.gradients(tf.reduce_sum(loss), xt_)[0]
+            entry.ops['batched_gd'] = {
+                'xt_': xt_,
+                'xt_ph': xt_ph,
+                'xt_assign_op': xt_assign_op,
+                'yhat_gd': yhat_gd,
+                'sig_val': sig_val,
+                'loss_op': loss,
+                'train_op': train,
+                'train_xt_op': train_xt,
+                'grad_op': grad,
+                'init_op': tf.variables_initializer([xt_] + optimizer.variables()),
+            }
+
+            # Nodes that score a batch of confs (e.g., the categorical hill
+            # climbing candidates) in one run, for either method
+            X_score_ph = tf.placeholder(dtype, shape=[None, nfeats])
+            entry.vars['X_score_h'] = X_score_ph
+            entry.ops['score_loss_op'] = self._batched_loss_nodes(
+                X_score_ph, X_train, xy_, factor, dtype)[2]
+
+    def _batched_loss_nodes(self, X, X_train, xy_, factor, dtype):
+        # Returns the yhat, sigma and loss nodes of each row of X
+        K2__ = self.kernel_op(X, X_train, dtype)
+        if self.check_numerics is True:
+            K2__ = tf.check_numerics(K2__, "K2__: ")
+        yhat_gd = tf.squeeze(tf.matmul(K2__, xy_), 1)
+        if self.solver == GPR.SOLVER_CHOLESKY:
+            v = tf.matrix_triangular_solve(factor, tf.transpose(K2__), lower=True)
+            var = self.magnitude - tf.reduce_sum(tf.square(v), 0)
+        else:
+            var = self.magnitude - tf.reduce_sum(K2__ * tf.matmul(K2__, factor), 1)
+        sig_val = tf.sqrt(tf.maximum(var, GPRGDNP.MIN_VARIANCE))
+        if self.check_numerics is True:
+            sig_val = tf.check_numerics(sig_val, message="sigma: ")
+        loss = self.mu_multiplier * yhat_gd - self.sigma_multiplier * sig_val
+        return yhat_gd, sig_val, loss
+
+    def _score_fn(self, entry):
+        # Returns a function computing the loss of each row of a matrix
+        # (the training data must be loaded)
+        def score(X):
+            return entry.session.run(entry.ops['score_loss_op'],
+                                     feed_dict={entry.vars['X_score_h']: X})
+        return score
+
+    def _load_training_data(self, entry):
+        factor = self.K_chol if self.solver == GPR.SOLVER_CHOLESKY else self.K_inv
+        entry.session.run(entry.ops['load_data_op'],
+                          feed_dict={entry.vars['X_train_h']: self.X_train,
+                                     entry.vars['xy_h']: self.xy_,
+                                     entry.vars['factor_h']: factor})
+
+    def _release_training_data(self, entry):
+        # Cached entries should not keep the (n x n) factorization alive
+        nfeats = self.X_train.shape[1]
+        entry.session.run(entry.ops['load_data_op'],
+                          feed_dict={entry.vars['X_train_h']: np.zeros((0, nfeats)),
+                                     entry.vars['xy_h']: np.zeros((0, 1)),
+                                     entry.vars['factor_h']: np.zeros((0, 0))})
 
     def predict(self, X_test, constraint_helper=None,  # pylint: disable=arguments-differ
                 categorical_feature_method='hillclimbing',
-                categorical_feature_steps=3):
+                categorical_feature_steps=3,
+                categorical_feature_candidates=1, deadline=None):
+        # Once the deadline (a time.time() timestamp) has passed, the best
+        # configurations found so far are returned
         self.check_fitted()
-        X_test = np.float32(GPR.check_array(X_test))
+        with self.build_gd_graph() as entry:
+            self._load_training_data(entry)
+            try:
+                if self.gd_method == GPRGD.GD_BATCHED:
+                    return self._predict_batched(entry, X_test, constraint_helper,
+                                                 categorical_feature_method,
+                                                 categorical_feature_steps,
+                                                 categorical_feature_candidates, deadline)
+                return self._predict_serial(entry, X_test, constraint_helper,
+                                            categorical_feature_method,
+                                            categorical_feature_steps,
+                                            categorical_feature_candidates, deadline)
+            finally:
+                self._release_training_data(entry)
+
+    def _predict_serial(self, entry, X_test, constraint_helper=None,
+                        categorical_feature_method='hillclimbing',
+                        categorical_feature_steps=3,
+                        categorical_feature_candidates=1, deadline=None):
+        X_test = GPR.check_array(X_test, dtype=self.dtype)
         test_size = X_test.shape[0]
         nfeats = self.X_train.shape[1]
 
@@ -394,211 +656,223 @@ class GPRGD(GPR):
         sigmas = np.zeros([test_size, 1])
         minls = np.zeros([test_size, 1])
         minl_confs = np.zeros([test_size, nfeats])
-
-        with tf.Session(graph=self.graph,
-                        config=tf.ConfigProto(
-                            intra_op_parallelism_threads=self.num_threads_)) as sess:
-            while arr_offset < test_size:
-                if arr_offset + self.batch_size_ > test_size:
-                    end_offset = test_size
+        n_iters = np.zeros([test_size, 1])
+
+        sess = entry.session
+        while arr_offset < test_size:
+            if arr_offset + self.batch_size_ > test_size:
+                end_offset = test_size
+            else:
+                end_offset = arr_offset + self.batch_size_
+
+            X_test_batch = X_test[arr_offset:end_offset]
+            batch_len = end_offset - arr_offset
+
+            xt_ = entry.vars['xt_']
+            sess.run(entry.ops['init_op'])
+
+            loss = entry.ops['loss_op']
+            train_xt = entry.ops['train_xt_op']
+            step_fetches = [entry.ops['yhat_gd'], entry.ops['sig_val2'], loss, xt_]
+            if self.grad_tol is not None:
+                step_fetches.append(entry.ops['grad_op'])
+
+            xt_ph = entry.vars['xt_ph']
+            assign_op = entry.ops['xt_assign_op']
+
+            yhat = np.empty((batch_len, 1))
+            sigma = np.empty((batch_len, 1))
+            minl = np.empty((batch_len, 1))
+            minl_conf = np.empty((batch_len, nfeats))
+            n_iter = np.empty((batch_len, 1))
+            for i in range(batch_len):
+                if self.debug is True:
+                    LOG.info("-------------------------------------------")
+                yhats_it = np.empty((self.max_iter + 1,)) * np.nan
+                sigmas_it = np.empty((self.max_iter + 1,)) * np.nan
+                losses_it = np.empty((self.max_iter + 1,)) * np.nan
+                confs_it = np.empty((self.max_iter + 1, nfeats)) * np.nan
+
+                sess.run(assign_op, feed_dict={xt_ph: X_test_batch[i]})
+                stalls = 0
+                for step in range(self.max_iter + 1):
+                    if self.debug is True:
+                        LOG.info("Batch %d, iter %d:", i, step)
+                    # All per-step values are fetched in a single run
+                    values = sess.run(step_fetches)
+                    yhats_it[step] = values[0][0][0]
+                    sigmas_it[step] = values[1][0][0]
+                    losses_it[step] = values[2]
+                    confs_it[step] = values[3]
+                    if self.debug is True:
+                        LOG.info("    yhat:  %s", str(yhats_it[step]))
+                        LOG.info("    sigma: %s", str(sigmas_it[step]))
+                        LOG.info("    loss:  %s", str(losses_it[step]))
+                        LOG.info("    conf:  %s", str(confs_it[step]))
+                    stalls = self._update_stalls(
+                        stalls, losses_it[step - 1] if step > 0 else None,
+                        losses_it[step], confs_it[step],
+                        values[4] if len(values) > 4 else None)
+                    out_of_time = deadline_passed(deadline)
+                    if stalls >= self.patience or step == self.max_iter or out_of_time:
+                        # Results from the final iteration have been recorded
+                        break
+                    # Run the training step and read back the new xt
+                    xt = sess.run(train_xt)
+                    # constraint Projected Gradient Descent
+                    xt_valid = np.minimum(xt, self.X_max)
+                    xt_valid = np.maximum(xt_valid, self.X_min)
+                    if constraint_helper is not None:
+                        xt_valid = constraint_helper.apply_constraints(xt_valid)
+                        if categorical_feature_method == 'hillclimbing':
+                            if step % categorical_feature_steps == 0:
+                                xt_valid = hillclimb_categorical_features(
+                                    self._score_fn(entry), xt_valid.reshape(1, -1),
+                                    constraint_helper, categorical_feature_candidates)[0]
+                        else:
+                            raise Exception("Unknown categorial feature method: {}".format(
+                                categorical_feature_method))
+                    sess.run(assign_op, feed_dict={xt_ph: xt_valid})
+                n_iter[i] = step
+                assert np.all(np.isfinite(yhats_it[:step + 1]))
+                assert np.all(np.isfinite(sigmas_it[:step + 1]))
+                assert np.all(np.isfinite(losses_it[:step + 1]))
+                assert np.all(np.isfinite(confs_it[:step + 1]))
+
+                # Store info for conf with min loss from all iters
+                if np.all(~np.isfinite(losses_it)):
+                    min_loss_idx = 0
                 else:
-                    end_offset = arr_offset + self.batch_size_
-
-                X_test_batch = X_test[arr_offset:end_offset]
-                batch_len = end_offset - arr_offset
+                    min_loss_idx = np.nanargmin(losses_it)
+                yhat[i] = yhats_it[min_loss_idx]
+                sigma[i] = sigmas_it[min_loss_idx]
+                minl[i] = losses_it[min_loss_idx]
+                minl_conf[i] = confs_it[min_loss_idx]
+
+            minls[arr_offset:end_offset] = minl
+            minl_confs[arr_offset:end_offset] = minl_conf
+            yhats[arr_offset:end_offset] = yhat
+            sigmas[arr_offset:end_offset] = sigma
+            n_iters[arr_offset:end_offset] = n_iter
+            arr_offset = end_offset
 
-                xt_ = self.vars['xt_']
-                init = tf.global_variables_initializer()
-                sess.run(init)
+        GPR.check_output(yhats)
+        GPR.check_output(sigmas)
+        GPR.check_output(minls)
+        GPR.check_output(minl_confs)
 
-                sig_val = self.ops['sig_val2']
-                yhat_gd = self.ops['yhat_gd']
-                loss = self.ops['loss_op']
-                train = self.ops['train_op']
+        return GPRGDResult(yhats, sigmas, minls, minl_confs, n_iters)
 
-                xt_ph = self.vars['xt_ph']
-                assign_op = self.ops['xt_assign_op']
+    def _predict_batched(self, entry, X_test, constraint_helper=None,
+                         categorical_feature_method='hillclimbing',
+                         categorical_feature_steps=3,
+                         categorical_feature_candidates=1, deadline=None):
+        X_test = GPR.check_array(X_test, dtype=self.dtype)
+        if constraint_helper is not None and categorical_feature_method != 'hillclimbing':
+            raise Exception("Unknown categorial feature method: {}".format(
+                categorical_feature_method))
+        test_size = X_test.shape[0]
+        nfeats = self.X_train.shape[1]
 
-                yhat = np.empty((batch_len, 1))
-                sigma = np.empty((batch_len, 1))
-                minl = np.empty((batch_len, 1))
-                minl_conf = np.empty((batch_len, nfeats))
-                for i in range(batch_len):
-                    if self.debug is True:
-                        LOG.info("-------------------------------------------")
-                    yhats_it = np.empty((self.max_iter + 1,)) * np.nan
-                    sigmas_it = np.empty((self.max_iter + 1,)) * np.nan
-                    losses_it = np.empty((self.max_iter + 1,)) * np.nan
-                    confs_it = np.empty((self.max_iter + 1, nfeats)) * np.nan
-
-                    sess.run(assign_op, feed_dict={xt_ph: X_test_batch[i]})
-                    step = 0
-                    for step in range(self.max_iter):
-                        if self.debug is True:
-                            LOG.info("Batch %d, iter %d:", i, step)
-                        yhats_it[step] = sess.run(yhat_gd)[0][0]
-                        sigmas_it[step] = sess.run(sig_val)[0][0]
-                        losses_it[step] = sess.run(loss)
-                        confs_it[step] = sess.run(xt_)
-                        if self.debug is True:
-                            LOG.info("    yhat:  %s", str(yhats_it[step]))
-                            LOG.info("    sigma: %s", str(sigmas_it[step]))
-                            LOG.info("    loss:  %s", str(losses_it[step]))
-                            LOG.info("    conf:  %s", str(confs_it[step]))
-                        sess.run(train)
-                        # constraint Projected Gradient Descent
-                        xt = sess.run(xt_)
-                        xt_valid = np.minimum(xt, self.X_max)
-                        xt_valid = np.maximum(xt_valid, self.X_min)
-                        sess.run(assign_op, feed_dict={xt_ph: xt_valid})
-                        if constraint_helper is not None:
-                            xt_valid = constraint_helper.apply_constraints(sess.run(xt_))
-                            sess.run(assign_op, feed_dict={xt_ph: xt_valid})
-                            if categorical_feature_method == 'hillclimbing':
-                                if step % categorical_feature_steps == 0:
-                                    current_xt = sess.run(xt_)
-                                    current_loss = sess.run(loss)
-                                    new_xt = \
-                                        constraint_helper.randomize_categorical_features(
-                                            current_xt)
-                                    sess.run(assign_op, feed_dict={xt_ph: new_xt})
-                                    new_loss = sess.run(loss)
-                                    if current_loss < new_loss:
-                                        sess.run(assign_op, feed_dict={xt_ph: new_xt})
-                            else:
-                                raise Exception("Unknown categorial feature method: {}".format(
-                                    categorical_feature_method))
-                    if step == self.max_iter - 1:
-                        # Record results from final iteration
-                        yhats_it[-1] = sess.run(yhat_gd)[0][0]
-                        sigmas_it[-1] = sess.run(sig_val)[0][0]
-                        losses_it[-1] = sess.run(loss)
-                        confs_it[-1] = sess.run(xt_)
-                        assert np.all(np.isfinite(yhats_it))
-                        assert np.all(np.isfinite(sigmas_it))
-                        assert np.all(np.isfinite(losses_it))
-                        assert np.all(np.isfinite(confs_it))
-
-                    # Store info for conf with min loss from all iters
-                    if np.all(~np.isfinite(losses_it)):
-                        min_loss_idx = 0
-                    else:
-                        min_loss_idx = np.nanargmin(losses_it)
-                    yhat[i] = yhats_it[min_loss_idx]
-                    sigma[i] = sigmas_it[min_loss_idx]
-                    minl[i] = losses_it[min_loss_idx]
-                    minl_conf[i] = confs_it[min_loss_idx]
-
-                minls[arr_offset:end_offset] = minl
-                minl_confs[arr_offset:end_offset] = minl_conf
-                yhats[arr_offset:end_offset] = yhat
-                sigmas[arr_offset:end_offset] = sigma
-                arr_offset = end_offset
+        arr_offset = 0
+        yhats = np.zeros([test_size, 1])
+        sigmas = np.zeros([test_size, 1])
+        minls = np.zeros([test_size, 1])
+        minl_confs = np.zeros([test_size, nfeats])
+        n_iters = np.zeros([test_size, 1])
+
+        sess = entry.session
+        ops = entry.ops['batched_gd']
+        xt_ph = ops['xt_ph']
+        assign_op = ops['xt_assign_op']
+        loss = ops['loss_op']
+        train_xt = ops['train_xt_op']
+        step_fetches = [ops['yhat_gd'], ops['sig_val'], loss, ops['xt_']]
+        if self.grad_tol is not None:
+            step_fetches.append(ops['grad_op'])
+        while arr_offset < test_size:
+            if arr_offset + self.batch_size_ > test_size:
+                end_offset = test_size
+            else:
+                end_offset = arr_offset + self.batch_size_
+
+            X_test_batch = X_test[arr_offset:end_offset]
+            batch_len = end_offset - arr_offset
+
+            # Sets the starting points and resets the optimizer state
+            sess.run(ops['init_op'], feed_dict={xt_ph: X_test_batch})
+
+            # Per-row record of the conf with the min loss from all iters
+            yhat = np.empty(batch_len) * np.nan
+            sigma = np.empty(batch_len) * np.nan
+            minl = np.ones(batch_len) * np.inf
+            minl_conf = X_test_batch.copy()
+            n_iter = np.ones(batch_len) * self.max_iter
+            active = np.ones(batch_len, dtype=bool)
+            stalls = np.zeros(batch_len, dtype=int)
+            loss_prev = None
+            for step in range(self.max_iter + 1):
+                # All per-step values are fetched in a single run
+                values = sess.run(step_fetches)
+                yhat_it, sigma_it, loss_it, conf_it = values[:4]
+                improved = (loss_it < minl) & active
+                yhat[improved] = yhat_it[improved]
+                sigma[improved] = sigma_it[improved]
+                minl[improved] = loss_it[improved]
+                minl_conf[improved] = conf_it[improved]
+                if self.debug is True:
+                    LOG.info("Iter %d: min loss %s", step, str(minl))
+
+                # Starts that have converged keep their current conf
+                stalls = self._update_stalls(stalls, loss_prev, loss_it, conf_it,
+                                             values[4] if len(values) > 4 else None)
+                loss_prev = loss_it
+                converged = active & (stalls >= self.patience)
+                n_iter[converged] = step
+                active &= ~converged
+                if deadline_passed(deadline):
+                    n_iter[active] = step
+                    break
+                if step == self.max_iter or not np.any(active):
+                    # Results from the final iteration have been recorded
+                    break
+
+                # Run the training step and read back the new confs
+                xt = sess.run(train_xt)
+                # constraint Projected Gradient Descent (per row)
+                xt_valid = np.minimum(xt, self.X_max)
+                xt_valid = np.maximum(xt_valid, self.X_min)
+                if constraint_helper is not None:
+                    xt_valid = np.array([constraint_helper.apply_constraints(x)
+                                         for x in xt_valid])
+                    if step % categorical_feature_steps == 0:
+                        xt_valid = hillclimb_categorical_features(
+                            self._score_fn(entry), xt_valid, constraint_helper,
+                            categorical_feature_candidates)
+                xt_valid[~active] = conf_it[~active]
+                sess.run(assign_op, feed_dict={xt_ph: xt_valid})
+
+            minls[arr_offset:end_offset] = minl.reshape(-1, 1)
+            minl_confs[arr_offset:end_offset] = minl_conf
+            yhats[arr_offset:end_offset] = yhat.reshape(-1, 1)
+            sigmas[arr_offset:end_offset] = sigma.reshape(-1, 1)
+            n_iters[arr_offset:end_offset] = n_iter.reshape(-1, 1)
+            arr_offset = end_offset
 
         GPR.check_output(yhats)
         GPR.check_output(sigmas)
         GPR.check_output(minls)
         GPR.check_output(minl_confs)
 
-        return GPRGDResult(yhats, sigmas, minls, minl_confs)
+        return GPRGDResult(yhats, sigmas, minls, minl_confs, n_iters)
+
+    def _update_stalls(self, stalls, loss_prev, loss, xt, grad):
+        return update_stall_counts(stalls, loss_prev, loss, xt, grad,
+                                   self.X_min, self.X_max, self.loss_tol, self.grad_tol)
 
     @staticmethod
     def calculate_sigma_multiplier(t, ndim, bound=0.1):
-        assert t > 0
-        assert ndim > 0
-        assert bound > 0 and bound <= 1
-        beta = 2 * np.log(ndim * (t**2) * (np.pi**2) / 6 * bound)
-        if beta > 0:
-            beta = np.sqrt(beta)
-        else:
-            beta = 1
-        return beta
-
-
-# def gp_tf(X_train, y_train, X_test, ridge, length_scale, magnitude, batch_size=3000):
-#    with tf.Graph().as_default():
-#        y_best = tf.cast(tf.reduce_min(y_train, 0, True), tf.float32)
-#        sample_size = X_train.shape[0]
-#        train_size = X_test.shape[0]
-#        arr_offset = 0
-#        yhats = np.zeros([train_size, 1])
-#        sigmas = np.zeros([train_size, 1])
-#        eips = np.zeros([train_size, 1])
-#        X_train = np.float32(X_train)
-#        y_train = np.float32(y_train)
-#        X_test = np.float32(X_test)
-#        ridge = np.float32(ridge)
-#
-#        v1 = tf.placeholder(tf.float32,name="v1")
-#        v2 = tf.placeholder(tf.float32,name="v2")
-#        dist_op = tf.sqrt(tf.reduce_sum(tf.pow(tf.subtract(v1, v2), 2), 1))
-#        try:
-#            sess = tf.Session(config=tf.ConfigProto(log_device_placement=False))
-#
-#            dists = np.zeros([sample_size,sample_size])
-#            for i in range(sample_size):
-#                dists[i] = sess.run(dist_op,feed_dict={v1:X_train[i], v2:X_train})
-#
-#
-#            dists = tf.cast(dists, tf.float32)
-#            K = magnitude * tf.exp(-dists/length_scale) + tf.diag(ridge);
-#
-#            K2 = tf.placeholder(tf.float32, name="K2")
-#            K3 = tf.placeholder(tf.float32, name="K3")
-#
-#            x = tf.matmul(tf.matrix_inverse(K), y_train)
-#            yhat_ =  tf.cast(tf.matmul(tf.transpose(K2), x), tf.float32);
-#            sig_val = tf.cast((tf.sqrt(tf.diag_part(K3 -  tf.matmul(tf.transpose(K2),
-#                                                                    tf.matmul(tf.matrix_inverse(K),
-#                                                                              K2))))),
-#                              tf.float32)
-#
-#            u = tf.placeholder(tf.float32, name="u")
-#            phi1 = 0.5 * tf.erf(u / np.sqrt(2.0)) + 0.5
-#            phi2 = (1.0 / np.sqrt(2.0 * np.pi)) * tf.exp(tf.square(u) * (-0.5));
-#            eip = (tf.multiply(u, phi1) + phi2);
-#
-#            while arr_offset < train_size:
-#                if arr_offset + batch_size > train_size:
-#                    end_offset = train_size
-#                else:
-#                    end_offset = arr_offset + batch_size;
-#
-#                xt_ = X_test[arr_offset:end_offset];
-#                batch_len = end_offset - arr_offset
-#
-#                dists = np.zeros([sample_size, batch_len])
-#                for i in range(sample_size):
-#                    dists[i] = sess.run(dist_op, feed_dict={v1:X_train[i], v2:xt_})
-#
-#                K2_ = magnitude * tf.exp(-dists / length_scale);
-#                K2_ = sess.run(K2_)
-#
-#                dists = np.zeros([batch_len, batch_len])
-#                for i in range(batch_len):
-#                    dists[i] = sess.run(dist_op, feed_dict={v1:xt_[i], v2:xt_})
-#                K3_ = magnitude * tf.exp(-dists / length_scale);
-#                K3_ = sess.run(K3_)
-#
-#                yhat = sess.run(yhat_, feed_dict={K2:K2_})
-#
-#                sigma = np.zeros([1, batch_len], np.float32)
-#                sigma[0] = (sess.run(sig_val, feed_dict={K2:K2_, K3:K3_}))
-#                sigma = np.transpose(sigma)
-#
-#                u_ = tf.cast(tf.div(tf.subtract(y_best, yhat), sigma), tf.float32)
-#                u_ = sess.run(u_)
-#                eip_p = sess.run(eip, feed_dict={u:u_})
-#                eip_ = tf.multiply(sigma, eip_p)
-#                yhats[arr_offset:end_offset] = yhat
-#                sigmas[arr_offset:end_offset] =  sigma;
-#                eips[arr_offset:end_offset] = sess.run(eip_);
-#                arr_offset = end_offset
-#
-#        finally:
-#            sess.close()
-#
-#        return yhats, sigmas, eips
+        return acquisition.calculate_sigma_multiplier(t, ndim, bound)
 
 
 def euclidean_mat(X, y, sess):
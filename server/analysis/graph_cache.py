@@ -0,0 +1,120 @@
+#
+# OtterTune - graph_cache.py
+#
+# Copyright (c) 2017-18, Carnegie Mellon University Database Group
+#
+import contextlib
+import threading
+from collections import OrderedDict
+
+import tensorflow as tf
+
+
+class GraphCacheEntry(object):
+
+    def __init__(self, num_threads):
+        self.graph = tf.Graph()
+        self.vars = {}
+        self.ops = {}
+        self.session = None
+        self.num_threads = num_threads
+        # Held by a model while it runs the entry's nodes, since the
+        # variables in the session are shared by all models using the entry
+        self.lock = threading.RLock()
+        # Number of models using the entry (see GraphCache.use) and whether
+        # it has been evicted from the cache
+        self.users = 0
+        self.evicted = False
+
+    def finalize(self):
+        # No more nodes may be added once the entry has been built, so the
+        # graph cannot grow while it is reused
+        self.graph.finalize()
+        self.session = tf.Session(graph=self.graph,
+                                  config=tf.ConfigProto(
+                                      intra_op_parallelism_threads=self.num_threads))
+
+    def close(self):
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
+
+# Per-process LRU cache of built graphs and their sessions. The graphs only
+# depend on the model hyperparameters (and the number of features), all data
+# is fed in at run time, so they can be reused across fits. The session of an
+# evicted (or cleared) entry is closed right away if no model is using it, or
+# else when the last model using it is done (see use).
+class GraphCache(object):
+
+    def __init__(self, max_entries=8):
+        if max_entries < 1:
+            raise Exception("The graph cache needs at least 1 entry ({})"
+                            .format(max_entries))
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, build_fn, num_threads):
+        with self.lock:
+            return self._get(key, build_fn, num_threads)
+
+    @contextlib.contextmanager
+    def use(self, key, build_fn, num_threads):
+        # Yields the entry for key (built with build_fn on a miss) while
+        # holding its lock. The entry is not closed while it is in use.
+        with self.lock:
+            entry = self._get(key, build_fn, num_threads)
+            entry.users += 1
+        try:
+            with entry.lock:
+                yield entry
+        finally:
+            with self.lock:
+                entry.users -= 1
+                if entry.evicted and entry.users == 0:
+                    entry.close()
+
+    def _get(self, key, build_fn, num_threads):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            entry = GraphCacheEntry(num_threads)
+            build_fn(entry)
+            entry.finalize()
+        else:
+            self.hits += 1
+        self.entries[key] = entry
+        self._evict()
+        return entry
+
+    def resize(self, max_entries):
+        if max_entries < 1:
+            raise Exception("The graph cache needs at least 1 entry ({})"
+                            .format(max_entries))
+        with self.lock:
+            self.max_entries = max_entries
+            self._evict()
+
+    def clear(self):
+        with self.lock:
+            while self.entries:
+                self._remove(self.entries.popitem(last=False)[1])
+
+    def _evict(self):
+        while len(self.entries) > self.max_entries:
+            self._remove(self.entries.popitem(last=False)[1])
+
+    @staticmethod
+    def _remove(entry):
+        entry.evicted = True
+        if entry.users == 0:
+            entry.close()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+GRAPH_CACHE = GraphCache(max_entries=8)
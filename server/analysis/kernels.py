@@ -0,0 +1,163 @@
+#
+# OtterTune - kernels.py
+#
+# Copyright (c) 2017-18, Carnegie Mellon University Database Group
+#
+'''
+Stationary kernels of the GPR models. Each kernel is
+
+    k(x, x') = magnitude * f(||x - x'|| / length_scale)
+
+for a profile f with f(0) = 1, so the prior variance of every point is the
+magnitude. The profile is written once for numpy and TensorFlow (it only
+uses functions both provide), and the numpy kernel matrix is computed in
+row blocks directly into the output, so the full distance matrix is never
+materialized next to the kernel matrix. The TensorFlow models evaluate
+their kernel op on the same row blocks (see GPR.kernel_matrix).
+'''
+from abc import ABCMeta, abstractmethod
+
+import numpy as np
+from scipy.spatial.distance import cdist
+
+EXPONENTIAL = 'exponential'
+RBF = 'rbf'
+MATERN32 = 'matern32'
+MATERN52 = 'matern52'
+
+# Max number of distances computed at once by Kernel.__call__
+BLOCK_ELEMENTS = 2 ** 18
+
+SQRT3 = float(np.sqrt(3.0))
+SQRT5 = float(np.sqrt(5.0))
+
+
+class Kernel(object, metaclass=ABCMeta):
+
+    name = None
+
+    def __init__(self, length_scale=1.0, magnitude=1.0):
+        assert length_scale > 0 and magnitude > 0
+        self.length_scale = length_scale
+        self.magnitude = magnitude
+
+    def __repr__(self):
+        return "{}(length_scale={}, magnitude={})".format(
+            type(self).__name__, self.length_scale, self.magnitude)
+
+    @abstractmethod
+    def profile(self, s, xp=np):
+        # f(s) for the scaled distances s, with xp = numpy or tensorflow
+        pass
+
+    @abstractmethod
+    def profile_grad_over_s(self, s):
+        # f'(s) / s (numpy), the finite limit at s = 0 if there is one
+        pass
+
+    def from_dists(self, dists, xp=np):
+        # The kernel values of the (Euclidean) distances
+        return self.magnitude * self.profile(dists / self.length_scale, xp)
+
+    def from_dists_inplace(self, dists):
+        # Same as from_dists (numpy), but dists may be overwritten with the
+        # result to avoid temporaries
+        return self.from_dists(dists)
+
+    def grad_coef(self, dists):
+        # (dk/dr) / r for the distances r, so that the gradient of k(x, x')
+        # with respect to x is grad_coef * (x - x')
+        return self.magnitude * self.profile_grad_over_s(dists / self.length_scale) / \
+            (self.length_scale ** 2)
+
+    def __call__(self, X1, X2, dtype=np.float64, block_elements=BLOCK_ELEMENTS):
+        # The kernel matrix between the rows of X1 and X2 in the given dtype,
+        # computed in blocks of rows of X1 (of about block_elements entries)
+        K = np.empty((X1.shape[0], X2.shape[0]), dtype=dtype)
+        for start, end, dists in iter_dist_blocks(X1, X2, block_elements):
+            K[start:end] = self.from_dists_inplace(dists)
+        return K
+
+
+def iter_row_blocks(n_rows, n_cols, block_elements=None):
+    # Yields (start, end) for blocks of rows of an n_rows x n_cols matrix of
+    # about block_elements entries (BLOCK_ELEMENTS by default) each
+    if block_elements is None:
+        block_elements = BLOCK_ELEMENTS
+    block_rows = max(1, block_elements // max(1, n_cols))
+    for start in range(0, n_rows, block_rows):
+        yield start, min(start + block_rows, n_rows)
+
+
+def iter_dist_blocks(X1, X2, block_elements=None):
+    # Yields (start, end, dists) for blocks of rows of X1 (see
+    # iter_row_blocks), where dists are the distances between X1[start:end]
+    # and the rows of X2
+    for start, end in iter_row_blocks(X1.shape[0], X2.shape[0], block_elements):
+        yield start, end, cdist(X1[start:end], X2)
+
+
+class ExponentialKernel(Kernel):
+
+    name = EXPONENTIAL
+
+    def profile(self, s, xp=np):
+        return xp.exp(-s)
+
+    def from_dists_inplace(self, dists):
+        np.divide(dists, -self.length_scale, out=dists)
+        np.exp(dists, out=dists)
+        dists *= self.magnitude
+        return dists
+
+    def profile_grad_over_s(self, s):
+        # Not differentiable at s = 0, where the (sub)gradient 0 is used
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(s > 0, -np.exp(-s) / s, 0.0)
+
+
+class RBFKernel(Kernel):
+
+    name = RBF
+
+    def profile(self, s, xp=np):
+        return xp.exp(-0.5 * s * s)
+
+    def profile_grad_over_s(self, s):
+        return -np.exp(-0.5 * s * s)
+
+
+class Matern32Kernel(Kernel):
+
+    name = MATERN32
+
+    def profile(self, s, xp=np):
+        return (1.0 + SQRT3 * s) * xp.exp(-SQRT3 * s)
+
+    def profile_grad_over_s(self, s):
+        return -3.0 * np.exp(-SQRT3 * s)
+
+
+class Matern52Kernel(Kernel):
+
+    name = MATERN52
+
+    def profile(self, s, xp=np):
+        return (1.0 + SQRT5 * s + (5.0 / 3.0) * s * s) * xp.exp(-SQRT5 * s)
+
+    def profile_grad_over_s(self, s):
+        return -(5.0 / 3.0) * (1.0 + SQRT5 * s) * np.exp(-SQRT5 * s)
+
+
+KERNELS = {kernel_cls.name: kernel_cls for kernel_cls in
+           (ExponentialKernel, RBFKernel, Matern32Kernel, Matern52Kernel)}
+
+
+def check_kernel_type(kernel_type):
+    if kernel_type not in KERNELS:
+        raise Exception("Unknown kernel: {}".format(kernel_type))
+
+
+def create_kernel(kernel_type, length_scale=1.0, magnitude=1.0):
+    check_kernel_type(kernel_type)
+    return KERNELS[kernel_type](length_scale, magnitude)
@@ -0,0 +1,288 @@
+#
+# OtterTune - model_server.py
+#
+# Copyright (c) 2017-18, Carnegie Mellon University Database Group
+#
+'''
+A long-lived local process that keeps fitted models in memory and runs
+predict/optimize operations on them for short-lived clients (e.g., the
+celery workers, which are recycled every CELERYD_MAX_TASKS_PER_CHILD tasks).
+
+Models are keyed by the client, e.g., by (pipeline run, workload, hash of
+the model settings and training data). A request first names the key and
+the operation; only if the server does not have the model (a miss) does the
+client send the unfitted model and its training data, and the server fits
+it (or loads it from a ModelStore) and keeps it in an LRU cache of
+max_models models. Requests are served over multiprocessing.connection (a
+unix socket or a TCP port on localhost), one thread per connection. The
+server counts the hits and misses and the latency of each operation. The
+clients must authenticate with the server's key: the server refuses to
+start without one, since a client can make it unpickle arbitrary objects.
+
+Usage (from the server directory; the authentication key is read from the
+OTTERTUNE_MODEL_SERVER_AUTHKEY environment variable):
+    python -m analysis.model_server --address /tmp/ottertune-models.sock
+'''
+import argparse
+import copy
+import os
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+from analysis.batch_selection import select_batch
+from analysis.model_store import MODEL_CLASSES, ModelStore
+from analysis.screening import iter_halton_candidates, screen_candidates
+from analysis.util import get_analysis_logger
+
+LOG = get_analysis_logger(__name__)
+
+AUTHKEY_ENV = 'OTTERTUNE_MODEL_SERVER_AUTHKEY'
+
+# Errors raised when the server cannot be reached (or the authentication
+# keys do not match)
+CONNECTION_ERRORS = (OSError, EOFError, AuthenticationError)
+
+# Response statuses
+OK = 'ok'
+MISS = 'miss'
+ERROR = 'error'
+
+
+def _predict(model, *args, **kwargs):
+    return model.predict(*args, **kwargs)
+
+
+def _screen_halton(model, n_candidates, X_min, X_max, k, chunk_size=10000, **kwargs):
+    candidates = iter_halton_candidates(n_candidates, X_min, X_max, chunk_size=chunk_size)
+    return screen_candidates(model, candidates, k, **kwargs)
+
+
+# The operations clients can run on a fitted model: each one is called as
+# operation(model, *args, **kwargs)
+OPERATIONS = {
+    'predict': _predict,
+    'select_batch': select_batch,
+    'screen_halton': _screen_halton,
+}
+
+
+def run_operation(model, operation, *args, **kwargs):
+    # Runs the operation on a shallow copy of the model, so that operations
+    # that update it (e.g., select_batch fantasizes observations with
+    # partial_fit, which replaces the arrays) do not change the cached model
+    if operation not in OPERATIONS:
+        raise Exception("Unknown model operation: {}".format(operation))
+    return OPERATIONS[operation](copy.copy(model), *args, **kwargs)
+
+
+class ModelServer(object):
+
+    def __init__(self, address, authkey=None, max_models=32, model_dir=None):
+        if not authkey:
+            raise Exception("The model server requires an authentication key")
+        self.address = address
+        self.authkey = authkey
+        self.max_models = max_models
+        # Fitted models are also saved in/loaded from the model store (if
+        # given) for keys of the form (pipeline_run, workload, hash)
+        self.model_store = ModelStore(model_dir) if model_dir is not None else None
+        self.models = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {'requests': 0, 'hits': 0, 'misses': 0, 'fits': 0, 'loads': 0,
+                         'evictions': 0, 'errors': 0}
+        # operation -> [count, total seconds, max seconds]
+        self.latencies = {}
+        self.start_time = time.time()
+        self.listener = None
+        self.running = False
+
+    def _count(self, counter, n=1):
+        with self.lock:
+            self.counters[counter] += n
+
+    def _record_latency(self, operation, seconds):
+        with self.lock:
+            stats = self.latencies.setdefault(operation, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+
+    def get_model(self, key):
+        with self.lock:
+            model = self.models.get(key)
+            if model is not None:
+                self.models.move_to_end(key)
+            return model
+
+    def put_model(self, key, model):
+        with self.lock:
+            self.models[key] = model
+            self.models.move_to_end(key)
+            while len(self.models) > self.max_models:
+                self.models.popitem(last=False)
+                self.counters['evictions'] += 1
+
+    def fit_model(self, key, model, fit_args, ridge):
+        # Returns the model fit on fit_args (or loaded from the model store)
+        # and caches it
+        storable = type(model).__name__ in MODEL_CLASSES
+        use_store = all((self.model_store is not None, len(key) == 3, storable))
+        fitted_model = None
+        if use_store:
+            fitted_model = self.model_store.load(*key)
+            if fitted_model is not None:
+                self._count('loads')
+        if fitted_model is None:
+            fitted_model = model.fit(*fit_args, ridge=ridge)
+            self._count('fits')
+            if use_store:
+                self.model_store.save(key[0], key[1], key[2], fitted_model)
+        self.put_model(key, fitted_model)
+        return fitted_model
+
+    def stats(self):
+        with self.lock:
+            return {
+                'counters': dict(self.counters),
+                'latencies': {op: {'count': count, 'mean_seconds': total / count,
+                                   'max_seconds': max_seconds}
+                              for op, (count, total, max_seconds) in self.latencies.items()},
+                'num_models': len(self.models),
+                'uptime_seconds': time.time() - self.start_time,
+            }
+
+    def handle(self, request):
+        # Returns the (status, value) response to a request:
+        #   ('call', key, operation, args, kwargs): runs the operation on the
+        #       cached model, or responds MISS if there is none
+        #   ('fit_call', key, model, fit_args, ridge, operation, args, kwargs):
+        #       fits the model, caches it and runs the operation
+        #   ('stats',), ('shutdown',)
+        command = request[0]
+        if command == 'stats':
+            return OK, self.stats()
+        if command == 'shutdown':
+            self.running = False
+            return OK, None
+        if command not in ('call', 'fit_call'):
+            raise Exception("Unknown model server command: {}".format(command))
+        self._count('requests')
+        start = time.time()
+        key = request[1]
+        if command == 'call':
+            operation, args, kwargs = request[2:]
+            model = self.get_model(key)
+            if model is None:
+                self._count('misses')
+                return MISS, None
+            self._count('hits')
+        else:
+            model, fit_args, ridge, operation, args, kwargs = request[2:]
+            model = self.fit_model(key, model, fit_args, ridge)
+        value = run_operation(model, operation, *args, **kwargs)
+        self._record_latency(operation if command == 'call' else 'fit+' + operation,
+                             time.time() - start)
+        return OK, value
+
+    def _serve_request(self, conn, request):
+        with conn:
+            try:
+                response = self.handle(request)
+            except Exception as ex:  # pylint: disable=broad-except
+                LOG.exception("Model server request failed")
+                self._count('errors')
+                response = (ERROR, '{}: {}'.format(type(ex).__name__, ex))
+            try:
+                conn.send(response)
+            except CONNECTION_ERRORS as ex:
+                LOG.warning("Failed to send the model server response: %s", ex)
+
+    def serve_forever(self):
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            # Remove the socket left by a previous server
+            os.unlink(self.address)
+        self.listener = Listener(self.address, authkey=self.authkey)
+        self.running = True
+        LOG.info("Model server listening on %s", str(self.listener.address))
+        try:
+            while self.running:
+                try:
+                    conn = self.listener.accept()
+                    request = conn.recv()
+                except CONNECTION_ERRORS as ex:
+                    # e.g., a client with the wrong authentication key
+                    LOG.warning("Failed to accept a model server connection: %s", ex)
+                    continue
+                if request[0] == 'shutdown':
+                    # Served here, so that the loop stops right away
+                    self._serve_request(conn, request)
+                    continue
+                thread = threading.Thread(target=self._serve_request, args=(conn, request))
+                thread.daemon = True
+                thread.start()
+        finally:
+            self.listener.close()
+            LOG.info("Model server stopped: %s", str(self.stats()))
+
+
+class ModelClient(object):
+
+    def __init__(self, address, authkey=None):
+        self.address = address
+        self.authkey = authkey
+
+    def _request(self, request):
+        # Raises one of CONNECTION_ERRORS if the server cannot be reached
+        with Client(self.address, authkey=self.authkey) as conn:
+            conn.send(request)
+            status, value = conn.recv()
+        if status == ERROR:
+            raise Exception("Model server error: {}".format(value))
+        return status, value
+
+    def call(self, key, operation, args=(), kwargs=None, model=None, fit_args=None,
+             ridge=None):
+        # Returns the result of the operation on the model cached for key. If
+        # the server does not have it, the (unfitted) model is sent with its
+        # training data (fit_args and ridge) to be fit and cached first.
+        kwargs = kwargs or {}
+        status, value = self._request(('call', key, operation, args, kwargs))
+        if status == MISS:
+            if model is None:
+                raise Exception("The model server has no model for {}".format(key))
+            status, value = self._request(('fit_call', key, model, fit_args, ridge,
+                                           operation, args, kwargs))
+        return value
+
+    def stats(self):
+        return self._request(('stats',))[1]
+
+    def shutdown(self):
+        return self._request(('shutdown',))[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OtterTune model server")
+    parser.add_argument('--address', required=True,
+                        help="unix socket path, or host:port for a TCP socket")
+    parser.add_argument('--max-models', type=int, default=32)
+    parser.add_argument('--model-dir', default=None,
+                        help="directory of the saved models (see analysis/model_store.py)")
+    args = parser.parse_args()
+    address = args.address
+    if ':' in address and not address.startswith('/'):
+        host, port = address.rsplit(':', 1)
+        address = (host, int(port))
+    authkey = os.environ.get(AUTHKEY_ENV)
+    if not authkey:
+        raise Exception("{} is not set".format(AUTHKEY_ENV))
+    authkey = authkey.encode('utf-8')
+    ModelServer(address, authkey=authkey, max_models=args.max_models,
+                model_dir=args.model_dir).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
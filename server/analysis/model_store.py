@@ -0,0 +1,137 @@
+#
+# OtterTune - model_store.py
+#
+# Copyright (c) 2017-18, Carnegie Mellon University Database Group
+#
+'''
+Persists fitted numpy GP models (GPRNP, GPRGDNP) so that a model fit on
+unchanged inputs can be reused instead of refit.
+
+A model is saved as a directory with one .npy file per array attribute
+(training data, factorization of K, xy_, ...) and a meta.json file with
+its class and scalar attributes. The arrays are loaded back memory-mapped
+(read-only), so loading takes milliseconds regardless of the model size
+and the pages are shared by the worker processes that use the same model.
+'''
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from analysis.gp import GPRNP, GPRGDNP
+from analysis.util import get_analysis_logger
+
+LOG = get_analysis_logger(__name__)
+
+MODEL_CLASSES = {cls.__name__: cls for cls in (GPRNP, GPRGDNP)}
+
+META_FILENAME = 'meta.json'
+
+
+def data_hash(*arrays):
+    # Returns a hash of the dtypes, shapes and contents of the arrays
+    sha = hashlib.sha1()
+    for arr in arrays:
+        arr = np.ascontiguousarray(arr)
+        sha.update(str((arr.dtype.str, arr.shape)).encode('utf-8'))
+        sha.update(arr.tobytes())
+    return sha.hexdigest()
+
+
+def model_key(model, fit_args, ridge):
+    # Returns a key of the (unfitted) model's class and settings (its repr)
+    # and the arguments it is fit with
+    settings = np.frombuffer(repr(model).encode('utf-8'), dtype=np.uint8)
+    return data_hash(settings, np.asarray(ridge), *fit_args)
+
+
+def save_model(model, path):
+    # Saves the model to the directory path (replacing it if it exists). The
+    # model is written to a temporary directory first and then renamed, so
+    # a concurrent load_model sees either the whole model or no model.
+    cls_name = type(model).__name__
+    if cls_name not in MODEL_CLASSES:
+        raise Exception("Cannot save models of type {}".format(cls_name))
+    meta = {'class': cls_name, 'attrs': {}, 'arrays': []}
+    parent = os.path.dirname(os.path.abspath(path))
+    if not os.path.exists(parent):
+        os.makedirs(parent)
+    tmp_path = tempfile.mkdtemp(dir=parent, prefix='.tmp-')
+    try:
+        for name, val in model.__dict__.items():
+            if isinstance(val, np.ndarray):
+                np.save(os.path.join(tmp_path, name + '.npy'), val)
+                meta['arrays'].append(name)
+            elif isinstance(val, np.dtype):
+                meta['attrs'][name] = {'dtype': val.name}
+            elif isinstance(val, np.generic):
+                meta['attrs'][name] = val.item()
+            else:
+                meta['attrs'][name] = val
+        with open(os.path.join(tmp_path, META_FILENAME), 'w') as f:
+            json.dump(meta, f)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.rename(tmp_path, path)
+    except Exception:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+
+def load_model(path, mmap_mode='r'):
+    # Returns the model saved in the directory path, or None if there is no
+    # model there. The arrays are memory-mapped with mmap_mode (None loads
+    # them into memory).
+    meta_path = os.path.join(path, META_FILENAME)
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, 'r') as f:
+        meta = json.load(f)
+    model = MODEL_CLASSES[meta['class']].__new__(MODEL_CLASSES[meta['class']])
+    for name, val in meta['attrs'].items():
+        if isinstance(val, dict) and 'dtype' in val:
+            val = np.dtype(val['dtype'])
+        setattr(model, name, val)
+    for name in meta['arrays']:
+        setattr(model, name, np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode))
+    return model
+
+
+class ModelStore(object):
+
+    # Saved models are keyed by (pipeline_run, workload, data hash) and kept
+    # in root/<pipeline_run>/<workload>-<data hash>, so the models of old
+    # pipeline runs can be removed together.
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, pipeline_run, workload, key):
+        return os.path.join(self.root, str(pipeline_run), '{}-{}'.format(workload, key))
+
+    def load(self, pipeline_run, workload, key, mmap_mode='r'):
+        try:
+            return load_model(self.path(pipeline_run, workload, key), mmap_mode)
+        except (IOError, OSError, ValueError, KeyError) as ex:
+            LOG.warning("Failed to load model (%s, %s, %s): %s", pipeline_run, workload,
+                        key, ex)
+            return None
+
+    def save(self, pipeline_run, workload, key, model):
+        try:
+            save_model(model, self.path(pipeline_run, workload, key))
+        except (IOError, OSError) as ex:
+            LOG.warning("Failed to save model (%s, %s, %s): %s", pipeline_run, workload,
+                        key, ex)
+
+    def prune(self, keep_pipeline_runs):
+        # Removes the models of all pipeline runs except keep_pipeline_runs
+        if not os.path.isdir(self.root):
+            return
+        keep = set(str(run) for run in keep_pipeline_runs)
+        for name in os.listdir(self.root):
+            if name not in keep:
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
@@ -0,0 +1,125 @@
+#
+# OtterTune - screening.py
+#
+# Copyright (c) 2017-18, Carnegie Mellon University Database Group
+#
+'''
+Screening of very large sets of candidate configurations with a fitted GPR
+model. The candidates are consumed lazily, one chunk (2D array) at a time,
+and only the running top k by acquisition value is kept, so the memory used
+depends on the chunk size and k but not on the number of candidates.
+'''
+import numpy as np
+
+from analysis.acquisition import (EXPECTED_IMPROVEMENT, calculate_sigma_multiplier,
+                                  compute_acquisitions)
+from analysis.forest import ForestNP
+from analysis.gp import GPRNP, GPRResult
+from analysis.util import deadline_passed, get_analysis_logger
+
+LOG = get_analysis_logger(__name__)
+
+
+def first_primes(n):
+    primes = []
+    candidate = 2
+    while len(primes) < n:
+        if all(candidate % p != 0 for p in primes if p * p <= candidate):
+            primes.append(candidate)
+        candidate += 1
+    return primes
+
+
+def halton_sequence(start, stop, ndim):
+    # Returns points start, ..., stop - 1 of the ndim dimensional Halton
+    # (quasi-random, low discrepancy) sequence in [0, 1)^ndim. Point 0 (the
+    # origin) is never returned. In many dimensions the coordinates that use
+    # large prime bases are correlated over short runs of points.
+    indices = np.arange(start, stop, dtype=np.int64) + 1
+    points = np.empty((indices.shape[0], ndim))
+    for j, base in enumerate(first_primes(ndim)):
+        remaining = indices.copy()
+        scale = 1.0
+        coords = np.zeros(indices.shape[0])
+        while np.any(remaining > 0):
+            scale /= base
+            coords += scale * (remaining % base)
+            remaining //= base
+        points[:, j] = coords
+    return points
+
+
+def iter_halton_candidates(n_candidates, X_min, X_max, chunk_size=10000, skip=0):
+    # Yields n_candidates points of the Halton sequence scaled to the box
+    # [X_min, X_max], in chunks of at most chunk_size rows
+    X_min = np.asarray(X_min, dtype=float)
+    X_max = np.asarray(X_max, dtype=float)
+    for start in range(skip, skip + n_candidates, chunk_size):
+        stop = min(start + chunk_size, skip + n_candidates)
+        yield X_min + halton_sequence(start, stop, X_min.shape[0]) * (X_max - X_min)
+
+
+def predict_chunk(model, X_chunk, acquisition=EXPECTED_IMPROVEMENT, beta=None):
+    # Returns the GPRResult (with the acquisition scores) of the GPR
+    # predictions of the model for X_chunk. The GPR (rather than gradient
+    # descent or local search) predictions are used for GPRGDNP/GPRGD and
+    # ForestSearchNP models.
+    for model_cls in (GPRNP, ForestNP):
+        if isinstance(model, model_cls):
+            return model_cls.predict(model, X_chunk, acquisitions=(acquisition,), beta=beta)
+    # Only load TensorFlow for TensorFlow models
+    from analysis.gp_tf import GPR
+    res = GPR.predict(model, X_chunk)
+    if beta is None:
+        beta = calculate_sigma_multiplier(t=model.X_train.shape[0],
+                                          ndim=model.X_train.shape[1])
+    y_best = np.min(model.y_train, axis=0)
+    res.acquisitions = compute_acquisitions((acquisition,), res.ypreds, res.sigmas,
+                                            y_best, beta)
+    return res
+
+
+def iter_predictions(model, candidate_chunks, acquisition=EXPECTED_IMPROVEMENT, beta=None):
+    # Yields (X_chunk, GPRResult) for each chunk of candidate_chunks (any
+    # iterable of 2D arrays, e.g., a generator)
+    for X_chunk in candidate_chunks:
+        yield X_chunk, predict_chunk(model, X_chunk, acquisition, beta)
+
+
+def screen_candidates(model, candidate_chunks, k, acquisition=EXPECTED_IMPROVEMENT,
+                      beta=None, deadline=None):
+    # Returns the k candidates with the highest acquisition scores (best
+    # first, k x nfeats) and a GPRResult with their predictions, sigmas and
+    # scores. Fewer than k are returned if there are fewer candidates. Once
+    # the deadline (a time.time() timestamp) has passed, no more chunks are
+    # screened (the first one always is).
+    if k < 1:
+        raise Exception("k must be positive ({})".format(k))
+    X_top = None
+    n_candidates = 0
+    for X_chunk, res in iter_predictions(model, candidate_chunks, acquisition, beta):
+        if res.ypreds.shape[1] != 1:
+            raise Exception("Candidates can only be screened for a single output "
+                            "(the model has {})".format(res.ypreds.shape[1]))
+        n_candidates += X_chunk.shape[0]
+        chunk = (np.asarray(X_chunk), res.ypreds, res.sigmas,
+                 res.acquisitions[acquisition])
+        if X_top is None:
+            X_top, ypreds, sigmas, scores = chunk
+        else:
+            X_top, ypreds, sigmas, scores = (np.vstack((top, new)) for top, new in
+                                             zip((X_top, ypreds, sigmas, scores), chunk))
+        if X_top.shape[0] > k:
+            keep = np.argpartition(-scores.ravel(), k - 1)[:k]
+            X_top, ypreds, sigmas, scores = (arr[keep] for arr in
+                                             (X_top, ypreds, sigmas, scores))
+        if deadline_passed(deadline):
+            LOG.info("Deadline passed after screening %d candidates", n_candidates)
+            break
+    if X_top is None:
+        raise Exception("No candidates to screen")
+    order = np.argsort(-scores.ravel(), kind='mergesort')
+    LOG.debug("Screened %d candidates, best %s score: %s", n_candidates, acquisition,
+              str(scores[order[0]]))
+    return X_top[order], GPRResult(ypreds[order], sigmas[order],
+                                   {acquisition: scores[order]})
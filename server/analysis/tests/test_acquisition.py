@@ -0,0 +1,90 @@
+#
+# OtterTune - test_acquisition.py
+#
+# Copyright (c) 2017-18, Carnegie Mellon University Database Group
+#
+import unittest
+import numpy as np
+from scipy.stats import norm
+from sklearn import datasets
+from analysis.acquisition import (EXPECTED_IMPROVEMENT, PROBABILITY_OF_IMPROVEMENT,
+                                  UPPER_CONFIDENCE_BOUND, calculate_sigma_multiplier,
+                                  expected_improvement, probability_of_improvement,
+                                  upper_confidence_bound)
+from analysis.gp import GPRNP
+
+
+class TestAcquisitionFunctions(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.yhat = rng.randn(50, 1)
+        self.sigma = rng.rand(50, 1) + 0.1
+        self.y_best = -0.5
+
+    def test_expected_improvement(self):
+        # Compare to a Monte Carlo estimate of E[max(y_best - y, 0)]
+        rng = np.random.RandomState(1)
+        samples = self.yhat + self.sigma * rng.randn(50, 200000)
+        expected = np.mean(np.maximum(self.y_best - samples, 0), axis=1, keepdims=True)
+        eis = expected_improvement(self.yhat, self.sigma, self.y_best)
+        np.testing.assert_allclose(eis, expected, atol=5e-3)
+
+    def test_probability_of_improvement(self):
+        pis = probability_of_improvement(self.yhat, self.sigma, self.y_best)
+        np.testing.assert_allclose(pis, norm.cdf((self.y_best - self.yhat) / self.sigma))
+
+    def test_upper_confidence_bound(self):
+        ucbs = upper_confidence_bound(self.yhat, self.sigma, 2.0)
+        np.testing.assert_allclose(ucbs, 2.0 * self.sigma - self.yhat)
+
+    def test_zero_sigma(self):
+        yhat = np.array([-1.0, -0.5, 0.0])
+        sigma = np.zeros(3)
+        np.testing.assert_allclose(expected_improvement(yhat, sigma, -0.5), [0.5, 0.0, 0.0])
+        np.testing.assert_allclose(probability_of_improvement(yhat, sigma, -0.5),
+                                   [1.0, 0.5, 0.0])
+
+    def test_calculate_sigma_multiplier(self):
+        self.assertEqual(calculate_sigma_multiplier(1, 1), 1)
+        self.assertAlmostEqual(calculate_sigma_multiplier(100, 10),
+                               np.sqrt(2 * np.log(10 * 100**2 * np.pi**2 / 6 * 0.1)))
+
+
+class TestGPRNPAcquisitions(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestGPRNPAcquisitions, cls).setUpClass()
+        boston = datasets.load_boston()
+        data = boston['data']
+        X_min, X_max = data.min(axis=0), data.max(axis=0)
+        cls.X_train = (data[0:300] - X_min) / (X_max - X_min)
+        cls.X_test = (data[300:] - X_min) / (X_max - X_min)
+        y_train = boston['target'][0:300].reshape(300, 1)
+        cls.y_train = (y_train - y_train.mean()) / y_train.std()
+
+    def test_gprnp_acquisitions(self):
+        names = (EXPECTED_IMPROVEMENT, PROBABILITY_OF_IMPROVEMENT, UPPER_CONFIDENCE_BOUND)
+        model = GPRNP(length_scale=1.0, magnitude=1.0, batch_size=64, dtype=np.float64)
+        model.fit(self.X_train, self.y_train, ridge=0.1)
+        res = model.predict(self.X_test, acquisitions=names, beta=2.0)
+        self.assertEqual(sorted(res.acquisitions.keys()), sorted(names))
+        y_best = np.min(self.y_train)
+        np.testing.assert_allclose(res.acquisitions[EXPECTED_IMPROVEMENT],
+                                   expected_improvement(res.ypreds, res.sigmas, y_best),
+                                   rtol=1e-5)
+        np.testing.assert_allclose(res.acquisitions[PROBABILITY_OF_IMPROVEMENT],
+                                   probability_of_improvement(res.ypreds, res.sigmas, y_best),
+                                   rtol=1e-5)
+        np.testing.assert_allclose(res.acquisitions[UPPER_CONFIDENCE_BOUND],
+                                   upper_confidence_bound(res.ypreds, res.sigmas, 2.0),
+                                   rtol=1e-5)
+
+    def test_gprnp_default_acquisitions(self):
+        model = GPRNP(length_scale=1.0, magnitude=1.0)
+        model.fit(self.X_train, self.y_train, ridge=0.1)
+        res = model.predict(self.X_test)
+        self.assertEqual(list(res.acquisitions.keys()), [EXPECTED_IMPROVEMENT])
+        with self.assertRaises(Exception):
+            model.predict(self.X_test, acquisitions=('unknown',))
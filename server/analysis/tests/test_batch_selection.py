@@ -0,0 +1,85 @@
+#
+# OtterTune - test_batch_selection.py
+#
+# Copyright (c) 2017-18, Carnegie Mellon University Database Group
+#
+import unittest
+import numpy as np
+from sklearn import datasets
+from analysis.batch_selection import CONSTANT_LIAR, KRIGING_BELIEVER, select_batch
+from analysis.gp import GPRGDNP, GPRGDResult
+
+
+class FixedResultModel(object):
+    # Returns the same result from every round of batch selection, as when
+    # the fantasized observations do not move the minimum
+
+    def __init__(self, minl, minl_conf):
+        self.minl = np.asarray(minl, dtype=float).reshape(-1, 1)
+        self.minl_conf = np.asarray(minl_conf, dtype=float)
+        self.y_train = np.zeros((1, 1))
+
+    def predict(self, X_samples):
+        n_samples = X_samples.shape[0]
+        return GPRGDResult(np.zeros((n_samples, 1)), np.ones((n_samples, 1)),
+                           self.minl, self.minl_conf, np.zeros((n_samples, 1)))
+
+    def partial_fit(self, X_new, y_new, ridge=0.01):
+        pass
+
+
+class TestSelectBatch(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestSelectBatch, cls).setUpClass()
+        boston = datasets.load_boston()
+        data = boston['data']
+        X_min, X_max = data.min(axis=0), data.max(axis=0)
+        cls.X_train = (data[0:200] - X_min) / (X_max - X_min)
+        y_train = boston['target'][0:200].reshape(200, 1)
+        cls.y_train = (y_train - y_train.mean()) / y_train.std()
+        cls.X_samples = (data[200:220] - X_min) / (X_max - X_min)
+        cls.X_min = np.zeros(data.shape[1])
+        cls.X_max = np.ones(data.shape[1])
+
+    def fit_model(self):
+        model = GPRGDNP(length_scale=1.0, magnitude=1.0, max_iter=50)
+        model.fit(self.X_train, self.y_train, self.X_min, self.X_max, ridge=0.1)
+        return model
+
+    def test_select_batch(self):
+        for method in (KRIGING_BELIEVER, CONSTANT_LIAR):
+            model = self.fit_model()
+            configs, results = select_batch(model, self.X_samples, 3, method=method, ridge=0.1)
+            self.assertEqual(configs.shape, (3, self.X_train.shape[1]))
+            self.assertEqual(len(results), 3)
+            # The fantasized observations are appended to the training data
+            self.assertEqual(model.X_train.shape[0], self.X_train.shape[0] + 2)
+            np.testing.assert_allclose(model.X_train[-2:], configs[:2], rtol=1e-6)
+            # The configurations are distinct and within bounds
+            self.assertEqual(len(set(tuple(c) for c in np.round(configs, 4))), 3)
+            self.assertTrue(np.all(configs >= self.X_min) and np.all(configs <= self.X_max))
+
+    def test_select_batch_first_is_best(self):
+        model = self.fit_model()
+        res = model.predict(self.X_samples)
+        configs, _ = select_batch(self.fit_model(), self.X_samples, 2)
+        np.testing.assert_allclose(configs[0], res.minl_conf[np.argmin(res.minl.ravel())])
+
+    def test_select_batch_distinct(self):
+        minl_conf = [[0.2, 0.3], [0.2, 0.3], [0.7, 0.1], [0.2, 0.3]]
+        for method in (KRIGING_BELIEVER, CONSTANT_LIAR):
+            model = FixedResultModel([0.0, 0.5, 1.0, 1.5], minl_conf)
+            configs, results = select_batch(model, np.zeros((4, 2)), 2, method=method)
+            np.testing.assert_allclose(configs, [[0.2, 0.3], [0.7, 0.1]])
+            self.assertEqual(len(results), 2)
+            # No candidate is left for a third distinct configuration
+            configs, results = select_batch(model, np.zeros((4, 2)), 3, method=method)
+            self.assertEqual(len(set(tuple(c) for c in configs)), configs.shape[0])
+            self.assertEqual(configs.shape, (2, 2))
+            self.assertEqual(len(results), 2)
+
+    def test_select_batch_unknown_method(self):
+        with self.assertRaises(Exception):
+            select_batch(self.fit_model(), self.X_samples, 2, method='unknown')
@@ -79,11 +79,25 @@ class TestKSelection(unittest.TestCase):
         self.assertEqual(detk.optimal_num_clusters_, 2)
 
     def test_gap_statistic_optimal_num_clusters(self):
-        # Compute optimal # cluster using gap-statistics
+        # Compute optimal # cluster using gap-statistics. The gap curve is
+        # nearly flat past K=6, so the chosen K depends on the reference data
+        # sets and the seed is pinned
         gap = create_kselection_model("gap-statistic")
-        gap.fit(self.matrix, self.kmeans_models.cluster_map_)
+        gap.fit(self.matrix, self.kmeans_models.cluster_map_, random_state=42)
         self.assertEqual(gap.optimal_num_clusters_, 8)
 
+    def test_gap_statistic_parallel(self):
+        # The reference data sets are seeded independently of the number of
+        # processes, so the results match the serial ones
+        serial = create_kselection_model("gap-statistic")
+        serial.fit(self.matrix, self.kmeans_models.cluster_map_, n_b=10, random_state=0)
+        parallel = create_kselection_model("gap-statistic")
+        parallel.fit(self.matrix, self.kmeans_models.cluster_map_, n_b=10, n_jobs=3,
+                     random_state=0)
+        np.testing.assert_array_equal(parallel.log_wkbs_, serial.log_wkbs_)
+        np.testing.assert_array_equal(parallel.khats_, serial.khats_)
+        self.assertEqual(parallel.optimal_num_clusters_, serial.optimal_num_clusters_)
+
     def test_silhouette_optimal_num_clusters(self):
         # Compute optimal # cluster using Silhouette Analysis
         sil = create_kselection_model("s-score")
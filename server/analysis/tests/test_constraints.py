@@ -9,6 +9,7 @@ from sklearn import datasets
 from sklearn.preprocessing import StandardScaler
 
 from analysis.constraints import ParamConstraintHelper
+from analysis.gp import hillclimb_categorical_features
 from analysis.preprocessing import DummyEncoder
 
 
@@ -111,6 +112,63 @@ class ConstraintHelperTestCase(unittest.TestCase):
         for ct in cat_var_2_counts:
             self.assertTrue(ct > 0)
 
+    # tests that the batched randomization returns n_candidates valid
+    # configurations per sample, each with at least one categorical feature
+    # flipped, and reaches all possible values of the categorical variables
+    def test_randomize_categorical_features_batch(self):
+        n_values = [3, 4]
+        categorical_features = [0, 2]
+        encoder = DummyEncoder(n_values, categorical_features, ['a', 'b'], [])
+        encoder.fit([[0, 17, 0]])
+        X_scaler = StandardScaler()
+        constraint_helper = ParamConstraintHelper(X_scaler, encoder,
+                                                  init_flip_prob=0.3,
+                                                  flip_prob_decay=0.5)
+
+        rows = np.array([[0, 0, 1, 1, 0, 0, 0, 17],
+                         [1, 0, 0, 0, 0, 0, 1, 5]], dtype=float)
+        n_candidates = 50
+        candidates = constraint_helper.randomize_categorical_features_batch(
+            rows, n_candidates, scaled=False, rescale=False)
+        self.assertEqual(candidates.shape, (2 * n_candidates, 8))
+        for i, row in enumerate(rows):
+            row_candidates = candidates[i * n_candidates: (i + 1) * n_candidates]
+            cat_var_0_dummies = row_candidates[:, 0:3]
+            cat_var_2_dummies = row_candidates[:, 3:7]
+            self.assertTrue(np.all(np.sum(cat_var_0_dummies == 1, axis=1) == 1))
+            self.assertTrue(np.all(np.sum(cat_var_0_dummies, axis=1) == 1))
+            self.assertTrue(np.all(np.sum(cat_var_2_dummies == 1, axis=1) == 1))
+            self.assertTrue(np.all(np.sum(cat_var_2_dummies, axis=1) == 1))
+            self.assertTrue(np.all(np.any(row_candidates[:, :7] != row[:7], axis=1)))
+            self.assertTrue(np.all(row_candidates[:, -1] == row[-1]))
+            self.assertTrue(np.all(np.any(cat_var_0_dummies == 1, axis=0)))
+            self.assertTrue(np.all(np.any(cat_var_2_dummies == 1, axis=0)))
+
+    # tests that a hill climbing step scores all of the candidates in a
+    # single call and only keeps the candidates that lower the loss
+    def test_hillclimb_categorical_features(self):
+        encoder = DummyEncoder([3], [0], ['a'], [])
+        encoder.fit([[0, 17]])
+        X_scaler = StandardScaler()
+        X = np.array([[1, 0, 0, 17], [0, 0, 1, 5]], dtype=float)
+        X_scaler.fit(np.vstack((X, [[0, 1, 0, 11]])))
+        constraint_helper = ParamConstraintHelper(X_scaler, encoder,
+                                                  init_flip_prob=0.3,
+                                                  flip_prob_decay=0.5)
+        calls = []
+
+        def loss_fn(X_scaled):
+            calls.append(X_scaled.shape[0])
+            # The third value of the categorical variable is the best
+            return -X_scaler.inverse_transform(X_scaled)[:, 2]
+
+        X_scaled = X_scaler.transform(X)
+        X_new = hillclimb_categorical_features(loss_fn, X_scaled, constraint_helper,
+                                               n_candidates=50)
+        self.assertEqual(calls, [2 + 2 * 50])
+        X_new = np.round(X_scaler.inverse_transform(X_new), 10)
+        self.assertTrue(np.all(X_new == [[0, 0, 1, 17], [0, 0, 1, 5]]))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,50 @@
+#
+# OtterTune - test_coreset.py
+#
+# Copyright (c) 2017-18, Carnegie Mellon University Database Group
+#
+import unittest
+import numpy as np
+from scipy.spatial.distance import cdist
+from analysis.coreset import KCENTER, RANDOM, kcenter_greedy, select_coreset
+
+
+class TestCoreset(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestCoreset, cls).setUpClass()
+        rng = np.random.RandomState(0)
+        # 5 tight clusters of 200 near duplicates and 20 spread out points
+        centers = rng.rand(5, 3)
+        cls.X = np.vstack((np.repeat(centers, 200, axis=0) + 1e-3 * rng.randn(1000, 3),
+                           rng.rand(20, 3)))
+
+    def test_kcenter_covers_clusters(self):
+        idxs = kcenter_greedy(self.X, 25)
+        self.assertEqual(np.unique(idxs).shape[0], 25)
+        # Every cluster is represented by a single point, and every spread
+        # out point is selected
+        cluster_counts = np.bincount(np.minimum(idxs // 200, 5), minlength=6)
+        np.testing.assert_array_equal(cluster_counts, [1, 1, 1, 1, 1, 20])
+        # The covering radius is much smaller than that of a random subset
+        radius = np.max(np.min(cdist(self.X, self.X[idxs]), axis=1))
+        random_idxs = select_coreset(self.X, 25, method=RANDOM)
+        random_radius = np.max(np.min(cdist(self.X, self.X[random_idxs]), axis=1))
+        self.assertLess(radius, random_radius)
+
+    def test_select_coreset_keeps_rows(self):
+        keep_idxs = [3, 500, 1019, 3]
+        for method in (KCENTER, RANDOM):
+            idxs = select_coreset(self.X, 30, keep_idxs, method=method)
+            self.assertEqual(idxs.shape[0], 30)
+            self.assertTrue(np.all(np.diff(idxs) > 0))
+            self.assertTrue(set(keep_idxs) <= set(idxs))
+
+    def test_select_coreset_small(self):
+        np.testing.assert_array_equal(select_coreset(self.X, 2000), np.arange(1020))
+        np.testing.assert_array_equal(select_coreset(self.X, 2, [7, 1, 9]), [1, 7, 9])
+        with self.assertRaises(Exception):
+            select_coreset(self.X, 10, method='leverage')
+        with self.assertRaises(Exception):
+            select_coreset(self.X, 0)
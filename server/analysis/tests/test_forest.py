@@ -0,0 +1,84 @@
+#
+# OtterTune - test_forest.py
+#
+# Copyright (c) 2017-18, Carnegie Mellon University Database Group
+#
+import time
+import unittest
+import numpy as np
+from sklearn import datasets
+from analysis.acquisition import EXPECTED_IMPROVEMENT, UPPER_CONFIDENCE_BOUND
+from analysis.batch_selection import select_batch
+from analysis.forest import ForestNP, ForestSearchNP
+
+
+class TestForestNP(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestForestNP, cls).setUpClass()
+        boston = datasets.load_boston()
+        data = boston['data']
+        X_min, X_max = data.min(axis=0), data.max(axis=0)
+        cls.X_train = (data[0:500] - X_min) / (X_max - X_min)
+        cls.X_test = (data[500:] - X_min) / (X_max - X_min)
+        cls.y_train = boston['target'][0:500].reshape(500, 1)
+        cls.y_test = boston['target'][500:].reshape(-1, 1)
+
+    def test_forest_predict(self):
+        for ensemble in (ForestNP.EXTRA_TREES, ForestNP.RANDOM_FOREST):
+            model = ForestNP(ensemble=ensemble, n_estimators=50)
+            model.fit(self.X_train, self.y_train)
+            res = model.predict(self.X_test, acquisitions=(EXPECTED_IMPROVEMENT,
+                                                           UPPER_CONFIDENCE_BOUND))
+            self.assertEqual(res.ypreds.shape, (6, 1))
+            self.assertEqual(res.sigmas.shape, (6, 1))
+            self.assertTrue(np.all(res.sigmas > 0))
+            self.assertEqual(res.acquisitions[EXPECTED_IMPROVEMENT].shape, (6, 1))
+            # The mean of the trees is the prediction of the ensemble
+            np.testing.assert_allclose(res.ypreds.ravel(),
+                                       model.forest_.predict(self.X_test))
+            self.assertLess(np.mean(np.abs(res.ypreds - self.y_test)), 5.0)
+
+    def test_forest_multi_output(self):
+        y_train = np.hstack((self.y_train, np.log(self.y_train)))
+        model = ForestNP(n_estimators=20, batch_size=4).fit(self.X_train, y_train)
+        res = model.predict(self.X_test, acquisitions=())
+        self.assertEqual(res.ypreds.shape, (6, 2))
+        self.assertEqual(res.sigmas.shape, (6, 2))
+        single = ForestNP(n_estimators=20).fit(self.X_train, self.y_train)
+        self.assertEqual(single.predict(self.X_test).ypreds.shape, (6, 1))
+
+    def test_forest_not_fitted(self):
+        with self.assertRaises(Exception):
+            ForestNP().predict(self.X_test)
+        with self.assertRaises(Exception):
+            ForestNP(ensemble='boosting')
+
+    def test_forest_partial_fit(self):
+        model = ForestNP(n_estimators=20).fit(self.X_train[:400], self.y_train[:400])
+        model.partial_fit(self.X_train[400:], self.y_train[400:])
+        full = ForestNP(n_estimators=20).fit(self.X_train, self.y_train)
+        np.testing.assert_allclose(model.predict(self.X_test).ypreds,
+                                   full.predict(self.X_test).ypreds)
+
+    def test_forest_search(self):
+        X_min = np.zeros(self.X_train.shape[1])
+        X_max = np.ones(self.X_train.shape[1])
+        model = ForestSearchNP(n_estimators=20, max_iter=50)
+        model.fit(self.X_train, self.y_train, X_min, X_max)
+        start_loss = model.objective(self.X_test)[2]
+        res = model.predict(self.X_test)
+        self.assertEqual(res.minl_conf.shape, self.X_test.shape)
+        self.assertTrue(np.all(res.minl.ravel() <= start_loss))
+        self.assertTrue(np.all(res.minl_conf >= X_min))
+        self.assertTrue(np.all(res.minl_conf <= X_max))
+        np.testing.assert_allclose(res.minl.ravel(), model.objective(res.minl_conf)[2])
+        # Past the deadline, the (clipped) starting points are returned
+        res = model.predict(self.X_test, deadline=time.time() - 1)
+        np.testing.assert_array_equal(res.n_iters, 0)
+        np.testing.assert_allclose(res.minl.ravel(), start_loss)
+        # Works as the model of a batch selection (partial_fit refits)
+        configs, _ = select_batch(model, self.X_test, 2)
+        self.assertEqual(configs.shape, (2, self.X_train.shape[1]))
+        self.assertEqual(model.X_train.shape[0], self.X_train.shape[0] + 1)
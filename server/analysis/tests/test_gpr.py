@@ -3,10 +3,13 @@
 #
 # Copyright (c) 2017-18, Carnegie Mellon University Database Group
 #
+import time
 import unittest
+import numpy as np
 from sklearn import datasets
-from analysis.gp import GPRNP
-from analysis.gp_tf import GPR
+from analysis.gp import GPRNP, GPRGDNP, fit_kernel_hyperparameters, log_marginal_likelihood
+from analysis.gp_tf import GPR, GPRGD
+from analysis.graph_cache import GraphCache
 
 
 # test numpy version GPR
@@ -59,3 +62,596 @@ class TestGPRTF(unittest.TestCase):
         sigmas_round = [round(x[0], 4) for x in self.gpr_result.sigmas]
         expected_sigmas = [1.0, 1.0, 1.0, 1.0, 1.0, 1.0]
         self.assertEqual(sigmas_round, expected_sigmas)
+
+
+# test numpy version GPR with the Cholesky solver
+class TestGPRNPCholesky(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestGPRNPCholesky, cls).setUpClass()
+        boston = datasets.load_boston()
+        data = boston['data']
+        X_train = data[0:500]
+        X_test = data[500:]
+        y_train = boston['target'][0:500].reshape(500, 1)
+        cls.model = GPRNP(length_scale=1.0, magnitude=1.0, solver=GPRNP.SOLVER_CHOLESKY)
+        cls.model.fit(X_train, y_train, ridge=1.0)
+        cls.gpr_result = cls.model.predict(X_test)
+
+    def test_gprnp_ypreds(self):
+        ypreds_round = [round(x[0], 4) for x in self.gpr_result.ypreds]
+        expected_ypreds = [0.0181, 0.0014, 0.0006, 0.0015, 0.0039, 0.0014]
+        self.assertEqual(ypreds_round, expected_ypreds)
+
+    def test_gprnp_sigmas(self):
+        sigmas_round = [round(x[0], 4) for x in self.gpr_result.sigmas]
+        expected_sigmas = [1.0, 1.0, 1.0, 1.0, 1.0, 1.0]
+        self.assertEqual(sigmas_round, expected_sigmas)
+
+    def test_gprnp_cholesky_jitter(self):
+        # Duplicate rows without a ridge make K singular
+        boston = datasets.load_boston()
+        X_train = np.vstack([boston['data'][0:50]] * 2)
+        y_train = np.vstack([boston['target'][0:50].reshape(50, 1)] * 2)
+        model = GPRNP(length_scale=1.0, magnitude=1.0, solver=GPRNP.SOLVER_CHOLESKY)
+        model.fit(X_train, y_train, ridge=0.0)
+        self.assertGreater(model.jitter, 0)
+        self.assertTrue(np.all(np.isfinite(model.predict(boston['data'][500:]).ypreds)))
+
+    def test_gprnp_cholesky_sigmas_nonnegative(self):
+        # With a tiny ridge in float32, the predictive variance at the
+        # training points rounds to (slightly) negative values
+        rng = np.random.RandomState(0)
+        X_train = rng.rand(2000, 4)
+        y_train = np.sum(X_train, axis=1).reshape(-1, 1)
+        for model in (GPRNP(length_scale=1.0, magnitude=1.0, solver=GPRNP.SOLVER_CHOLESKY,
+                            dtype=np.float32),
+                      GPR(length_scale=1.0, magnitude=1.0, solver=GPR.SOLVER_CHOLESKY,
+                          dtype=np.float32)):
+            model.fit(X_train, y_train, ridge=1e-6)
+            sigmas = model.predict(X_train).sigmas
+            self.assertTrue(np.all(np.isfinite(sigmas)))
+            self.assertTrue(np.all(sigmas >= 0))
+
+
+# test Tensorflow version GPR with the Cholesky solver
+class TestGPRTFCholesky(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestGPRTFCholesky, cls).setUpClass()
+        boston = datasets.load_boston()
+        data = boston['data']
+        X_train = data[0:500]
+        X_test = data[500:]
+        y_train = boston['target'][0:500].reshape(500, 1)
+        cls.model = GPR(length_scale=1.0, magnitude=1.0, solver=GPR.SOLVER_CHOLESKY)
+        cls.model.fit(X_train, y_train, ridge=1.0)
+        cls.gpr_result = cls.model.predict(X_test)
+
+    def test_gprnp_ypreds(self):
+        ypreds_round = [round(x[0], 4) for x in self.gpr_result.ypreds]
+        expected_ypreds = [0.0181, 0.0014, 0.0006, 0.0015, 0.0039, 0.0014]
+        self.assertEqual(ypreds_round, expected_ypreds)
+
+    def test_gprnp_sigmas(self):
+        sigmas_round = [round(x[0], 4) for x in self.gpr_result.sigmas]
+        expected_sigmas = [1.0, 1.0, 1.0, 1.0, 1.0, 1.0]
+        self.assertEqual(sigmas_round, expected_sigmas)
+
+
+# test batched multi-start gradient descent
+class TestGPRGDBatched(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestGPRGDBatched, cls).setUpClass()
+        boston = datasets.load_boston()
+        data = boston['data']
+        X_min, X_max = data.min(axis=0), data.max(axis=0)
+        cls.X_train = (data[0:500] - X_min) / (X_max - X_min)
+        cls.X_test = (data[500:] - X_min) / (X_max - X_min)
+        cls.y_train = boston['target'][0:500].reshape(500, 1)
+        cls.X_min = np.zeros(data.shape[1])
+        cls.X_max = np.ones(data.shape[1])
+        cls.model = GPRGD(length_scale=1.0, magnitude=1.0, max_iter=20,
+                          gd_method=GPRGD.GD_BATCHED)
+        cls.model.fit(cls.X_train, cls.y_train, cls.X_min, cls.X_max, ridge=1.0)
+        cls.gpr_result = cls.model.predict(cls.X_test)
+
+    def test_gprgd_batched_matches_serial(self):
+        # Each start is optimized independently, so the batched result must
+        # match optimizing every start on its own
+        model = GPRGD(length_scale=1.0, magnitude=1.0, max_iter=20)
+        model.fit(self.X_train, self.y_train, self.X_min, self.X_max, ridge=1.0)
+        for i in range(self.X_test.shape[0]):
+            res = model.predict(self.X_test[i:i + 1])
+            self.assertAlmostEqual(res.minl[0][0], self.gpr_result.minl[i][0], 4)
+            np.testing.assert_allclose(res.minl_conf[0], self.gpr_result.minl_conf[i],
+                                       atol=1e-4)
+
+    def test_gprgd_batched_bounds(self):
+        self.assertTrue(np.all(self.gpr_result.minl_conf >= self.X_min))
+        self.assertTrue(np.all(self.gpr_result.minl_conf <= self.X_max))
+
+    def test_gprgd_early_termination(self):
+        # A quadratic bowl with its minimum at center: with the loss yhat
+        # (sigma_multiplier=0), every start converges there
+        grid = np.linspace(0, 1, 11)
+        X_train = np.array([[a, b] for a in grid for b in grid])
+        center = np.array([0.3, 0.6])
+        y_train = np.sum(np.square(X_train - center), axis=1).reshape(-1, 1)
+        X_test = np.random.RandomState(0).rand(5, 2)
+        for gd_method in (GPRGD.GD_SERIAL, GPRGD.GD_BATCHED):
+            model = GPRGD(length_scale=1.0, magnitude=1.0, max_iter=500,
+                          learning_rate=0.05, sigma_multiplier=0.0, mu_multiplier=1.0,
+                          gd_method=gd_method, loss_tol=1e-4, patience=5,
+                          dtype=np.float64)
+            model.fit(X_train, y_train, np.zeros(2), np.ones(2), ridge=1e-4)
+            res = model.predict(X_test)
+            self.assertEqual(res.n_iters.shape, (X_test.shape[0], 1))
+            self.assertTrue(np.all(res.n_iters >= model.patience - 1))
+            self.assertTrue(np.all(res.n_iters < model.max_iter))
+            np.testing.assert_allclose(res.minl_conf, np.tile(center, (5, 1)), atol=0.02)
+
+    def test_gprgd_deadline(self):
+        for gd_method in (GPRGD.GD_SERIAL, GPRGD.GD_BATCHED):
+            model = GPRGD(length_scale=1.0, magnitude=1.0, max_iter=200, gd_method=gd_method)
+            model.fit(self.X_train, self.y_train, self.X_min, self.X_max, ridge=1.0)
+            res = model.predict(self.X_test, deadline=time.time() - 1)
+            np.testing.assert_array_equal(res.n_iters, 0)
+            np.testing.assert_allclose(res.minl_conf, self.X_test, atol=1e-6)
+
+
+# test numpy version GPRGD against the tensorflow version
+class TestGPRGDNP(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestGPRGDNP, cls).setUpClass()
+        boston = datasets.load_boston()
+        data = boston['data']
+        X_min, X_max = data.min(axis=0), data.max(axis=0)
+        cls.X_train = (data[0:500] - X_min) / (X_max - X_min)
+        cls.X_test = (data[500:] - X_min) / (X_max - X_min)
+        cls.y_train = boston['target'][0:500].reshape(500, 1)
+        cls.X_min = np.zeros(data.shape[1])
+        cls.X_max = np.ones(data.shape[1])
+
+    def test_gprgdnp_matches_tf(self):
+        for solver in (GPRNP.SOLVER_INVERSE, GPRNP.SOLVER_CHOLESKY):
+            tf_model = GPRGD(length_scale=1.0, magnitude=1.0, max_iter=20,
+                             gd_method=GPRGD.GD_BATCHED, solver=solver)
+            tf_model.fit(self.X_train, self.y_train, self.X_min, self.X_max, ridge=1.0)
+            np_model = GPRGDNP(length_scale=1.0, magnitude=1.0, max_iter=20, solver=solver)
+            np_model.fit(self.X_train, self.y_train, self.X_min, self.X_max, ridge=1.0)
+            tf_result = tf_model.predict(self.X_test)
+            np_result = np_model.predict(self.X_test)
+            np.testing.assert_allclose(np_result.minl, tf_result.minl, atol=1e-3)
+            np.testing.assert_allclose(np_result.minl_conf, tf_result.minl_conf, atol=1e-4)
+            np.testing.assert_allclose(np_result.ypreds, tf_result.ypreds, atol=1e-3)
+            np.testing.assert_allclose(np_result.sigmas, tf_result.sigmas, atol=1e-3)
+
+    def test_gprgdnp_gradient(self):
+        model = GPRGDNP(length_scale=1.0, magnitude=1.0, dtype=np.float64)
+        model.fit(self.X_train, self.y_train, self.X_min, self.X_max, ridge=1.0)
+        grad = model.objective(self.X_test)[3]
+        step = 1e-6
+        for j in range(self.X_test.shape[1]):
+            delta = np.zeros(self.X_test.shape[1])
+            delta[j] = step
+            loss_hi = model.objective(self.X_test + delta, gradient=False)[2]
+            loss_lo = model.objective(self.X_test - delta, gradient=False)[2]
+            np.testing.assert_allclose(grad[:, j], (loss_hi - loss_lo) / (2 * step),
+                                       atol=1e-5)
+
+    def test_gprgdnp_early_termination(self):
+        model = GPRGDNP(length_scale=1.0, magnitude=1.0, max_iter=200,
+                        loss_tol=1e-2, patience=5)
+        model.fit(self.X_train, self.y_train, self.X_min, self.X_max, ridge=1.0)
+        res = model.predict(self.X_test)
+        self.assertTrue(np.all(res.n_iters < model.max_iter))
+        self.assertTrue(np.all(res.minl_conf >= self.X_min))
+        self.assertTrue(np.all(res.minl_conf <= self.X_max))
+
+    def test_gprgdnp_deadline(self):
+        for optimizer in (GPRGDNP.OPTIMIZER_ADAM, GPRGDNP.OPTIMIZER_LBFGS):
+            model = GPRGDNP(length_scale=1.0, magnitude=1.0, max_iter=200,
+                            optimizer=optimizer, dtype=np.float64)
+            model.fit(self.X_train, self.y_train, self.X_min, self.X_max, ridge=1.0)
+            # Past the deadline, the starting points are only evaluated
+            res = model.predict(self.X_test, deadline=time.time() - 1)
+            np.testing.assert_array_equal(res.n_iters, 0)
+            np.testing.assert_allclose(res.minl_conf, self.X_test)
+            loss = model.objective(self.X_test, gradient=False)[2]
+            np.testing.assert_allclose(res.minl.ravel(), loss)
+            res = model.predict(self.X_test, deadline=time.time() + 3600)
+            self.assertTrue(np.all(res.n_iters > 0))
+            self.assertTrue(np.all(res.minl.ravel() < loss))
+
+    def test_gprgdnp_lbfgs(self):
+        adam_model = GPRGDNP(length_scale=1.0, magnitude=1.0, max_iter=200, dtype=np.float64)
+        adam_model.fit(self.X_train, self.y_train, self.X_min, self.X_max, ridge=1.0)
+        adam_result = adam_model.predict(self.X_test)
+        results = []
+        for n_jobs, executor in ((1, GPRGDNP.EXECUTOR_THREAD), (2, GPRGDNP.EXECUTOR_THREAD),
+                                 (2, GPRGDNP.EXECUTOR_PROCESS)):
+            model = GPRGDNP(length_scale=1.0, magnitude=1.0, max_iter=200,
+                            optimizer=GPRGDNP.OPTIMIZER_LBFGS, n_jobs=n_jobs,
+                            executor=executor, dtype=np.float64)
+            model.fit(self.X_train, self.y_train, self.X_min, self.X_max, ridge=1.0)
+            res = model.predict(self.X_test)
+            self.assertEqual(res.minl_conf.shape, self.X_test.shape)
+            self.assertTrue(np.all(res.minl_conf >= self.X_min))
+            self.assertTrue(np.all(res.minl_conf <= self.X_max))
+            self.assertTrue(np.all(res.n_iters < model.max_iter))
+            # The starts may end in different local minima, but the best one
+            # is at least as good as Adam's in far fewer iterations
+            self.assertLessEqual(np.min(res.minl), np.min(adam_result.minl) + 1e-4)
+            self.assertLess(np.mean(res.n_iters), np.mean(adam_result.n_iters))
+            results.append(res)
+        for res in results[1:]:
+            np.testing.assert_allclose(res.minl, results[0].minl, rtol=1e-10)
+            np.testing.assert_allclose(res.minl_conf, results[0].minl_conf, rtol=1e-10)
+
+
+class TestGraphCache(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestGraphCache, cls).setUpClass()
+        boston = datasets.load_boston()
+        data = boston['data']
+        X_min, X_max = data.min(axis=0), data.max(axis=0)
+        cls.X_train = (data[0:500] - X_min) / (X_max - X_min)
+        cls.X_test = (data[500:] - X_min) / (X_max - X_min)
+        cls.y_train = boston['target'][0:500].reshape(500, 1)
+        cls.X_min = np.zeros(data.shape[1])
+        cls.X_max = np.ones(data.shape[1])
+
+    def test_graph_reused_across_fits(self):
+        model = GPRGD(length_scale=1.0, magnitude=1.0, max_iter=10,
+                      gd_method=GPRGD.GD_BATCHED)
+        model.graph_cache_ = GraphCache(max_entries=4)
+        results = []
+        for X_test in (self.X_test, self.X_test[:3], self.X_test):
+            model.fit(self.X_train, self.y_train, self.X_min, self.X_max, ridge=1.0)
+            results.append(model.predict(X_test))
+        # One GPR and one GPRGD graph, built by the first fit/predict
+        self.assertEqual(len(model.graph_cache_), 2)
+        self.assertEqual(model.graph_cache_.misses, 2)
+        self.assertEqual(model.graph_cache_.hits, 4)
+        np.testing.assert_array_equal(results[0].minl, results[2].minl)
+        np.testing.assert_array_equal(results[0].minl[:3], results[1].minl)
+
+    def test_graph_cache_matches_uncached(self):
+        for gd_method in (GPRGD.GD_SERIAL, GPRGD.GD_BATCHED):
+            cached = GPRGD(length_scale=1.0, magnitude=1.0, max_iter=10,
+                           gd_method=gd_method)
+            cached.fit(self.X_train, self.y_train, self.X_min, self.X_max, ridge=1.0)
+            uncached = GPRGD(length_scale=1.0, magnitude=1.0, max_iter=10,
+                             gd_method=gd_method, use_graph_cache=False)
+            uncached.fit(self.X_train, self.y_train, self.X_min, self.X_max, ridge=1.0)
+            np.testing.assert_array_equal(cached.predict(self.X_test).minl,
+                                          uncached.predict(self.X_test).minl)
+
+    def test_graph_cache_bound(self):
+        cache = GraphCache(max_entries=2)
+        for length_scale in (1.0, 2.0, 3.0):
+            model = GPR(length_scale=length_scale, magnitude=1.0)
+            model.graph_cache_ = cache
+            model.fit(self.X_train, self.y_train, ridge=1.0)
+            model.predict(self.X_test)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.misses, 3)
+        cache.resize(1)
+        self.assertEqual(len(cache), 1)
+
+    def test_graph_cache_closes_evicted_sessions(self):
+        cache = GraphCache(max_entries=1)
+
+        def build_fn(entry):
+            return entry
+
+        with cache.use('a', build_fn, 1) as entry_a:
+            # Evicted while in use: closed once it is released
+            entry_b = cache.get('b', build_fn, 1)
+            self.assertTrue(entry_a.evicted)
+            self.assertIsNotNone(entry_a.session)
+        self.assertIsNone(entry_a.session)
+        self.assertIsNotNone(entry_b.session)
+        cache.clear()
+        self.assertIsNone(entry_b.session)
+        self.assertEqual(len(cache), 0)
+
+
+class TestGPRPartialFit(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestGPRPartialFit, cls).setUpClass()
+        boston = datasets.load_boston()
+        data = boston['data']
+        cls.X_train = data[0:500]
+        cls.X_test = data[500:]
+        cls.y_train = boston['target'][0:500].reshape(500, 1)
+
+    def check_partial_fit(self, model_class, atol, dtype=np.float32):
+        for solver in (model_class.SOLVER_INVERSE, model_class.SOLVER_CHOLESKY):
+            full = model_class(length_scale=2.0, magnitude=1.0, solver=solver, dtype=dtype)
+            full.fit(self.X_train, self.y_train, ridge=1.0)
+            model = model_class(length_scale=2.0, magnitude=1.0, solver=solver, dtype=dtype)
+            model.fit(self.X_train[:400], self.y_train[:400], ridge=1.0)
+            model.partial_fit(self.X_train[400:450], self.y_train[400:450], ridge=1.0)
+            model.partial_fit(self.X_train[450:], self.y_train[450:], ridge=1.0)
+            full_result = full.predict(self.X_test)
+            result = model.predict(self.X_test)
+            np.testing.assert_allclose(result.ypreds, full_result.ypreds, atol=atol)
+            np.testing.assert_allclose(result.sigmas, full_result.sigmas, atol=atol)
+            np.testing.assert_allclose(model.xy_, full.xy_, atol=atol)
+
+    def test_gprnp_partial_fit(self):
+        self.check_partial_fit(GPRNP, 1e-8, dtype=np.float64)
+
+    def test_gprtf_partial_fit(self):
+        self.check_partial_fit(GPR, 1e-4)
+
+    def test_gprnp_partial_fit_jitter(self):
+        # Appending duplicate rows without a ridge makes K singular, so the
+        # factorization falls back to a full one with a jitter
+        X = np.vstack([self.X_train[:20], self.X_train[:20]])
+        y = np.vstack([self.y_train[:20], self.y_train[:20]])
+        full = GPRNP(length_scale=2.0, magnitude=1.0, solver=GPRNP.SOLVER_CHOLESKY)
+        full.fit(X, y, ridge=0.0)
+        model = GPRNP(length_scale=2.0, magnitude=1.0, solver=GPRNP.SOLVER_CHOLESKY)
+        model.fit(X[:20], y[:20], ridge=0.0)
+        model.partial_fit(X[20:], y[20:], ridge=0.0)
+        self.assertGreater(model.jitter, 0.0)
+        self.assertEqual(model.jitter, full.jitter)
+        np.testing.assert_allclose(model.predict(self.X_test).ypreds,
+                                   full.predict(self.X_test).ypreds)
+
+
+class TestGPRNPSparse(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestGPRNPSparse, cls).setUpClass()
+        boston = datasets.load_boston()
+        data = boston['data']
+        X_min, X_max = data.min(axis=0), data.max(axis=0)
+        cls.X_train = (data[0:500] - X_min) / (X_max - X_min)
+        cls.X_test = (data[500:] - X_min) / (X_max - X_min)
+        cls.y_train = boston['target'][0:500].reshape(500, 1)
+
+    def test_gprnp_sparse_close_to_exact(self):
+        exact = GPRNP(length_scale=1.0, magnitude=1.0)
+        exact.fit(self.X_train, self.y_train, ridge=1.0)
+        sparse = GPRNP(length_scale=1.0, magnitude=1.0, num_inducing=490)
+        sparse.fit(self.X_train, self.y_train, ridge=1.0)
+        self.assertTrue(sparse.is_sparse())
+        self.assertEqual(sparse.X_inducing.shape, (490, self.X_train.shape[1]))
+        exact_result = exact.predict(self.X_test)
+        sparse_result = sparse.predict(self.X_test)
+        np.testing.assert_allclose(sparse_result.ypreds, exact_result.ypreds, atol=0.05)
+        np.testing.assert_allclose(sparse_result.sigmas, exact_result.sigmas, atol=1e-3)
+
+    def test_gprnp_sparse_max_train_size(self):
+        model = GPRNP(length_scale=1.0, magnitude=1.0, max_train_size=100)
+        with self.assertRaises(Exception):
+            model.fit(self.X_train, self.y_train, ridge=1.0)
+        model = GPRNP(length_scale=1.0, magnitude=1.0, max_train_size=100,
+                      num_inducing=100, batch_size=64)
+        model.fit(self.X_train, self.y_train, ridge=1.0)
+        result = model.predict(self.X_test)
+        self.assertEqual(result.ypreds.shape, (self.X_test.shape[0], 1))
+        self.assertTrue(np.all(result.sigmas > 0))
+
+    def test_gprnp_sparse_small_data_is_exact(self):
+        exact = GPRNP(length_scale=1.0, magnitude=1.0)
+        exact.fit(self.X_train, self.y_train, ridge=1.0)
+        model = GPRNP(length_scale=1.0, magnitude=1.0, num_inducing=500)
+        model.fit(self.X_train, self.y_train, ridge=1.0)
+        self.assertFalse(model.is_sparse())
+        np.testing.assert_array_equal(model.predict(self.X_test).ypreds,
+                                      exact.predict(self.X_test).ypreds)
+
+    def test_gprgdnp_sparse_gradient(self):
+        model = GPRGDNP(length_scale=1.0, magnitude=1.0, num_inducing=100, dtype=np.float64)
+        model.fit(self.X_train, self.y_train, np.zeros(self.X_train.shape[1]),
+                  np.ones(self.X_train.shape[1]), ridge=1.0)
+        grad = model.objective(self.X_test)[3]
+        step = 1e-6
+        for j in range(self.X_test.shape[1]):
+            delta = np.zeros(self.X_test.shape[1])
+            delta[j] = step
+            loss_hi = model.objective(self.X_test + delta, gradient=False)[2]
+            loss_lo = model.objective(self.X_test - delta, gradient=False)[2]
+            np.testing.assert_allclose(grad[:, j], (loss_hi - loss_lo) / (2 * step),
+                                       atol=1e-5)
+
+
+class TestKernelHyperparameters(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestKernelHyperparameters, cls).setUpClass()
+        boston = datasets.load_boston()
+        data = boston['data']
+        X_min, X_max = data.min(axis=0), data.max(axis=0)
+        cls.X_train = (data[0:200] - X_min) / (X_max - X_min)
+        y_train = boston['target'][0:200].reshape(200, 1)
+        cls.y_train = (y_train - y_train.mean()) / y_train.std()
+
+    def test_log_marginal_likelihood(self):
+        # Compare to the likelihood of N(0, K) computed directly
+        length_scale, magnitude, ridge = 0.5, 2.0, 0.1
+        lml = log_marginal_likelihood(self.X_train, self.y_train, length_scale,
+                                      magnitude, ridge)
+        dists = np.sqrt(np.sum(np.square(
+            self.X_train[:, np.newaxis, :] - self.X_train[np.newaxis, :, :]), axis=2))
+        K = magnitude * np.exp(-dists / length_scale) + ridge * np.eye(self.X_train.shape[0])
+        y = self.y_train.ravel()
+        quad = y.dot(np.linalg.solve(K, y))
+        logdet = np.linalg.slogdet(K)[1]
+        expected = -0.5 * (quad + logdet + len(y) * np.log(2 * np.pi))
+        self.assertAlmostEqual(lml, expected, places=6)
+
+    def test_log_marginal_likelihood_gradient(self):
+        theta = np.log([0.5, 2.0])
+        grad = log_marginal_likelihood(self.X_train, self.y_train, np.exp(theta[0]),
+                                       np.exp(theta[1]), 0.1, eval_gradient=True)[1]
+        step = 1e-6
+        for j in range(2):
+            delta = np.zeros(2)
+            delta[j] = step
+            lml_hi = log_marginal_likelihood(self.X_train, self.y_train,
+                                             *np.exp(theta + delta), ridge=0.1)
+            lml_lo = log_marginal_likelihood(self.X_train, self.y_train,
+                                             *np.exp(theta - delta), ridge=0.1)
+            self.assertAlmostEqual(grad[j], (lml_hi - lml_lo) / (2 * step), places=4)
+
+    def test_fit_kernel_hyperparameters(self):
+        bounds = ((1e-2, 1e2), (1e-2, 1e2))
+        params = fit_kernel_hyperparameters(self.X_train, self.y_train, ridge=0.1,
+                                            bounds=bounds)
+        lml0 = log_marginal_likelihood(self.X_train, self.y_train, 1.0, 1.0, 0.1)
+        lml = log_marginal_likelihood(self.X_train, self.y_train, params['length_scale'],
+                                      params['magnitude'], 0.1)
+        self.assertGreater(lml, lml0)
+        self.assertAlmostEqual(lml, params['log_marginal_likelihood'], places=6)
+        self.assertTrue(bounds[0][0] <= params['length_scale'] <= bounds[0][1])
+        self.assertTrue(bounds[1][0] <= params['magnitude'] <= bounds[1][1])
+
+    def test_fit_kernel_hyperparameters_log_step(self):
+        params = fit_kernel_hyperparameters(self.X_train, self.y_train, ridge=0.1)
+        rounded = fit_kernel_hyperparameters(self.X_train, self.y_train, ridge=0.1,
+                                             log_step=0.1)
+        for name in ('length_scale', 'magnitude'):
+            log_value = np.log(rounded[name]) / 0.1
+            self.assertAlmostEqual(log_value, np.round(log_value))
+            self.assertLessEqual(abs(np.log(rounded[name] / params[name])), 0.05 + 1e-9)
+
+
+class TestGPRDiagonalVariance(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestGPRDiagonalVariance, cls).setUpClass()
+        boston = datasets.load_boston()
+        data = boston['data']
+        X_min, X_max = data.min(axis=0), data.max(axis=0)
+        cls.X_train = (data[0:300] - X_min) / (X_max - X_min)
+        cls.X_test = (data[300:] - X_min) / (X_max - X_min)
+        cls.y_train = boston['target'][0:300].reshape(300, 1)
+
+    def full_covariance_sigmas(self, model):
+        # The predictive standard deviations computed from the full
+        # (test x test) predictive covariance matrix
+        def kernel(X1, X2):
+            dists = np.sqrt(np.sum(np.square(X1[:, np.newaxis, :] - X2[np.newaxis, :, :]),
+                                   axis=2))
+            return model.magnitude * np.exp(-dists / model.length_scale)
+        K = kernel(self.X_train, self.X_train) + np.eye(self.X_train.shape[0])
+        K2 = kernel(self.X_train, self.X_test)
+        cov = kernel(self.X_test, self.X_test) - K2.T.dot(np.linalg.solve(K, K2))
+        return np.sqrt(np.diag(cov)).reshape(-1, 1)
+
+    def test_gpr_sigmas(self):
+        for model_cls in (GPRNP, GPR):
+            for solver in (GPRNP.SOLVER_INVERSE, GPRNP.SOLVER_CHOLESKY):
+                model = model_cls(length_scale=0.5, magnitude=2.0, batch_size=50,
+                                  solver=solver)
+                model.fit(self.X_train, self.y_train, ridge=1.0)
+                np.testing.assert_allclose(model.predict(self.X_test).sigmas,
+                                           self.full_covariance_sigmas(model),
+                                           rtol=1e-3, atol=1e-4)
+
+
+class TestGPRNPMultiOutput(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestGPRNPMultiOutput, cls).setUpClass()
+        boston = datasets.load_boston()
+        data = boston['data']
+        X_min, X_max = data.min(axis=0), data.max(axis=0)
+        data = (data - X_min) / (X_max - X_min)
+        # Predict the last 3 features (and the target) from the others
+        cls.X_train = data[0:400, :-3]
+        cls.X_test = data[400:, :-3]
+        cls.y_train = np.hstack((data[0:400, -3:], boston['target'][0:400].reshape(-1, 1)))
+
+    def test_gprnp_multi_output_matches_single(self):
+        for kwargs in ({'solver': GPRNP.SOLVER_INVERSE},
+                       {'solver': GPRNP.SOLVER_CHOLESKY},
+                       {'num_inducing': 100}):
+            model = GPRNP(length_scale=1.0, magnitude=1.0, batch_size=64, **kwargs)
+            model.fit(self.X_train, self.y_train, ridge=1.0)
+            result = model.predict(self.X_test)
+            self.assertEqual(result.ypreds.shape, (self.X_test.shape[0], self.y_train.shape[1]))
+            self.assertEqual(result.sigmas.shape, (self.X_test.shape[0], 1))
+            self.assertEqual(result.acquisitions['ei'].shape, result.ypreds.shape)
+            for j in range(self.y_train.shape[1]):
+                single = GPRNP(length_scale=1.0, magnitude=1.0, batch_size=64, **kwargs)
+                single.fit(self.X_train, self.y_train[:, j:j + 1], ridge=1.0)
+                single_result = single.predict(self.X_test)
+                np.testing.assert_allclose(result.ypreds[:, j:j + 1], single_result.ypreds,
+                                           rtol=1e-5, atol=1e-6)
+                np.testing.assert_allclose(result.sigmas, single_result.sigmas)
+                np.testing.assert_allclose(result.acquisitions['ei'][:, j:j + 1],
+                                           single_result.acquisitions['ei'],
+                                           rtol=1e-5, atol=1e-6)
+
+
+class TestGPRPrecision(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestGPRPrecision, cls).setUpClass()
+        boston = datasets.load_boston()
+        data = boston['data']
+        X_min, X_max = data.min(axis=0), data.max(axis=0)
+        cls.X_train = (data[0:400] - X_min) / (X_max - X_min)
+        cls.X_test = (data[400:] - X_min) / (X_max - X_min)
+        y_train = boston['target'][0:400].reshape(400, 1)
+        cls.y_train = (y_train - y_train.mean()) / y_train.std()
+
+    def test_gpr_precision(self):
+        for model_cls in (GPRNP, GPR):
+            for solver in (GPRNP.SOLVER_INVERSE, GPRNP.SOLVER_CHOLESKY):
+                results = {}
+                for dtype in (np.float32, np.float64):
+                    X_train = self.X_train.astype(dtype)
+                    model = model_cls(length_scale=1.0, magnitude=1.0, solver=solver,
+                                      dtype=dtype)
+                    model.fit(X_train, self.y_train, ridge=0.1)
+                    factor = model.K_chol if solver == GPRNP.SOLVER_CHOLESKY else model.K_inv
+                    for arr in (model.y_train, model.K, factor, model.xy_):
+                        self.assertEqual(arr.dtype, dtype)
+                    results[dtype] = model.predict(self.X_test)
+                np.testing.assert_allclose(results[np.float32].ypreds,
+                                           results[np.float64].ypreds, atol=1e-3)
+                np.testing.assert_allclose(results[np.float32].sigmas,
+                                           results[np.float64].sigmas, atol=1e-3)
+
+    def test_gprnp_precision_no_copy(self):
+        X_train = self.X_train.astype(np.float32)
+        model = GPRNP(length_scale=1.0, magnitude=1.0, dtype='float32')
+        model.fit(X_train, self.y_train, ridge=0.1)
+        self.assertIs(model.X_train, X_train)
+
+    def test_gprgdnp_precision(self):
+        X_min, X_max = np.zeros(self.X_train.shape[1]), np.ones(self.X_train.shape[1])
+        minls = {}
+        for dtype in (np.float32, np.float64):
+            model = GPRGDNP(length_scale=1.0, magnitude=1.0, max_iter=20, dtype=dtype)
+            model.fit(self.X_train, self.y_train, X_min, X_max, ridge=0.1)
+            minls[dtype] = model.predict(self.X_test).minl
+        np.testing.assert_allclose(minls[np.float32], minls[np.float64], atol=1e-3)
+
+    def test_gpr_unsupported_precision(self):
+        for model_cls in (GPRNP, GPR):
+            with self.assertRaises(Exception):
+                model_cls(dtype=np.int32)
@@ -0,0 +1,204 @@
+#
+# OtterTune - test_kernels.py
+#
+# Copyright (c) 2017-18, Carnegie Mellon University Database Group
+#
+import unittest
+from unittest import mock
+import numpy as np
+from scipy.spatial.distance import cdist
+from analysis.gp import GPRNP, GPRGDNP, log_marginal_likelihood
+from analysis.gp_tf import GPR
+from analysis.kernels import (EXPONENTIAL, KERNELS, MATERN32, MATERN52, RBF, Kernel,
+                              create_kernel, iter_dist_blocks)
+
+
+class TestKernels(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestKernels, cls).setUpClass()
+        rng = np.random.RandomState(0)
+        cls.X1 = rng.rand(50, 3)
+        cls.X2 = rng.rand(70, 3)
+
+    def test_kernel_values(self):
+        r = np.array([0.0, 2.0])
+        np.testing.assert_allclose(create_kernel(EXPONENTIAL, 2.0, 3.0).from_dists(r),
+                                   [3.0, 3.0 * np.exp(-1.0)])
+        np.testing.assert_allclose(create_kernel(RBF, 2.0, 3.0).from_dists(r),
+                                   [3.0, 3.0 * np.exp(-0.5)])
+        np.testing.assert_allclose(create_kernel(MATERN32, 2.0, 3.0).from_dists(r),
+                                   [3.0, 3.0 * (1 + np.sqrt(3)) * np.exp(-np.sqrt(3))])
+        matern52 = 3.0 * (1 + np.sqrt(5) + 5.0 / 3) * np.exp(-np.sqrt(5))
+        np.testing.assert_allclose(create_kernel(MATERN52, 2.0, 3.0).from_dists(r),
+                                   [3.0, matern52])
+        with self.assertRaises(Exception):
+            create_kernel('periodic')
+
+    def test_kernel_abstract(self):
+        # A kernel that does not define its profile cannot be instantiated
+        class PartialKernel(Kernel):
+
+            def profile(self, s, xp=np):
+                return xp.exp(-s)
+
+        with self.assertRaises(TypeError):
+            Kernel()
+        with self.assertRaises(TypeError):
+            PartialKernel()
+
+    def test_kernel_blocks(self):
+        for kernel_type in KERNELS:
+            kernel = create_kernel(kernel_type, 0.7, 1.5)
+            expected = kernel.from_dists(cdist(self.X1, self.X2))
+            np.testing.assert_allclose(kernel(self.X1, self.X2), expected)
+            # Blocks of one and of several rows
+            np.testing.assert_allclose(kernel(self.X1, self.X2, block_elements=1), expected)
+            np.testing.assert_allclose(kernel(self.X1, self.X2, block_elements=500),
+                                       expected)
+            K = kernel(self.X1, self.X2, dtype=np.float32)
+            self.assertEqual(K.dtype, np.float32)
+            np.testing.assert_allclose(K, expected, rtol=1e-6)
+
+    def test_dist_blocks(self):
+        for block_elements in (1, 500, None):
+            dists = np.vstack([block for _, _, block in
+                               iter_dist_blocks(self.X1, self.X2, block_elements)])
+            np.testing.assert_allclose(dists, cdist(self.X1, self.X2))
+        blocks = [(start, end) for start, end, _ in iter_dist_blocks(self.X1, self.X2, 500)]
+        self.assertEqual(blocks[:2], [(0, 7), (7, 14)])
+        self.assertEqual(blocks[-1], (49, 50))
+
+    def test_lml_blocks(self):
+        y = np.sin(3 * self.X1).sum(axis=1).reshape(-1, 1)
+        for kernel_type in KERNELS:
+            expected = log_marginal_likelihood(self.X1, y, 0.7, 1.5, 0.1, eval_gradient=True,
+                                               kernel_type=kernel_type)
+            with mock.patch('analysis.kernels.BLOCK_ELEMENTS', 100):
+                lml, grad = log_marginal_likelihood(self.X1, y, 0.7, 1.5, 0.1,
+                                                    eval_gradient=True,
+                                                    kernel_type=kernel_type)
+            np.testing.assert_allclose(lml, expected[0])
+            np.testing.assert_allclose(grad, expected[1])
+
+    def test_kernel_gradient(self):
+        x = self.X1[:1]
+        step = 1e-6
+        for kernel_type in KERNELS:
+            kernel = create_kernel(kernel_type, 0.7, 1.5)
+            grad = kernel.grad_coef(cdist(x, self.X2)).T * (x - self.X2)
+            for j in range(x.shape[1]):
+                delta = np.zeros(x.shape[1])
+                delta[j] = step
+                k_hi = kernel(x + delta, self.X2).ravel()
+                k_lo = kernel(x - delta, self.X2).ravel()
+                np.testing.assert_allclose(grad[:, j], (k_hi - k_lo) / (2 * step),
+                                           atol=1e-6)
+
+    def test_lml_gradient(self):
+        y = np.sin(3 * self.X1).sum(axis=1).reshape(-1, 1)
+        step = 1e-6
+        for kernel_type in KERNELS:
+            _, grad = log_marginal_likelihood(self.X1, y, 0.7, 1.5, 0.1, eval_gradient=True,
+                                              kernel_type=kernel_type)
+            for i, (length_scale, magnitude) in enumerate(((0.7 * np.exp(step), 1.5),
+                                                           (0.7, 1.5 * np.exp(step)))):
+                lml_hi = log_marginal_likelihood(self.X1, y, length_scale, magnitude, 0.1,
+                                                 kernel_type=kernel_type)
+                lml_lo = log_marginal_likelihood(self.X1, y, 0.7 ** 2 / length_scale,
+                                                 1.5 ** 2 / magnitude, 0.1,
+                                                 kernel_type=kernel_type)
+                np.testing.assert_allclose(grad[i], (lml_hi - lml_lo) / (2 * step),
+                                           rtol=1e-4)
+
+
+class TestGPRKernels(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestGPRKernels, cls).setUpClass()
+        rng = np.random.RandomState(0)
+        cls.X_train = rng.rand(200, 4)
+        y_train = np.sin(3 * cls.X_train).sum(axis=1).reshape(-1, 1)
+        cls.y_train = (y_train - y_train.mean()) / y_train.std()
+        cls.X_test = rng.rand(30, 4)
+        cls.X_min = np.zeros(4)
+        cls.X_max = np.ones(4)
+
+    def test_gprnp_matches_tf(self):
+        for kernel_type in KERNELS:
+            for solver in (GPRNP.SOLVER_INVERSE, GPRNP.SOLVER_CHOLESKY):
+                np_model = GPRNP(length_scale=0.7, magnitude=1.5, solver=solver,
+                                 kernel_type=kernel_type, dtype=np.float64)
+                np_model.fit(self.X_train, self.y_train, ridge=0.01)
+                tf_model = GPR(length_scale=0.7, magnitude=1.5, solver=solver,
+                               kernel_type=kernel_type, dtype=np.float64)
+                tf_model.fit(self.X_train, self.y_train, ridge=0.01)
+                np_result = np_model.predict(self.X_test)
+                tf_result = tf_model.predict(self.X_test)
+                np.testing.assert_allclose(np_result.ypreds, tf_result.ypreds, atol=1e-6)
+                np.testing.assert_allclose(np_result.sigmas, tf_result.sigmas, atol=1e-6)
+
+    def test_gprgdnp_gradient(self):
+        step = 1e-6
+        for kernel_type in KERNELS:
+            model = GPRGDNP(length_scale=0.7, magnitude=1.5, kernel_type=kernel_type,
+                            dtype=np.float64)
+            model.fit(self.X_train, self.y_train, self.X_min, self.X_max, ridge=0.01)
+            grad = model.objective(self.X_test)[3]
+            for j in range(self.X_test.shape[1]):
+                delta = np.zeros(self.X_test.shape[1])
+                delta[j] = step
+                loss_hi = model.objective(self.X_test + delta, gradient=False)[2]
+                loss_lo = model.objective(self.X_test - delta, gradient=False)[2]
+                np.testing.assert_allclose(grad[:, j], (loss_hi - loss_lo) / (2 * step),
+                                           atol=1e-4)
+            # The same gradient in blocks of a few rows of X_test
+            with mock.patch('analysis.kernels.BLOCK_ELEMENTS', 1000):
+                np.testing.assert_allclose(model.objective(self.X_test)[3], grad)
+
+    def test_gpr_kernel_blocks(self):
+        for kernel_type in KERNELS:
+            model = GPR(length_scale=0.7, magnitude=1.5, kernel_type=kernel_type,
+                        dtype=np.float64)
+            expected = create_kernel(kernel_type, 0.7, 1.5).from_dists(
+                cdist(self.X_train, self.X_test))
+            np.testing.assert_allclose(model.kernel_matrix(self.X_train, self.X_test),
+                                       expected, atol=1e-10)
+            # Blocks of a few rows
+            with mock.patch('analysis.kernels.BLOCK_ELEMENTS', 100):
+                np.testing.assert_allclose(model.kernel_matrix(self.X_train, self.X_test),
+                                           expected, atol=1e-10)
+            ridge = np.linspace(0.01, 0.1, self.X_test.shape[0])
+            K_test = model.kernel_matrix(self.X_test, self.X_test)
+            np.testing.assert_allclose(model.kernel_matrix(self.X_test, self.X_test, ridge),
+                                       K_test + np.diag(ridge))
+
+    def test_gpr_kernel_block_size(self):
+        # The kernel op only ever computes one block of the kernel matrix
+        model = GPR(length_scale=0.7, magnitude=1.5, dtype=np.float64)
+        sizes = []
+        with model.build_graph() as entry:
+            run = entry.session.run
+
+            def run_spy(fetches, feed_dict=None):
+                result = run(fetches, feed_dict=feed_dict)
+                if fetches is entry.ops['K_op']:
+                    sizes.append(result.size)
+                return result
+
+            with mock.patch.object(entry.session, 'run', side_effect=run_spy), \
+                    mock.patch('analysis.kernels.BLOCK_ELEMENTS', 1000):
+                model.fit(self.X_train, self.y_train, ridge=0.01)
+        self.assertEqual(sum(sizes), self.X_train.shape[0] ** 2)
+        self.assertLessEqual(max(sizes), 1000)
+        K = create_kernel(EXPONENTIAL, 0.7, 1.5)(self.X_train, self.X_train)
+        K[np.diag_indices_from(K)] += 0.01
+        np.testing.assert_allclose(model.K, K, atol=1e-10)
+
+    def test_unknown_kernel(self):
+        with self.assertRaises(Exception):
+            GPRNP(kernel_type='periodic')
+        with self.assertRaises(Exception):
+            GPR(kernel_type='periodic')
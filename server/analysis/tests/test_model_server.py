@@ -0,0 +1,105 @@
+#
+# OtterTune - test_model_server.py
+#
+# Copyright (c) 2017-18, Carnegie Mellon University Database Group
+#
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import numpy as np
+from analysis.gp import GPRNP
+from analysis.model_server import (CONNECTION_ERRORS, ModelClient, ModelServer,
+                                   run_operation)
+from analysis.model_store import model_key
+
+
+class TestModelServer(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestModelServer, cls).setUpClass()
+        rng = np.random.RandomState(0)
+        cls.X_train = rng.rand(100, 4)
+        y_train = np.sum(np.square(cls.X_train - 0.5), axis=1).reshape(-1, 1)
+        cls.y_train = (y_train - y_train.mean()) / y_train.std()
+        cls.X_test = rng.rand(10, 4)
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        address = os.path.join(self.root, 'models.sock')
+        self.server = ModelServer(address, authkey=b'test', max_models=1,
+                                  model_dir=os.path.join(self.root, 'models'))
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        while self.server.listener is None:
+            self.thread.join(0.01)
+        self.client = ModelClient(address, authkey=b'test')
+
+    def tearDown(self):
+        self.client.shutdown()
+        self.thread.join(10)
+        shutil.rmtree(self.root)
+
+    def create_model(self):
+        return GPRNP(length_scale=1.0, magnitude=1.0)
+
+    def test_call(self):
+        fit_args = (self.X_train, self.y_train)
+        model = self.create_model()
+        key = (1, 2, model_key(model, fit_args, 0.1))
+        # The first call is a miss: the model is sent, fit and cached
+        res = self.client.call(key, 'predict', args=(self.X_test,), model=model,
+                               fit_args=fit_args, ridge=0.1)
+        expected = run_operation(self.create_model().fit(*fit_args, ridge=0.1),
+                                 'predict', self.X_test)
+        np.testing.assert_allclose(res.ypreds, expected.ypreds)
+        np.testing.assert_allclose(res.sigmas, expected.sigmas)
+        # The second one is a hit
+        res = self.client.call(key, 'predict', args=(self.X_test,),
+                               kwargs={'acquisitions': ()})
+        np.testing.assert_allclose(res.ypreds, expected.ypreds)
+        stats = self.client.stats()
+        self.assertEqual(stats['counters']['requests'], 3)
+        self.assertEqual(stats['counters']['hits'], 1)
+        self.assertEqual(stats['counters']['misses'], 1)
+        self.assertEqual(stats['counters']['fits'], 1)
+        self.assertEqual(stats['num_models'], 1)
+        self.assertEqual(stats['latencies']['predict']['count'], 1)
+        self.assertEqual(stats['latencies']['fit+predict']['count'], 1)
+
+    def test_eviction_and_store(self):
+        fit_args = (self.X_train, self.y_train)
+        model = self.create_model()
+        keys = [(1, 2, model_key(model, fit_args, ridge)) for ridge in (0.1, 0.2)]
+        for key, ridge in zip(keys, (0.1, 0.2)):
+            self.client.call(key, 'predict', args=(self.X_test,), model=model,
+                             fit_args=fit_args, ridge=ridge)
+        # Only one model fits in the server, so the first one was evicted,
+        # but it is loaded from the model store rather than refit
+        self.client.call(keys[0], 'predict', args=(self.X_test,), model=model,
+                         fit_args=fit_args, ridge=0.1)
+        counters = self.client.stats()['counters']
+        self.assertEqual(counters['evictions'], 2)
+        self.assertEqual(counters['fits'], 2)
+        self.assertEqual(counters['loads'], 1)
+
+    def test_errors(self):
+        with self.assertRaises(Exception):
+            self.client.call((1, 2, 'missing'), 'predict', args=(self.X_test,))
+        fit_args = (self.X_train, self.y_train)
+        with self.assertRaises(Exception):
+            self.client.call((1, 2, 'key'), 'unknown', model=self.create_model(),
+                             fit_args=fit_args, ridge=0.1)
+        self.assertEqual(self.client.stats()['counters']['errors'], 1)
+        with self.assertRaises(CONNECTION_ERRORS):
+            ModelClient(self.client.address, authkey=b'wrong').stats()
+        for authkey in (None, b''):
+            with self.assertRaises(Exception):
+                ModelServer(('localhost', 0), authkey=authkey)
+
+
+if __name__ == '__main__':
+    unittest.main()
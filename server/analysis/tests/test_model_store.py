@@ -0,0 +1,87 @@
+#
+# OtterTune - test_model_store.py
+#
+# Copyright (c) 2017-18, Carnegie Mellon University Database Group
+#
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from sklearn import datasets
+from analysis.gp import GPRNP, GPRGDNP
+from analysis.model_store import ModelStore, data_hash, load_model, save_model
+
+
+class TestModelStore(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestModelStore, cls).setUpClass()
+        boston = datasets.load_boston()
+        data = boston['data']
+        X_min, X_max = data.min(axis=0), data.max(axis=0)
+        cls.X_train = (data[0:400] - X_min) / (X_max - X_min)
+        cls.X_test = (data[400:] - X_min) / (X_max - X_min)
+        y_train = boston['target'][0:400].reshape(400, 1)
+        cls.y_train = (y_train - y_train.mean()) / y_train.std()
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_save_load_gprnp(self):
+        for kwargs in ({'solver': GPRNP.SOLVER_INVERSE},
+                       {'solver': GPRNP.SOLVER_CHOLESKY},
+                       {'num_inducing': 100, 'dtype': np.float32}):
+            model = GPRNP(length_scale=1.0, magnitude=1.0, **kwargs)
+            model.fit(self.X_train, self.y_train, ridge=0.1)
+            path = os.path.join(self.root, 'model')
+            save_model(model, path)
+            loaded = load_model(path)
+            self.assertIsInstance(loaded, GPRNP)
+            self.assertIsInstance(loaded.X_train, np.memmap)
+            self.assertEqual(loaded.dtype, model.dtype)
+            expected = model.predict(self.X_test)
+            result = loaded.predict(self.X_test)
+            np.testing.assert_array_equal(result.ypreds, expected.ypreds)
+            np.testing.assert_array_equal(result.sigmas, expected.sigmas)
+            # The memory-mapped arrays are not modified by partial_fit
+            loaded.partial_fit(self.X_test[:5], np.zeros((5, 1)), ridge=0.1)
+            self.assertEqual(load_model(path).X_train.shape, self.X_train.shape)
+
+    def test_save_load_gprgdnp(self):
+        X_min, X_max = np.zeros(self.X_train.shape[1]), np.ones(self.X_train.shape[1])
+        model = GPRGDNP(length_scale=1.0, magnitude=1.0, max_iter=20)
+        model.fit(self.X_train, self.y_train, X_min, X_max, ridge=0.1)
+        path = os.path.join(self.root, 'model')
+        save_model(model, path)
+        loaded = load_model(path)
+        self.assertIsInstance(loaded, GPRGDNP)
+        np.testing.assert_array_equal(loaded.predict(self.X_test).minl,
+                                      model.predict(self.X_test).minl)
+
+    def test_model_store(self):
+        store = ModelStore(self.root)
+        model = GPRNP(length_scale=1.0, magnitude=1.0)
+        model.fit(self.X_train, self.y_train, ridge=0.1)
+        key = data_hash(self.X_train, self.y_train)
+        self.assertIsNone(store.load(1, 2, key))
+        store.save(1, 2, key, model)
+        store.save(2, 2, key, model)
+        self.assertIsNotNone(store.load(1, 2, key))
+        self.assertIsNone(store.load(1, 3, key))
+        store.prune([2])
+        self.assertIsNone(store.load(1, 2, key))
+        self.assertIsNotNone(store.load(2, 2, key))
+
+    def test_data_hash(self):
+        key = data_hash(self.X_train, self.y_train)
+        self.assertEqual(key, data_hash(self.X_train.copy(), self.y_train.copy()))
+        X_changed = self.X_train.copy()
+        X_changed[0, 0] += 1e-6
+        self.assertNotEqual(key, data_hash(X_changed, self.y_train))
+        self.assertNotEqual(key, data_hash(self.X_train.astype(np.float32), self.y_train))
+        self.assertNotEqual(key, data_hash(self.X_train.T, self.y_train))
@@ -0,0 +1,102 @@
+#
+# OtterTune - test_screening.py
+#
+# Copyright (c) 2017-18, Carnegie Mellon University Database Group
+#
+import time
+import unittest
+import numpy as np
+from analysis.acquisition import EXPECTED_IMPROVEMENT, UPPER_CONFIDENCE_BOUND
+from analysis.gp import GPRNP, GPRGDNP
+from analysis.gp_tf import GPR
+from analysis.screening import halton_sequence, iter_halton_candidates, screen_candidates
+
+
+class TestHaltonSequence(unittest.TestCase):
+
+    def test_halton_sequence(self):
+        points = halton_sequence(0, 4, 2)
+        np.testing.assert_allclose(points, [[0.5, 1.0 / 3], [0.25, 2.0 / 3],
+                                            [0.75, 1.0 / 9], [0.125, 4.0 / 9]])
+
+    def test_halton_chunks(self):
+        X_min = np.array([-1.0, 0.0, 2.0])
+        X_max = np.array([1.0, 0.5, 3.0])
+        chunks = list(iter_halton_candidates(1000, X_min, X_max, chunk_size=300))
+        self.assertEqual([chunk.shape[0] for chunk in chunks], [300, 300, 300, 100])
+        X = np.vstack(chunks)
+        np.testing.assert_allclose(X, X_min + halton_sequence(0, 1000, 3) * (X_max - X_min))
+        self.assertTrue(np.all(X >= X_min))
+        self.assertTrue(np.all(X <= X_max))
+        self.assertEqual(np.unique(X, axis=0).shape[0], X.shape[0])
+
+
+class TestScreenCandidates(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestScreenCandidates, cls).setUpClass()
+        rng = np.random.RandomState(0)
+        cls.X_train = rng.rand(300, 4)
+        y_train = np.sin(3 * cls.X_train).sum(axis=1).reshape(-1, 1)
+        cls.y_train = (y_train - y_train.mean()) / y_train.std()
+        cls.X_min = np.zeros(4)
+        cls.X_max = np.ones(4)
+        cls.X_candidates = np.vstack(list(iter_halton_candidates(5000, cls.X_min, cls.X_max)))
+
+    def check_top_k(self, model, acquisition, k=20):
+        expected = GPRNP.predict(model, self.X_candidates, acquisitions=(acquisition,),
+                                 beta=2.0) if isinstance(model, GPRNP) else None
+        chunks = iter_halton_candidates(5000, self.X_min, self.X_max, chunk_size=700)
+        X_top, res = screen_candidates(model, chunks, k, acquisition=acquisition, beta=2.0)
+        self.assertEqual(X_top.shape, (k, 4))
+        scores = res.acquisitions[acquisition].ravel()
+        self.assertTrue(np.all(np.diff(scores) <= 0))
+        if expected is not None:
+            order = np.argsort(-expected.acquisitions[acquisition].ravel(), kind='mergesort')
+            np.testing.assert_allclose(X_top, self.X_candidates[order[:k]])
+            np.testing.assert_allclose(scores, expected.acquisitions[acquisition][order[:k]]
+                                       .ravel())
+            np.testing.assert_allclose(res.ypreds, expected.ypreds[order[:k]])
+        return X_top, res
+
+    def test_screen_gprnp(self):
+        model = GPRNP(length_scale=1.0, magnitude=1.0, solver=GPRNP.SOLVER_CHOLESKY)
+        model.fit(self.X_train, self.y_train, ridge=0.01)
+        for acquisition in (EXPECTED_IMPROVEMENT, UPPER_CONFIDENCE_BOUND):
+            self.check_top_k(model, acquisition)
+
+    def test_screen_gprgdnp(self):
+        # The GPR predictions of gradient descent models are screened
+        model = GPRGDNP(length_scale=1.0, magnitude=1.0)
+        model.fit(self.X_train, self.y_train, self.X_min, self.X_max, ridge=0.01)
+        self.check_top_k(model, UPPER_CONFIDENCE_BOUND)
+
+    def test_screen_tf(self):
+        np_model = GPRNP(length_scale=1.0, magnitude=1.0, dtype=np.float64)
+        np_model.fit(self.X_train, self.y_train, ridge=0.01)
+        tf_model = GPR(length_scale=1.0, magnitude=1.0, dtype=np.float64)
+        tf_model.fit(self.X_train, self.y_train, ridge=0.01)
+        np_top, np_res = self.check_top_k(np_model, UPPER_CONFIDENCE_BOUND)
+        tf_top, tf_res = self.check_top_k(tf_model, UPPER_CONFIDENCE_BOUND)
+        np.testing.assert_allclose(tf_top, np_top)
+        np.testing.assert_allclose(tf_res.sigmas, np_res.sigmas, atol=1e-6)
+
+    def test_screen_few_candidates(self):
+        model = GPRNP(length_scale=1.0, magnitude=1.0)
+        model.fit(self.X_train, self.y_train, ridge=0.01)
+        X_top, res = screen_candidates(model, [self.X_candidates[:3]], 10)
+        self.assertEqual(X_top.shape, (3, 4))
+        self.assertEqual(res.acquisitions[EXPECTED_IMPROVEMENT].shape, (3, 1))
+        with self.assertRaises(Exception):
+            screen_candidates(model, [], 10)
+
+    def test_screen_deadline(self):
+        model = GPRNP(length_scale=1.0, magnitude=1.0)
+        model.fit(self.X_train, self.y_train, ridge=0.01)
+        chunks = [self.X_candidates[:5], self.X_candidates[5:]]
+        # Past the deadline, only the first chunk is screened
+        X_top, _ = screen_candidates(model, chunks, 10, deadline=time.time() - 1)
+        self.assertEqual(X_top.shape, (5, 4))
+        X_top, _ = screen_candidates(model, chunks, 10, deadline=time.time() + 3600)
+        self.assertEqual(X_top.shape, (10, 4))
@@ -0,0 +1,67 @@
+#
+# OtterTune - test_trust_region.py
+#
+# Copyright (c) 2017-18, Carnegie Mellon University Database Group
+#
+import unittest
+import numpy as np
+from analysis.trust_region import TrustRegion, select_local_samples
+
+
+class TestTrustRegion(unittest.TestCase):
+
+    def test_grow_and_shrink(self):
+        region = TrustRegion(length_init=0.4, length_max=1.0, success_tolerance=2,
+                             failure_tolerance=3)
+        self.assertFalse(region.update(10.0))
+        self.assertTrue(region.update(9.0))
+        self.assertTrue(region.update(8.0))
+        self.assertEqual(region.length, 0.8)
+        # Capped at length_max
+        region.fit_history([7.0, 6.0])
+        self.assertEqual(region.length, 1.0)
+        # A tiny improvement is not a success
+        self.assertFalse(region.update(5.999999))
+        region.fit_history([6.0, 7.0])
+        self.assertEqual(region.length, 0.5)
+        self.assertEqual(region.y_best, 5.999999)
+
+    def test_restart(self):
+        region = TrustRegion(length_init=0.8, length_min=0.2, failure_tolerance=1)
+        region.fit_history([1.0, 2.0, 2.0])
+        self.assertEqual(region.length, 0.2)
+        self.assertEqual(region.n_restarts, 0)
+        region.update(3.0)
+        self.assertEqual(region.length, 0.8)
+        self.assertEqual(region.n_restarts, 1)
+        with self.assertRaises(Exception):
+            TrustRegion(length_init=0.1, length_min=0.2)
+
+    def test_bounds(self):
+        region = TrustRegion(length_init=0.5)
+        X_min = np.array([0.0, 0.0, -2.0])
+        X_max = np.array([1.0, 1.0, 2.0])
+        lower, upper = region.bounds(np.array([0.5, 0.1, 0.0]), X_min, X_max)
+        np.testing.assert_allclose(lower, [0.25, 0.0, -1.0])
+        np.testing.assert_allclose(upper, [0.75, 0.35, 1.0])
+        lower, upper = region.bounds(np.array([0.5, 0.1, 0.0]), X_min, X_max,
+                                     local_dims=np.array([False, True, True]))
+        np.testing.assert_allclose(lower, [0.0, 0.0, -1.0])
+        np.testing.assert_allclose(upper, [1.0, 0.35, 1.0])
+
+    def test_select_local_samples(self):
+        X = np.array([[0.5, 0.5], [0.45, 0.5], [0.9, 0.9], [0.6, 0.6], [0.0, 0.0]])
+        center = np.array([0.5, 0.5])
+        lower, upper = np.array([0.4, 0.4]), np.array([0.7, 0.7])
+        np.testing.assert_array_equal(
+            select_local_samples(X, center, lower, upper), [0, 1, 3])
+        # The closest rows outside of the box are added...
+        np.testing.assert_array_equal(
+            select_local_samples(X, center, lower, upper, min_samples=4), [0, 1, 2, 3])
+        # ... and the farthest ones inside of it are dropped
+        np.testing.assert_array_equal(
+            select_local_samples(X, center, lower, upper, max_samples=2), [0, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+#
+# OtterTune - trust_region.py
+#
+# Copyright (c) 2017-18, Carnegie Mellon University Database Group
+#
+'''
+Trust region for local optimization over many knobs (as in TuRBO, Eriksson
+et al., 2019). Rather than searching the whole knob space, the model is fit
+and optimized only in a box around the best configuration found so far (the
+incumbent). The box grows after consecutive improvements and shrinks after
+consecutive failures, and restarts at its initial size once it has collapsed.
+The side of the box is a fraction (length) of the range of each knob, so the
+number of training samples and the search space stay bounded no matter how
+many knobs are tuned.
+'''
+import numpy as np
+
+from analysis.util import get_analysis_logger
+
+LOG = get_analysis_logger(__name__)
+
+
+class TrustRegion(object):
+
+    def __init__(self, length_init=0.8, length_min=0.5 ** 7, length_max=1.6,
+                 success_tolerance=3, failure_tolerance=4, improvement_tol=1e-3):
+        if not 0 < length_min <= length_init <= length_max:
+            raise Exception("The trust region lengths must satisfy 0 < length_min <= "
+                            "length_init <= length_max ({}, {}, {})".format(
+                                length_min, length_init, length_max))
+        self.length_init = length_init
+        self.length_min = length_min
+        self.length_max = length_max
+        self.success_tolerance = success_tolerance
+        self.failure_tolerance = failure_tolerance
+        # An observation is a success if it improves the best one by more
+        # than improvement_tol * |best|
+        self.improvement_tol = improvement_tol
+        self.length = length_init
+        self.n_successes = 0
+        self.n_failures = 0
+        self.n_restarts = 0
+        self.y_best = None
+
+    def __repr__(self):
+        return "TrustRegion(length={}, n_successes={}, n_failures={}, n_restarts={})".format(
+            self.length, self.n_successes, self.n_failures, self.n_restarts)
+
+    def update(self, y_new):
+        # Records an observation of the objective (lower is better) and
+        # grows/shrinks the region. The first observation only sets y_best.
+        # Returns True if the observation was a success.
+        y_new = float(y_new)
+        if self.y_best is None:
+            self.y_best = y_new
+            return False
+        success = y_new < self.y_best - self.improvement_tol * abs(self.y_best)
+        self.y_best = min(self.y_best, y_new)
+        if success:
+            self.n_successes += 1
+            self.n_failures = 0
+        else:
+            self.n_successes = 0
+            self.n_failures += 1
+        if self.n_successes >= self.success_tolerance:
+            self.length = min(2.0 * self.length, self.length_max)
+            self.n_successes = 0
+        elif self.n_failures >= self.failure_tolerance:
+            self.length /= 2.0
+            self.n_failures = 0
+        if self.length < self.length_min:
+            # The region has collapsed around a local optimum: restart
+            LOG.debug("Trust region collapsed, restarting (%s)", str(self))
+            self.length = self.length_init
+            self.n_restarts += 1
+        return success
+
+    def fit_history(self, y_history):
+        # Replays the observations of the objective in the order they were
+        # made, so the region does not need to be stored between
+        # recommendations. Returns self.
+        for y_new in np.asarray(y_history, dtype=float).ravel():
+            self.update(y_new)
+        return self
+
+    def bounds(self, x_center, X_min, X_max, local_dims=None):
+        # Returns the (lower, upper) bounds of the region around x_center:
+        # a box with sides length * (X_max - X_min) / 2 on each side of the
+        # center, clipped to [X_min, X_max]. Only the dimensions in the
+        # boolean mask local_dims (default: all) are restricted, e.g., the
+        # dummy encoded categorical knobs can be left unrestricted.
+        X_min = np.asarray(X_min, dtype=float)
+        X_max = np.asarray(X_max, dtype=float)
+        half_width = 0.5 * self.length * (X_max - X_min)
+        lower = np.maximum(X_min, x_center - half_width)
+        upper = np.minimum(X_max, x_center + half_width)
+        if local_dims is not None:
+            lower = np.where(local_dims, lower, X_min)
+            upper = np.where(local_dims, upper, X_max)
+        return lower, upper
+
+
+def select_local_samples(X, x_center, lower, upper, min_samples=1, max_samples=None):
+    # Returns the (sorted) indices of the rows of X in the box [lower, upper].
+    # If there are fewer than min_samples, the rows closest to x_center (by
+    # the distance scaled by the width of the box) are added, and if there
+    # are more than max_samples only the closest ones are kept.
+    width = np.maximum(upper - lower, 1e-12)
+    dists = np.sqrt(np.sum(np.square((X - x_center) / width), axis=1))
+    inside = np.all((X >= lower) & (X <= upper), axis=1)
+    order = np.lexsort((dists, ~inside))
+    n_samples = max(min(min_samples, X.shape[0]), np.count_nonzero(inside))
+    if max_samples is not None:
+        n_samples = min(n_samples, max_samples)
+    return np.sort(order[:n_samples])
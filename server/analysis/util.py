@@ -14,6 +14,7 @@ from numbers import Number
 
 import contextlib
 import datetime
+import time
 import numpy as np
 
 
@@ -76,6 +77,12 @@ def stopwatch(message=None):
             LOG.info('Total elapsed_seconds time for %s: %.3fs', message, ts.elapsed_seconds)
 
 
+def deadline_passed(deadline):
+    # Returns True if the deadline (a time.time() timestamp, or None for no
+    # deadline) has passed
+    return deadline is not None and time.time() >= deadline
+
+
 def get_data_base(arr):
     """For a given Numpy array, finds the
     base array that "owns" the actual data."""
@@ -10,11 +10,14 @@ Admin tasks
 '''
 
 import logging
+import os
 from collections import namedtuple
 from fabric.api import env, local, quiet, settings, task
 from fabric.state import output as fabric_output
 
-from website.settings import DATABASES, PROJECT_ROOT
+from website.settings import (DATABASES, GPR_PERSIST_MODELS, MODEL_DIR,
+                              MODEL_SERVER_ADDRESS, MODEL_SERVER_MAX_MODELS,
+                              OTTERTUNE_LIBS, PROJECT_ROOT, SECRET_KEY)
 
 LOG = logging.getLogger(__name__)
 
@@ -74,6 +77,52 @@ def stop_celery():
         local('kill -9 `ps auxww | grep \'celery worker\' | awk \'{print $2}\'`')
 
 
+def model_server_client():
+    # Imported here (the settings add the analysis package to the path) so
+    # that the other tasks do not load the analysis package
+    from analysis.model_server import ModelClient
+    return ModelClient(MODEL_SERVER_ADDRESS, authkey=SECRET_KEY.encode('utf-8'))
+
+
+@task
+def start_model_server():
+    from analysis.model_server import AUTHKEY_ENV
+    if MODEL_SERVER_ADDRESS is None:
+        raise Exception("MODEL_SERVER_ADDRESS is not set")
+    if isinstance(MODEL_SERVER_ADDRESS, tuple):
+        address = '{}:{}'.format(*MODEL_SERVER_ADDRESS)
+    else:
+        address = MODEL_SERVER_ADDRESS
+    cmd = ('PYTHONPATH={} nohup python -m analysis.model_server '
+           '--address {} --max-models {}').format(
+               OTTERTUNE_LIBS, address, MODEL_SERVER_MAX_MODELS)
+    if GPR_PERSIST_MODELS:
+        cmd += ' --model-dir {}'.format(MODEL_DIR)
+    # The authentication key is inherited through the environment rather than
+    # put in the command, which other users can read (e.g., with ps)
+    os.environ[AUTHKEY_ENV] = SECRET_KEY
+    try:
+        local(cmd + ' > /dev/null 2>&1 &')
+    finally:
+        del os.environ[AUTHKEY_ENV]
+
+
+@task
+def stop_model_server():
+    from analysis.model_server import CONNECTION_ERRORS
+    try:
+        model_server_client().shutdown()
+    except CONNECTION_ERRORS as ex:
+        LOG.warning("Model server is not running: %s", ex)
+
+
+@task
+def model_server_stats():
+    stats = model_server_client().stats()
+    LOG.info("Model server stats: %s", stats)
+    return stats
+
+
 @task
 def start_debug_server(host="0.0.0.0", port=8000):
     stop_celery()
@@ -84,6 +133,8 @@ def start_debug_server(host="0.0.0.0", port=8000):
 @task
 def stop_all():
     stop_celery()
+    if MODEL_SERVER_ADDRESS is not None:
+        stop_model_server()
     stop_rabbitmq()
 
 
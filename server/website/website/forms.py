@@ -48,11 +48,13 @@ class SessionForm(forms.ModelForm):
         self.fields['description'].required = False
         self.fields['target_objective'].required = False
         self.fields['tuning_session'].required = True
+        self.fields['recommendation_deadline'].required = False
 
     class Meta:  # pylint: disable=old-style-class,no-init
         model = Session
 
-        fields = ('name', 'description', 'tuning_session', 'dbms', 'hardware', 'target_objective')
+        fields = ('name', 'description', 'tuning_session', 'dbms', 'hardware', 'target_objective',
+                  'recommendation_deadline')
 
         widgets = {
             'name': forms.TextInput(attrs={'required': True}),
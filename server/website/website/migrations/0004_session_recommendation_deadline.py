@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.1 on 2026-10-17 10:05
+
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0003_load_initial_data'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='session',
+            name='recommendation_deadline',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(0.0)], verbose_name='recommendation deadline (seconds)'),
+        ),
+    ]
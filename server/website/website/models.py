@@ -6,7 +6,7 @@
 from collections import namedtuple, OrderedDict
 
 from django.contrib.auth.models import User
-from django.core.validators import validate_comma_separated_integer_list
+from django.core.validators import MinValueValidator, validate_comma_separated_integer_list
 from django.db import models, DEFAULT_DB_ALIAS
 from django.utils.timezone import now
 
@@ -205,6 +205,10 @@ class Session(BaseModel):
     ]
     target_objective = models.CharField(choices=TARGET_OBJECTIVES, max_length=64, null=True)
     nondefault_settings = models.TextField(null=True)
+    # Time budget of a recommendation in seconds (None for no deadline)
+    recommendation_deadline = models.FloatField(
+        null=True, blank=True, validators=[MinValueValidator(0.0)],
+        verbose_name="recommendation deadline (seconds)")
 
     def clean(self):
         if self.target_objective is None:
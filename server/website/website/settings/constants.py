@@ -8,12 +8,41 @@
 #  the number of samples (staring points) in gradient descent
 NUM_SAMPLES = 30
 
-#  the number of selected tuning knobs
+#  the number of selected tuning knobs (the search over 30-50 knobs is
+#  only tractable with TRUST_REGION_ENABLED)
 IMPORTANT_KNOB_NUMBER = 10
 
 #  top K config with best performance put into prediction
 TOP_NUM_CONFIG = 10
 
+#  the number of quasi-random candidate configurations screened with the
+#  GPR model (in chunks of SCREENING_CHUNK_SIZE, so memory does not grow
+#  with it), of which the best NUM_SCREENED_SAMPLES are added to the
+#  starting points of gradient descent. 0 disables the screening.
+NUM_SCREENED_CANDIDATES = 0
+
+NUM_SCREENED_SAMPLES = 10
+
+SCREENING_CHUNK_SIZE = 10000
+
+#  the number of configurations recommended per tuning iteration (the
+#  client driver loop benchmarks and uploads each of them in turn before it
+#  asks for the next recommendation)
+RECOMMENDATION_BATCH_SIZE = 1
+
+#  how the configurations after the first one in a batch are selected:
+#  'kriging_believer' or 'constant_liar' (see analysis/batch_selection.py)
+RECOMMENDATION_BATCH_METHOD = 'kriging_believer'
+
+#  the number of processes the reference data sets of the gap statistic
+#  (used to prune the metrics) are clustered in. Processes cannot be
+#  started from daemonic (e.g., celery prefork) workers.
+GAP_STATISTIC_NUM_JOBS = 1
+
+#  seed of the reference data sets of the gap statistic, so that the
+#  pruned metrics do not change between pipeline runs on the same data
+GAP_STATISTIC_RANDOM_STATE = 0
+
 # ---CONSTRAINTS CONSTANTS---
 
 #  Initial probability to flip categorical feature in apply_constraints
@@ -25,19 +54,133 @@ INIT_FLIP_PROB = 0.3
 FLIP_PROB_DECAY = 0.5
 
 # ---GPR CONSTANTS---
+#  Kernel of the GPR models: 'exponential', 'rbf', 'matern32' or 'matern52'
+#  (see analysis/kernels.py)
+GPR_KERNEL = 'exponential'
+
 DEFAULT_LENGTH_SCALE = 1.0
 
 DEFAULT_MAGNITUDE = 1.0
 
+#  Fit the length scale and magnitude of the GPR kernel by maximizing the
+#  log marginal likelihood of the (scaled) data each model is trained on,
+#  right before it is trained (in map_workload and the recommendation).
+#  The defaults above are used if this is disabled.
+GPR_FIT_HYPERPARAMS = False
+
+#  Max number of (random) samples used to fit the kernel hyperparameters
+GPR_HYPERPARAM_MAX_SAMPLES = 1000
+
+#  The fitted length scale and magnitude are rounded to multiples of this
+#  step in log space (0.1 is about 10%), so that close fits share the TF
+#  graphs and the saved models, which are keyed by them
+GPR_HYPERPARAM_LOG_STEP = 0.1
+
 #  Max training size in GPR model
 MAX_TRAIN_SIZE = 7000
 
+#  Number of inducing points of the sparse (FITC) approximation used by the
+#  numpy GPR models once a workload has more samples than this. Sparse models
+#  are not limited by MAX_TRAIN_SIZE. None (the default) always uses the
+#  exact model; for very large workloads, set it to (at least) MAX_TRAIN_SIZE
+#  so that only the data the exact model cannot handle is approximated.
+GPR_NUM_INDUCING = None
+
+#  Max number of (target and workload) samples the recommendation model is
+#  fit on. Larger training sets are reduced to a representative subset that
+#  keeps all of the target's samples and the TOP_NUM_CONFIG best ones, with
+#  GPR_CORESET_METHOD: 'kcenter' (greedy k-center, which drops densely
+#  clustered samples first) or 'random'. None fits on all of the samples.
+#  See analysis/benchmarks/coreset_selection.py for the fit time versus
+#  recommendation quality trade-off.
+GPR_CORESET_SIZE = None
+
+GPR_CORESET_METHOD = 'kcenter'
+
+#  Fit and optimize the recommendation model only in a trust region around
+#  the best target configuration so far (see analysis/trust_region.py):
+#  a box whose sides are TRUST_REGION_LENGTH_INIT times the range of each
+#  (continuous) knob. It doubles after TRUST_REGION_SUCCESS_TOL consecutive
+#  target results that improve the best one, halves after
+#  TRUST_REGION_FAILURE_TOL consecutive ones that do not, and restarts once
+#  it is smaller than TRUST_REGION_LENGTH_MIN. The model is fit on the
+#  samples in the region, at least TRUST_REGION_MIN_SAMPLES and at most
+#  TRUST_REGION_MAX_SAMPLES (the closest to the best configuration), so the
+#  compute per recommendation stays bounded as the number of knobs grows.
+TRUST_REGION_ENABLED = False
+
+TRUST_REGION_LENGTH_INIT = 0.8
+
+TRUST_REGION_LENGTH_MIN = 0.5 ** 7
+
+TRUST_REGION_LENGTH_MAX = 1.6
+
+TRUST_REGION_SUCCESS_TOL = 3
+
+TRUST_REGION_FAILURE_TOL = 4
+
+TRUST_REGION_MIN_SAMPLES = 500
+
+TRUST_REGION_MAX_SAMPLES = 1000
+
 #  Batch size in GPR model
 BATCH_SIZE = 3000
 
 # Threads for TensorFlow config
 NUM_THREADS = 4
 
+#  Max number of TensorFlow graphs (and sessions) each worker process keeps
+#  around to be reused across GPR fits
+TF_GRAPH_CACHE_SIZE = 8
+
+#  Solver used to factorize the kernel matrix in GPR models: 'inverse'
+#  (explicit inverse) or 'cholesky' (triangular solves, retried with a
+#  larger diagonal jitter if the factorization fails)
+GPR_SOLVER = 'inverse'
+
+#  Floating point precision of the GPR models ('float32' or 'float64'). The
+#  training data is converted to it once and the kernel, its factorization
+#  and the gradient descent all use it. float32 halves the memory and is
+#  faster, but the inverse of the kernel matrix is less accurate (see
+#  analysis/benchmarks/gpr_precision.py); use 'float64' if the
+#  recommendations are sensitive to it.
+GPR_DTYPE = 'float32'
+
+#  Save the fitted (numpy) GPR models in MODEL_DIR, keyed by pipeline run,
+#  workload and a hash of the model settings and training data, and reuse
+#  them instead of refitting when the same inputs are seen again
+GPR_PERSIST_MODELS = False
+
+#  Address of the model server (analysis/model_server.py, started with
+#  'fab start_model_server'), a unix socket path or a (host, port) tuple.
+#  The server keeps the fitted numpy models in memory across tasks and
+#  worker restarts, and runs the predictions and the search on them. None
+#  fits the models in the celery workers (the tasks also fall back to this
+#  if the server cannot be reached).
+MODEL_SERVER_ADDRESS = None
+
+#  Maximum number of fitted models the model server keeps in memory (the
+#  least recently used ones are evicted)
+MODEL_SERVER_MAX_MODELS = 32
+
+# ---SURROGATE MODEL CONSTANTS---
+#  Model of the workloads' metrics used to map the target workload and to
+#  search for the recommended configurations: 'gp' (the GPR models above),
+#  or a tree ensemble, 'extra_trees' or 'random_forest' (see
+#  analysis/forest.py). Tree ensembles train in O(n log n) time, are not
+#  limited by MAX_TRAIN_SIZE, and search with a random local search rather
+#  than gradient descent.
+SURROGATE_MODEL = 'gp'
+
+#  Number of trees and min number of samples per leaf of the tree ensembles
+FOREST_NUM_TREES = 100
+
+FOREST_MIN_SAMPLES_LEAF = 1
+
+#  Standard deviation of the local search steps of the tree ensembles, as a
+#  fraction of the range (X_max - X_min) of each knob
+FOREST_STEP_SIZE = 0.1
+
 # ---GRADIENT DESCENT CONSTANTS---
 #  the maximum iterations of gradient descent
 MAX_ITER = 500
@@ -54,3 +197,43 @@ DEFAULT_EPSILON = 1e-6
 DEFAULT_SIGMA_MULTIPLIER = 3.0
 
 DEFAULT_MU_MULTIPLIER = 1.0
+
+#  Backend used to run gradient descent: 'tensorflow' (GPRGD) or 'numpy'
+#  (GPRGDNP, closed-form gradients; does not load TensorFlow)
+GD_BACKEND = 'tensorflow'
+
+#  Optimize the starting points one at a time ('serial') or all together
+#  as a single batch ('batched'). Only
+#  used by the 'tensorflow' backend; the 'numpy' backend always batches.
+GD_METHOD = 'serial'
+
+#  Stop optimizing a starting point once the change in its loss is at most
+#  GD_LOSS_TOL, or the norm of its (projected) gradient is at most
+#  GD_GRAD_TOL, for GD_PATIENCE consecutive iterations. None disables the
+#  criterion (by default, every starting point runs for MAX_ITER
+#  iterations).
+GD_LOSS_TOL = None
+
+GD_GRAD_TOL = None
+
+GD_PATIENCE = 10
+
+#  Optimizer of the 'numpy' backend: 'adam' (all starting points together,
+#  DEFAULT_LEARNING_RATE) or 'lbfgs' (L-BFGS-B, one starting point at a
+#  time, usually converging in tens of iterations). MAX_ITER, GD_LOSS_TOL
+#  (relative) and GD_GRAD_TOL also apply to 'lbfgs'.
+GD_OPTIMIZER = 'adam'
+
+#  Number of workers the 'lbfgs' starting points are split among, and
+#  whether they are threads ('thread') or processes ('process'). Processes
+#  cannot be started from daemonic (e.g., celery prefork) workers.
+GD_NUM_JOBS = 1
+
+GD_EXECUTOR = 'thread'
+
+#  Number of random flips of the categorical knobs of each starting point
+#  that are scored together (in one batched evaluation of the model) per
+#  categorical hill climbing step, keeping the best one that lowers the loss
+#  (1 is the single random flip per step; larger values explore more of the
+#  categorical knobs per step)
+GD_CATEGORICAL_CANDIDATES = 1
@@ -5,6 +5,8 @@
 #
 import random
 import queue
+import time
+from functools import lru_cache
 import numpy as np
 
 from celery.task import task, Task
@@ -12,10 +14,15 @@ from celery.utils.log import get_task_logger
 from djcelery.models import TaskMeta
 from sklearn.preprocessing import StandardScaler
 
-from analysis.gp import GPRNP
-from analysis.gp_tf import GPRGD
+from analysis.acquisition import UPPER_CONFIDENCE_BOUND
+from analysis.coreset import select_coreset
+from analysis.forest import ForestNP, ForestSearchNP
+from analysis.gp import GPRNP, GPRGDNP, fit_kernel_hyperparameters
+from analysis.model_server import CONNECTION_ERRORS, ModelClient, run_operation
+from analysis.model_store import ModelStore, model_key
 from analysis.preprocessing import Bin, DummyEncoder
 from analysis.constraints import ParamConstraintHelper
+from analysis.trust_region import TrustRegion, select_local_samples
 from website.models import PipelineData, PipelineRun, Result, Workload, KnobCatalog, MetricCatalog
 from website.parser import Parser
 from website.types import PipelineTaskType
@@ -24,14 +31,45 @@ from website.settings import IMPORTANT_KNOB_NUMBER, NUM_SAMPLES, TOP_NUM_CONFIG
 from website.settings import (DEFAULT_LENGTH_SCALE, DEFAULT_MAGNITUDE,
                               MAX_TRAIN_SIZE, BATCH_SIZE, NUM_THREADS,
                               DEFAULT_RIDGE, DEFAULT_LEARNING_RATE,
-                              DEFAULT_EPSILON, MAX_ITER, GPR_EPS,
-                              DEFAULT_SIGMA_MULTIPLIER, DEFAULT_MU_MULTIPLIER)
+                              DEFAULT_EPSILON, MAX_ITER, GPR_EPS, GPR_SOLVER,
+                              DEFAULT_SIGMA_MULTIPLIER, DEFAULT_MU_MULTIPLIER,
+                              GD_METHOD, GD_LOSS_TOL, GD_GRAD_TOL, GD_PATIENCE,
+                              GD_BACKEND, TF_GRAPH_CACHE_SIZE, GPR_NUM_INDUCING,
+                              GPR_FIT_HYPERPARAMS, GPR_HYPERPARAM_MAX_SAMPLES,
+                              GPR_HYPERPARAM_LOG_STEP, RECOMMENDATION_BATCH_SIZE,
+                              RECOMMENDATION_BATCH_METHOD, GPR_DTYPE,
+                              GPR_PERSIST_MODELS, MODEL_DIR, GD_OPTIMIZER,
+                              GD_NUM_JOBS, GD_EXECUTOR, GD_CATEGORICAL_CANDIDATES,
+                              NUM_SCREENED_CANDIDATES,
+                              NUM_SCREENED_SAMPLES, SCREENING_CHUNK_SIZE,
+                              SURROGATE_MODEL, FOREST_NUM_TREES,
+                              FOREST_MIN_SAMPLES_LEAF, FOREST_STEP_SIZE,
+                              GPR_CORESET_SIZE, GPR_CORESET_METHOD, GPR_KERNEL,
+                              TRUST_REGION_ENABLED, TRUST_REGION_LENGTH_INIT,
+                              TRUST_REGION_LENGTH_MIN, TRUST_REGION_LENGTH_MAX,
+                              TRUST_REGION_SUCCESS_TOL, TRUST_REGION_FAILURE_TOL,
+                              TRUST_REGION_MIN_SAMPLES, TRUST_REGION_MAX_SAMPLES,
+                              MODEL_SERVER_ADDRESS, SECRET_KEY)
 from website.settings import INIT_FLIP_PROB, FLIP_PROB_DECAY
 from website.types import VarType
 
 LOG = get_task_logger(__name__)
 
 
+@lru_cache(maxsize=None)
+def get_model_store():
+    # Store of the fitted GPR models (see fit_model_helper), created on first
+    # use rather than when the tasks are imported
+    return ModelStore(MODEL_DIR)
+
+
+@lru_cache(maxsize=None)
+def get_model_client():
+    # Client of the model server (see model_runner_helper), created on first
+    # use rather than when the tasks are imported
+    return ModelClient(MODEL_SERVER_ADDRESS, authkey=SECRET_KEY.encode('utf-8'))
+
+
 class UpdateTask(Task):  # pylint: disable=abstract-method
 
     def __init__(self):
@@ -84,12 +122,19 @@ class ConfigurationRecommendation(UpdateTask):  # pylint: disable=abstract-metho
         formatted_params = Parser.format_dbms_knobs(result.dbms.pk, retval['recommendation'])
         task_meta = TaskMeta.objects.get(task_id=task_id)
         retval['recommendation'] = formatted_params
+        if 'recommendations' in retval:
+            retval['recommendations'] = [Parser.format_dbms_knobs(result.dbms.pk, conf)
+                                         for conf in retval['recommendations']]
         task_meta.result = retval
         task_meta.save()
 
-        # Create next configuration to try
+        # Create next configuration to try. With batch recommendations, the
+        # other configurations are downloaded together with it.
         config = Parser.create_knob_configuration(result.dbms.pk, retval['recommendation'])
         retval['recommendation'] = config
+        if 'recommendations' in retval:
+            retval['recommendations'] = [Parser.create_knob_configuration(result.dbms.pk, conf)
+                                         for conf in retval['recommendations']]
         result.next_configuration = JSONUtil.dumps(retval)
         result.save()
 
@@ -126,6 +171,8 @@ def aggregate_target_results(result_id):
     agg_data = DataUtil.aggregate_data(target_results)
     agg_data['newest_result_id'] = result_id
     agg_data['bad'] = False
+    # The session's recommendation deadline counts from here
+    agg_data['start_time'] = time.time()
     return agg_data
 
 
@@ -193,6 +240,11 @@ def configuration_recommendation(target_data):
 
     # Target workload data
     newest_result = Result.objects.get(pk=target_data['newest_result_id'])
+    # If the session has a deadline, the search returns the best
+    # configurations found so far once it has passed
+    start_time = target_data.get('start_time', time.time())
+    time_budget = newest_result.session.recommendation_deadline
+    deadline = start_time + time_budget if time_budget is not None else None
     X_target = target_data['X_matrix']
     y_target = target_data['y_matrix']
     rowlabels_target = np.array(target_data['rowlabels'])
@@ -237,11 +289,28 @@ def configuration_recommendation(target_data):
     y_target = y_target[:, target_obj_idx]
     y_columnlabels = y_columnlabels[target_obj_idx]
 
+    if TRUST_REGION_ENABLED:
+        # The trust region is rebuilt by replaying the target's results in
+        # the order they were observed (the rowlabels are the result ids)
+        y_history = y_target[np.argsort(rowlabels_target, kind='mergesort'), 0]
+        if not lessisbetter:
+            y_history = -y_history
+        trust_region = TrustRegion(length_init=TRUST_REGION_LENGTH_INIT,
+                                   length_min=TRUST_REGION_LENGTH_MIN,
+                                   length_max=TRUST_REGION_LENGTH_MAX,
+                                   success_tolerance=TRUST_REGION_SUCCESS_TOL,
+                                   failure_tolerance=TRUST_REGION_FAILURE_TOL)
+        trust_region.fit_history(y_history)
+
     # Combine duplicate rows in the target/workload data (separately)
     X_workload, y_workload, rowlabels_workload = DataUtil.combine_duplicate_rows(
         X_workload, y_workload, rowlabels_workload)
     X_target, y_target, rowlabels_target = DataUtil.combine_duplicate_rows(
         X_target, y_target, rowlabels_target)
+    # Convert the metrics to the precision of the GPR model once; the
+    # scalers preserve it
+    y_workload = y_workload.astype(GPR_DTYPE, copy=False)
+    y_target = y_target.astype(GPR_DTYPE, copy=False)
 
     # Delete any rows that appear in both the workload data and the target
     # data from the workload data
@@ -264,7 +333,7 @@ def configuration_recommendation(target_data):
                                  categorical_info['categorical_features'],
                                  categorical_info['cat_columnlabels'],
                                  categorical_info['noncat_columnlabels'])
-    X_matrix = dummy_encoder.fit_transform(X_matrix)
+    X_matrix = dummy_encoder.fit_transform(X_matrix).astype(GPR_DTYPE, copy=False)
 
     # below two variables are needed for correctly determing max/min on dummies
     binary_index_set = set(categorical_info['binary_vars'])
@@ -374,24 +443,67 @@ def configuration_recommendation(target_data):
         except queue.Empty:
             break
 
-    model = GPRGD(length_scale=DEFAULT_LENGTH_SCALE,
-                  magnitude=DEFAULT_MAGNITUDE,
-                  max_train_size=MAX_TRAIN_SIZE,
-                  batch_size=BATCH_SIZE,
-                  num_threads=NUM_THREADS,
-                  learning_rate=DEFAULT_LEARNING_RATE,
-                  epsilon=DEFAULT_EPSILON,
-                  max_iter=MAX_ITER,
-                  sigma_multiplier=DEFAULT_SIGMA_MULTIPLIER,
-                  mu_multiplier=DEFAULT_MU_MULTIPLIER)
-    model.fit(X_scaled, y_scaled, X_min, X_max, ridge=DEFAULT_RIDGE)
-    res = model.predict(X_samples, constraint_helper=constraint_helper)
-
-    best_config_idx = np.argmin(res.minl.ravel())
-    best_config = res.minl_conf[best_config_idx, :]
-    best_config = X_scaler.inverse_transform(best_config)
+    # The target's rows are the first rows of X_scaled
+    num_target_rows = X_target.shape[0]
+    if TRUST_REGION_ENABLED:
+        # Only fit the model on, and search, the region around the best
+        # target configuration. The categorical and binary knobs are left
+        # unrestricted (they are changed by the hill climbing).
+        x_center = X_scaled[np.argmin(y_scaled[:num_target_rows, 0])]
+        local_dims = np.array([i >= total_dummies and i not in binary_index_set
+                               for i in range(X_scaled.shape[1])])
+        X_min, X_max = trust_region.bounds(x_center, X_min, X_max, local_dims)
+        local_idxs = select_local_samples(X_scaled, x_center, X_min, X_max,
+                                          min_samples=TRUST_REGION_MIN_SAMPLES,
+                                          max_samples=TRUST_REGION_MAX_SAMPLES)
+        LOG.info("Fitting the model on %d of %d samples in the trust region (%s)",
+                 local_idxs.shape[0], X_scaled.shape[0], str(trust_region))
+        X_scaled = X_scaled[local_idxs]
+        y_scaled = y_scaled[local_idxs]
+        num_target_rows = np.count_nonzero(local_idxs < num_target_rows)
+        X_random = np.random.rand(num_samples, X_scaled.shape[1]) * (X_max - X_min) + X_min
+        X_samples = np.vstack((X_random, np.clip(X_samples[num_samples:], X_min, X_max)))
+
+    if GPR_CORESET_SIZE is not None and X_scaled.shape[0] > GPR_CORESET_SIZE:
+        # Fit the model on a representative subset of the samples that
+        # includes all of the target's rows and the best rows overall
+        best_idxs = np.argsort(y_scaled[:, 0], kind='mergesort')[:TOP_NUM_CONFIG]
+        keep_idxs = np.union1d(np.arange(num_target_rows), best_idxs)
+        coreset_idxs = select_coreset(X_scaled, GPR_CORESET_SIZE, keep_idxs,
+                                      method=GPR_CORESET_METHOD)
+        LOG.info("Selected %d of %d samples to fit the model (%s)",
+                 coreset_idxs.shape[0], X_scaled.shape[0], GPR_CORESET_METHOD)
+        X_scaled = X_scaled[coreset_idxs]
+        y_scaled = y_scaled[coreset_idxs]
+    length_scale, magnitude = fit_kernel_params_helper(X_scaled, y_scaled)
+    model = create_search_model_helper(length_scale, magnitude)
+    run_model = model_runner_helper(model, latest_pipeline_run, mapped_workload,
+                                    (X_scaled, y_scaled, X_min, X_max), DEFAULT_RIDGE)
+    if NUM_SCREENED_CANDIDATES > 0:
+        # Add the best of many quasi-random candidates (by the upper
+        # confidence bound, which ranks them the same as the gradient
+        # descent loss) to the starting points
+        X_screened, _ = run_model(
+            'screen_halton', NUM_SCREENED_CANDIDATES, X_min, X_max, NUM_SCREENED_SAMPLES,
+            chunk_size=SCREENING_CHUNK_SIZE, acquisition=UPPER_CONFIDENCE_BOUND,
+            beta=DEFAULT_SIGMA_MULTIPLIER / DEFAULT_MU_MULTIPLIER, deadline=deadline)
+        X_samples = np.vstack((X_samples, X_screened))
+    # Select RECOMMENDATION_BATCH_SIZE configurations (best first) so that
+    # they can be benchmarked in parallel. Each one after the first is
+    # selected after fantasizing an observation at the previous ones.
+    best_configs, results = run_model('select_batch', X_samples, RECOMMENDATION_BATCH_SIZE,
+                                      method=RECOMMENDATION_BATCH_METHOD,
+                                      ridge=DEFAULT_RIDGE,
+                                      constraint_helper=constraint_helper,
+                                      categorical_feature_candidates=GD_CATEGORICAL_CANDIDATES,
+                                      deadline=deadline)
+    for res in results:
+        LOG.info('GPRGD iterations per starting point: mean=%.1f, max=%d (max_iter=%d)',
+                 np.mean(res.n_iters), np.max(res.n_iters), MAX_ITER)
+
+    best_configs = X_scaler.inverse_transform(best_configs)
     # Decode one-hot encoding into categorical knobs
-    best_config = dummy_encoder.inverse_transform(best_config)
+    best_configs = dummy_encoder.inverse_transform(best_configs)
 
     # Although we have max/min limits in the GPRGD training session, it may
     # lose some precisions. e.g. 0.99..99 >= 1.0 may be True on the scaled data,
@@ -400,14 +512,23 @@ def configuration_recommendation(target_data):
     # directly, and make sure the recommended config lies within the range
     X_min_inv = X_scaler.inverse_transform(X_min)
     X_max_inv = X_scaler.inverse_transform(X_max)
-    best_config = np.minimum(best_config, X_max_inv)
-    best_config = np.maximum(best_config, X_min_inv)
+    best_configs = np.minimum(best_configs, X_max_inv)
+    best_configs = np.maximum(best_configs, X_min_inv)
 
-    conf_map = {k: best_config[i] for i, k in enumerate(X_columnlabels)}
+    conf_maps = [{k: best_config[i] for i, k in enumerate(X_columnlabels)}
+                 for best_config in best_configs]
     conf_map_res = {}
     conf_map_res['status'] = 'good'
-    conf_map_res['recommendation'] = conf_map
+    conf_map_res['recommendation'] = conf_maps[0]
+    if RECOMMENDATION_BATCH_SIZE > 1:
+        conf_map_res['recommendations'] = conf_maps
     conf_map_res['info'] = 'INFO: training data size is {}'.format(X_scaled.shape[0])
+    if time_budget is not None:
+        elapsed = time.time() - start_time
+        conf_map_res['info'] += ', used {:.1f}s of the {:.1f}s deadline ({:.0f}%){}'.format(
+            elapsed, time_budget, 100.0 * elapsed / max(time_budget, 1e-9),
+            ', search stopped early' if elapsed >= time_budget else '')
+        LOG.info("Recommendation took %.1fs (deadline: %.1fs)", elapsed, time_budget)
     return conf_map_res
 
 
@@ -418,6 +539,159 @@ def load_data_helper(filtered_pipeline_data, workload, task_type):
     return JSONUtil.loads(pipeline_data.data)
 
 
+def create_search_model_helper(length_scale, magnitude):
+    # Returns the (unfitted) model that searches for the best configurations
+    # of the mapped workload, as selected by SURROGATE_MODEL and GD_BACKEND.
+    # The kernel parameters are only used by the GPR models.
+    if SURROGATE_MODEL in (ForestNP.EXTRA_TREES, ForestNP.RANDOM_FOREST):
+        return ForestSearchNP(ensemble=SURROGATE_MODEL,
+                              n_estimators=FOREST_NUM_TREES,
+                              min_samples_leaf=FOREST_MIN_SAMPLES_LEAF,
+                              batch_size=BATCH_SIZE,
+                              max_iter=MAX_ITER,
+                              step_size=FOREST_STEP_SIZE,
+                              patience=GD_PATIENCE,
+                              sigma_multiplier=DEFAULT_SIGMA_MULTIPLIER,
+                              mu_multiplier=DEFAULT_MU_MULTIPLIER)
+    if SURROGATE_MODEL != 'gp':
+        raise Exception("Unknown surrogate model: {}".format(SURROGATE_MODEL))
+    if GD_BACKEND == 'numpy':
+        model = GPRGDNP(length_scale=length_scale,
+                        magnitude=magnitude,
+                        max_train_size=MAX_TRAIN_SIZE,
+                        batch_size=BATCH_SIZE,
+                        learning_rate=DEFAULT_LEARNING_RATE,
+                        epsilon=DEFAULT_EPSILON,
+                        max_iter=MAX_ITER,
+                        sigma_multiplier=DEFAULT_SIGMA_MULTIPLIER,
+                        mu_multiplier=DEFAULT_MU_MULTIPLIER,
+                        solver=GPR_SOLVER,
+                        loss_tol=GD_LOSS_TOL,
+                        grad_tol=GD_GRAD_TOL,
+                        patience=GD_PATIENCE,
+                        num_inducing=GPR_NUM_INDUCING,
+                        dtype=GPR_DTYPE,
+                        kernel_type=GPR_KERNEL,
+                        optimizer=GD_OPTIMIZER,
+                        n_jobs=GD_NUM_JOBS,
+                        executor=GD_EXECUTOR)
+    elif GD_BACKEND == 'tensorflow':
+        # Only load TensorFlow when it is actually used
+        from analysis.gp_tf import GPRGD
+        from analysis.graph_cache import GRAPH_CACHE
+        GRAPH_CACHE.resize(TF_GRAPH_CACHE_SIZE)
+        model = GPRGD(length_scale=length_scale,
+                      magnitude=magnitude,
+                      max_train_size=MAX_TRAIN_SIZE,
+                      batch_size=BATCH_SIZE,
+                      num_threads=NUM_THREADS,
+                      learning_rate=DEFAULT_LEARNING_RATE,
+                      epsilon=DEFAULT_EPSILON,
+                      max_iter=MAX_ITER,
+                      sigma_multiplier=DEFAULT_SIGMA_MULTIPLIER,
+                      mu_multiplier=DEFAULT_MU_MULTIPLIER,
+                      solver=GPR_SOLVER,
+                      gd_method=GD_METHOD,
+                      loss_tol=GD_LOSS_TOL,
+                      grad_tol=GD_GRAD_TOL,
+                      patience=GD_PATIENCE,
+                      dtype=GPR_DTYPE,
+                      kernel_type=GPR_KERNEL)
+    else:
+        raise Exception("Unknown gradient descent backend: {}".format(GD_BACKEND))
+    return model
+
+
+def create_regression_model_helper(length_scale, magnitude):
+    # Returns the (unfitted) model that predicts the metrics of a workload,
+    # as selected by SURROGATE_MODEL. The kernel parameters are only used by
+    # the GPR model.
+    if SURROGATE_MODEL in (ForestNP.EXTRA_TREES, ForestNP.RANDOM_FOREST):
+        return ForestNP(ensemble=SURROGATE_MODEL,
+                        n_estimators=FOREST_NUM_TREES,
+                        min_samples_leaf=FOREST_MIN_SAMPLES_LEAF,
+                        batch_size=BATCH_SIZE)
+    if SURROGATE_MODEL != 'gp':
+        raise Exception("Unknown surrogate model: {}".format(SURROGATE_MODEL))
+    return GPRNP(length_scale=length_scale,
+                 magnitude=magnitude,
+                 max_train_size=MAX_TRAIN_SIZE,
+                 batch_size=BATCH_SIZE,
+                 solver=GPR_SOLVER,
+                 num_inducing=GPR_NUM_INDUCING,
+                 dtype=GPR_DTYPE,
+                 kernel_type=GPR_KERNEL)
+
+
+def fit_model_helper(model, pipeline_run, workload, fit_args, ridge):
+    # Fits the model with model.fit(*fit_args, ridge=ridge) and returns it.
+    # If GPR_PERSIST_MODELS is set, the fitted (numpy) model is saved, and a
+    # model that was already fit with the same settings on the same inputs
+    # is loaded instead of being refit.
+    if not GPR_PERSIST_MODELS or not isinstance(model, GPRNP):
+        return model.fit(*fit_args, ridge=ridge)
+    key = model_key(model, fit_args, ridge)
+    workload_id = getattr(workload, 'pk', workload)
+    fitted_model = get_model_store().load(pipeline_run.pk, workload_id, key)
+    if fitted_model is not None:
+        LOG.info("Loaded the fitted model (%s, %s, %s)", pipeline_run.pk, workload_id, key)
+        return fitted_model
+    model.fit(*fit_args, ridge=ridge)
+    get_model_store().save(pipeline_run.pk, workload_id, key, model)
+    return model
+
+
+def model_runner_helper(model, pipeline_run, workload, fit_args, ridge):
+    # Returns run(operation, *args, **kwargs), which runs an operation of
+    # analysis/model_server.py (e.g., 'predict' or 'select_batch') on the
+    # model fit with fit_model_helper's arguments. If MODEL_SERVER_ADDRESS
+    # is set, the (numpy) models are fit and kept by the model server, so a
+    # model is only fit once across tasks and workers. If the server cannot
+    # be reached, the model is fit here (once) instead.
+    workload_id = getattr(workload, 'pk', workload)
+    fitted_model = []
+
+    def run_locally(operation, *args, **kwargs):
+        if not fitted_model:
+            fitted_model.append(fit_model_helper(model, pipeline_run, workload_id,
+                                                 fit_args, ridge))
+        return run_operation(fitted_model[0], operation, *args, **kwargs)
+
+    if MODEL_SERVER_ADDRESS is None or not isinstance(model, (GPRNP, ForestNP)):
+        return run_locally
+
+    key = (pipeline_run.pk, workload_id, model_key(model, fit_args, ridge))
+
+    def run(operation, *args, **kwargs):
+        try:
+            return get_model_client().call(key, operation, args=args, kwargs=kwargs,
+                                           model=model, fit_args=fit_args, ridge=ridge)
+        except CONNECTION_ERRORS as ex:
+            LOG.warning("Model server %s unavailable (%s), fitting the model locally",
+                        str(MODEL_SERVER_ADDRESS), ex)
+            return run_locally(operation, *args, **kwargs)
+
+    return run
+
+
+def fit_kernel_params_helper(X_scaled, y_scaled):
+    # Returns the (length_scale, magnitude) of the GPR kernel: fit to the
+    # (scaled) data the model is trained on if GPR_FIT_HYPERPARAMS is set,
+    # and the defaults otherwise. The fitted values are rounded (see
+    # GPR_HYPERPARAM_LOG_STEP) so that they rarely split the graph cache and
+    # the model store.
+    if not GPR_FIT_HYPERPARAMS or SURROGATE_MODEL != 'gp':
+        return DEFAULT_LENGTH_SCALE, DEFAULT_MAGNITUDE
+    kernel_params = fit_kernel_hyperparameters(X_scaled, y_scaled, ridge=DEFAULT_RIDGE,
+                                               length_scale=DEFAULT_LENGTH_SCALE,
+                                               magnitude=DEFAULT_MAGNITUDE,
+                                               max_samples=GPR_HYPERPARAM_MAX_SAMPLES,
+                                               kernel_type=GPR_KERNEL,
+                                               log_step=GPR_HYPERPARAM_LOG_STEP)
+    LOG.debug("KERNEL PARAMS: %s", str(kernel_params))
+    return kernel_params['length_scale'], kernel_params['magnitude']
+
+
 @task(base=MapWorkload, name='map_workload')
 def map_workload(target_data):
     # Get the latest version of pipeline data that's been computed so far.
@@ -496,8 +770,8 @@ def map_workload(target_data):
             X_matrix, y_matrix, rowlabels)
 
         workload_data[unique_workload] = {
-            'X_matrix': X_matrix,
-            'y_matrix': y_matrix,
+            'X_matrix': X_matrix.astype(GPR_DTYPE, copy=False),
+            'y_matrix': y_matrix.astype(GPR_DTYPE, copy=False),
             'rowlabels': rowlabels,
         }
 
@@ -518,8 +792,8 @@ def map_workload(target_data):
     del ys
 
     # Filter the target's X & y data by the ranked knobs & pruned metrics.
-    X_target = target_data['X_matrix'][:, ranked_knob_idxs]
-    y_target = target_data['y_matrix'][:, pruned_metric_idxs]
+    X_target = target_data['X_matrix'][:, ranked_knob_idxs].astype(GPR_DTYPE, copy=False)
+    y_target = target_data['y_matrix'][:, pruned_metric_idxs].astype(GPR_DTYPE, copy=False)
 
     # Now standardize the target's data and bin it by the deciles we just
     # calculated
@@ -529,22 +803,20 @@ def map_workload(target_data):
 
     scores = {}
     for workload_id, workload_entry in list(workload_data.items()):
-        predictions = np.empty_like(y_target)
         X_workload = workload_entry['X_matrix']
         X_scaled = X_scaler.transform(X_workload)
         y_workload = workload_entry['y_matrix']
         y_scaled = y_scaler.transform(y_workload)
-        for j, y_col in enumerate(y_scaled.T):
-            # Using this workload's data, train a Gaussian process model
-            # and then predict the performance of each metric for each of
-            # the knob configurations attempted so far by the target.
-            y_col = y_col.reshape(-1, 1)
-            model = GPRNP(length_scale=DEFAULT_LENGTH_SCALE,
-                          magnitude=DEFAULT_MAGNITUDE,
-                          max_train_size=MAX_TRAIN_SIZE,
-                          batch_size=BATCH_SIZE)
-            model.fit(X_scaled, y_col, ridge=DEFAULT_RIDGE)
-            predictions[:, j] = model.predict(X_target).ypreds.ravel()
+        # Using this workload's data, train a model (a Gaussian process by
+        # default) and then predict the performance of each metric for each
+        # of the knob configurations attempted so far by the target. All of
+        # the metrics share the same GPR kernel, so it is only factorized
+        # once per workload.
+        length_scale, magnitude = fit_kernel_params_helper(X_scaled, y_scaled)
+        model = create_regression_model_helper(length_scale, magnitude)
+        run_model = model_runner_helper(model, latest_pipeline_run, workload_id,
+                                        (X_scaled, y_scaled), DEFAULT_RIDGE)
+        predictions = run_model('predict', X_target, acquisitions=()).ypreds
         # Bin each of the predicted metric columns by deciles and then
         # compute the score (i.e., distance) between the target workload
         # and each of the known workloads
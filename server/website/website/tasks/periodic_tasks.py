@@ -14,10 +14,13 @@ from sklearn.preprocessing import StandardScaler
 from analysis.cluster import KMeansClusters, create_kselection_model
 from analysis.factor_analysis import FactorAnalysis
 from analysis.lasso import LassoPath
+from analysis.model_store import ModelStore
 from analysis.preprocessing import (Bin, get_shuffle_indices,
                                     DummyEncoder,
                                     consolidate_columnlabels)
 from website.models import PipelineData, PipelineRun, Result, Workload
+from website.settings import (GPR_PERSIST_MODELS, MODEL_DIR,  # pylint: disable=no-name-in-module
+                              GAP_STATISTIC_NUM_JOBS, GAP_STATISTIC_RANDOM_STATE)
 from website.types import PipelineTaskType
 from website.utils import DataUtil, JSONUtil
 
@@ -112,6 +115,10 @@ def run_background_tasks():
     pipeline_run_obj.end_time = now()
     pipeline_run_obj.save()
 
+    if GPR_PERSIST_MODELS:
+        # The models fit on the data of older pipeline runs are not used again
+        ModelStore(MODEL_DIR).prune([pipeline_run_obj.pk])
+
 
 def aggregate_data(wkld_results):
     # Aggregates both the knob & metric data for the given workload.
@@ -206,7 +213,8 @@ def run_workload_characterization(metric_data):
 
     # Compute optimal # clusters, k, using gap statistics
     gapk = create_kselection_model("gap-statistic")
-    gapk.fit(components, kmeans_models.cluster_map_)
+    gapk.fit(components, kmeans_models.cluster_map_, n_jobs=GAP_STATISTIC_NUM_JOBS,
+             random_state=GAP_STATISTIC_RANDOM_STATE)
 
     # Get pruned metrics, cloest samples of each cluster center
     pruned_metrics = kmeans_models.cluster_map_[gapk.optimal_num_clusters_].get_closest_samples()